@@ -1,5 +1,7 @@
 module.exports = {
   PYTHON_PATH: process.env.PYTHON_PATH || 'python3', // Default to 'python3' if not set
+  // 'queue' hands work to the long-lived pages/worker.py; 'spawn' starts a Python process per request
+  PYTHON_WORKER_MODE: process.env.PYTHON_WORKER_MODE || 'spawn',
   UPLOAD_LIMIT: process.env.UPLOAD_LIMIT || '10mb',
   ALLOWED_SUBJECTS: ['python', 'java', 'cpp', 'c', 'mixed'],
   JWT_SECRET: process.env.JWT_SECRET || 'your-secret-key'
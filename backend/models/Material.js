@@ -49,6 +49,14 @@ const materialSchema = new mongoose.Schema({
   },
   error: {
     type: String,
+  },
+  // Per-stage checkpoints written by auto_pipeline.py; used to resume failed runs
+  pipeline: {
+    type: mongoose.Schema.Types.Mixed,
+  },
+  // Per-stage durations of the last pipeline run, for diagnosing slow uploads
+  stage_timings: {
+    type: mongoose.Schema.Types.Mixed,
   }
 });
 
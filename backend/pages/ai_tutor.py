@@ -2,32 +2,54 @@ import sys
 import os
 import json
 import time
-from ollama import Client
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_client import get_client, MODEL
 from db import db
 from bson import ObjectId
+from explanation_cache import get_explanation_cache, explanation_key
+from artifact_cache import hash_bytes
+from metrics import span, inc, in_current_trace
+import vector_index
 
-try:
-    client = Client(host='http://localhost:11434')
-except Exception as e:
-    print(f"Failed to connect to Ollama: {e}", file=sys.stderr)
-    sys.exit(1)
+# Bump when the prompt changes so cached explanations from the old prompt are not reused
+PROMPT_VERSION = 1
 
-def load_data_from_db(material_id, user_answers_path):
+TUTOR_EXPLANATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tutor_explanations")
+
+# Passages from the material's vector index added to each prompt. Bounded so
+# long materials do not grow the prompt; 0 passages turns grounding off.
+GROUNDING_PASSAGES = int(os.getenv("TUTOR_GROUNDING_PASSAGES", "3"))
+GROUNDING_MAX_CHARS = int(os.getenv("TUTOR_GROUNDING_CHARS", "1500"))
+
+def load_material(material_id, bank_question_ids=None):
     material = db.materials.find_one({"_id": ObjectId(material_id)})
     if not material:
         raise ValueError(f"Material with ID {material_id} not found in the database.")
-    
+
+    if bank_question_ids:
+        # A quiz drawn from the bank: answers index the drawn questions, not quiz_content
+        import question_bank
+        return material, question_bank.bank_questions(db.db, bank_question_ids)
     quiz_data = material.get('quiz_content')
     if not quiz_data:
         raise ValueError(f"Quiz content not found in material {material_id}.")
+    return material, quiz_data
 
+def load_data_from_db(material_id, user_answers_path):
     with open(user_answers_path, 'r', encoding='utf-8') as f:
         user_answers_data = json.load(f)
-    
+
+    material, quiz_data = load_material(material_id, user_answers_data.get('bank_question_ids'))
+
     user_answers = user_answers_data.get('answers', [])
     return material, quiz_data, user_answers
 
-def explain_wrong_answers(quiz_data, user_answers):
+# Explanations are independent, so several are generated at once. Kept
+# small because they all share the one local model.
+TUTOR_MAX_CONCURRENCY = int(os.getenv("TUTOR_MAX_CONCURRENCY", "4"))
+
+def collect_wrong_questions(quiz_data, user_answers):
     wrong_questions = []
     for user_ans_obj in user_answers:
         if not user_ans_obj.get('isCorrect', False):
@@ -41,14 +63,49 @@ def explain_wrong_answers(quiz_data, user_answers):
                     "correct_answer": q["answer"],
                     "options": q["options"]
                 })
+    return wrong_questions
+
+def retrieve_passages(index, questions):
+    """Most relevant passages per question text, trimmed to GROUNDING_MAX_CHARS in total.
+    Returns {question text: [passage, ...]}; empty when there is no index or retrieval fails."""
+    if index is None or GROUNDING_PASSAGES <= 0:
+        return {}
+    # One query per distinct question: the question plus its correct option
+    queries = {}
+    for q in questions:
+        queries.setdefault(q["question"], f"{q['question']} {q['options'].get(q['correct_answer'], '')}")
+    texts = list(queries)
+    try:
+        results = index.search_text(list(queries.values()), GROUNDING_PASSAGES)
+    except Exception as e:
+        print(f"Passage retrieval failed, explaining without the material: {e}", file=sys.stderr)
+        return {}
+
+    grounding = {}
+    for text, hits in zip(texts, results):
+        passages, budget = [], GROUNDING_MAX_CHARS
+        for _, passage in hits:
+            if budget <= 0:
+                break
+            passages.append({"page": passage["page"], "text": passage["text"][:budget]})
+            budget -= len(passages[-1]["text"])
+        grounding[text] = passages
+    return grounding
+
+def build_explanation_prompt(q, passages=()):
+    correct_answer_text = q['options'].get(q['correct_answer'], 'Unknown')
+    user_answer_text = q['options'].get(q['user_answer'], 'No answer provided')
+
+    material = ""
+    if passages:
+        excerpts = "\n\n".join(f"(page {p['page']}) {p['text']}" for p in passages)
+        material = f"""Relevant excerpts from the course material:
+{excerpts}
 
-    explanations = []
-    for q in wrong_questions:
-        correct_answer_text = q['options'].get(q['correct_answer'], 'Unknown')
-        user_answer_text = q['options'].get(q['user_answer'], 'No answer provided')
-        
-        prompt = f"""You are an AI tutor. A student got this question wrong.
-Question: {q['question']}
+"""
+
+    return f"""You are an AI tutor. A student got this question wrong.
+{material}Question: {q['question']}
 Options:
 A) {q['options']['A']}
 B) {q['options']['B']}
@@ -58,17 +115,81 @@ D) {q['options']['D']}
 Student's Answer: {q['user_answer']}) {user_answer_text}
 Correct Answer: {q['correct_answer']}) {correct_answer_text}
 
-Provide a clear explanation for why the correct answer is right and the student's answer is wrong. Do not use Markdown, asterisks, or any other formatting characters. Your entire response must be in plain text."""
-        
-        try:
-            response = client.chat(model="gemma3", messages=[{"role": "user", "content": prompt}])
-            q["explanation"] = response["message"]["content"].strip()
-            explanations.append(q)
-        except Exception as e:
-            print(f"Error generating explanation for question {q['index']}: {e}", file=sys.stderr)
-            q["explanation"] = "An error occurred while generating the explanation."
-            explanations.append(q)
-    return explanations
+Provide a clear explanation for why the correct answer is right and the student's answer is wrong.{" Base it on the excerpts above." if passages else ""} Do not use Markdown, asterisks, or any other formatting characters. Your entire response must be in plain text."""
+
+def question_cache_key(q, passages=()):
+    prompt_version = PROMPT_VERSION
+    if passages:
+        # Grounded prompts differ with the excerpts, so they are cached apart
+        prompt_version = f"{PROMPT_VERSION}:{hash_bytes(json.dumps(passages, ensure_ascii=False).encode('utf-8'))[:16]}"
+    return explanation_key(q["question"], q["options"], q["user_answer"], q["correct_answer"], prompt_version, MODEL)
+
+def explain_question(q, passages=(), lookup=True):
+    # Every student who picks the same wrong option gets the same explanation.
+    # lookup=False is for callers that already know the key is missing.
+    cache = get_explanation_cache()
+    key = question_cache_key(q, passages)
+    if passages:
+        q["source_pages"] = sorted({p["page"] for p in passages if p["page"] is not None})
+    cached = cache.get(key) if lookup else None
+    inc("explanation_cache_total", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        q["explanation"] = cached
+        return q
+
+    try:
+        response = get_client().chat(model=MODEL, messages=[{"role": "user", "content": build_explanation_prompt(q, passages)}])
+        q["explanation"] = response["message"]["content"].strip()
+        cache.put(key, q["explanation"])
+    except Exception as e:
+        print(f"Error generating explanation for question {q['index']}: {e}", file=sys.stderr)
+        q["explanation"] = "An error occurred while generating the explanation."
+    return q
+
+def explain_wrong_answers(quiz_data, user_answers, max_concurrency=TUTOR_MAX_CONCURRENCY, on_explanation=None, index=None):
+    """Explain every wrong answer concurrently; on_explanation(q) is called as each one finishes.
+    With a vector index, each prompt also carries the most relevant passages of the material."""
+    wrong_questions = collect_wrong_questions(quiz_data, user_answers)
+    if not wrong_questions:
+        return []
+
+    grounding = retrieve_passages(index, wrong_questions)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(wrong_questions)))) as pool:
+        explain = in_current_trace(explain_question)
+        futures = [pool.submit(explain, q, grounding.get(q["question"], ())) for q in wrong_questions]
+        for future in as_completed(futures):
+            if on_explanation:
+                on_explanation(future.result())
+
+    # The final file keeps question order regardless of which finished first
+    return [future.result() for future in futures]
+
+def prewarm_explanations(quiz_data, max_concurrency=TUTOR_MAX_CONCURRENCY, index=None):
+    """Generate and cache an explanation for every distractor of a quiz ahead of any student"""
+    cache = get_explanation_cache()
+    questions = [{"question": q["question"], "options": q["options"], "correct_answer": q["answer"]} for q in quiz_data]
+    grounding = retrieve_passages(index, questions)
+    candidates = {}
+    for q_index, q in enumerate(quiz_data):
+        for option in q["options"]:
+            if option == q["answer"]:
+                continue
+            wrong = {
+                "index": q_index + 1,
+                "question": q["question"],
+                "user_answer": option,
+                "correct_answer": q["answer"],
+                "options": q["options"]
+            }
+            passages = grounding.get(q["question"], ())
+            candidates[question_cache_key(wrong, passages)] = (wrong, passages)
+
+    # One query for the whole quiz; the misses are generated without a second lookup
+    pending = [candidates[key] for key in cache.missing(candidates)]
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as pool:
+            list(pool.map(lambda item: explain_question(*item, lookup=False), pending))
+    return {"generated": len(pending), "questions": len(quiz_data)}
 
 def main():
     # Corrected check for 5 arguments: script name, material_id, answers_path, attempt_id, user_id
@@ -91,25 +212,50 @@ def main():
         print(f"Error loading data: {e}", file=sys.stderr)
         sys.exit(1)
 
-    explanations = explain_wrong_answers(quiz_data, user_answers)
+    output_path = save_explanations(material, quiz_data, user_answers, attempt_id, user_id)
+    print(f"Explanations saved to: {output_path}")
 
+def save_explanations(material, quiz_data, user_answers, attempt_id, user_id):
     base_name = os.path.splitext(material.get("filename", "unknown_file"))[0]
     
     # Use the user_id to create a specific subdirectory for the output
-    output_dir = os.path.join("pages", "tutor_explanations", user_id)
+    output_dir = os.path.join(TUTOR_EXPLANATIONS_DIR, user_id)
     os.makedirs(output_dir, exist_ok=True)
     
     # Create a unique filename within the user's directory
     output_path = os.path.join(output_dir, f"{base_name}_{attempt_id}_tutor_explanations.json")
 
-    with open(output_path, "w", encoding="utf-8") as f:
+    # Each explanation is appended to an NDJSON file the moment it is ready,
+    # so the frontend can show the first ones while the rest are generated.
+    partial_path = output_path[:-len(".json")] + ".ndjson"
+    partial_lock = threading.Lock()
+    with span("tutor_session") as session_span, open(partial_path, "w", encoding="utf-8") as partial:
+        session_span.set(material_id=str(material.get("_id")), attempt_id=attempt_id, user_id=user_id)
+
+        def on_explanation(q):
+            with partial_lock:
+                partial.write(json.dumps(q, ensure_ascii=False) + "\n")
+                partial.flush()
+
+        index = vector_index.load_for_material(material.get("_id"))
+        explanations = explain_wrong_answers(quiz_data, user_answers, on_explanation=on_explanation, index=index)
+        session_span.set(explanations=len(explanations), grounded=index is not None)
+
+    # Write the complete file atomically; its presence means "done"
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(explanations, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+    os.remove(partial_path)
+    return output_path
 
-    print(f"Explanations saved to: {output_path}")
+def run_tutor_session(material_id, user_answers, attempt_id, user_id, bank_question_ids=None):
+    """Entry point for the worker service: answers arrive in the job payload, not a temp file"""
+    material, quiz_data = load_material(material_id, bank_question_ids)
+    return save_explanations(material, quiz_data, user_answers, attempt_id, user_id)
 
 if __name__ == "__main__":
     try:
-        client = Client(host='http://localhost:11434')
         main()
     except Exception as e:
         import traceback
@@ -0,0 +1,306 @@
+"""Learner analytics rolled up per user, per material and per subject.
+
+    python analytics.py recompute
+"""
+
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from metrics import span
+
+COLLECTION = "learner_analytics"
+SCOPES = ("user", "material", "subject")
+# Raw attempt collections -> kind. quizzes/flashcards come from save_*;
+# user_answers/flashcard_sessions from migrate_answers.py.
+SOURCES = {
+    "quizzes": "quiz",
+    "flashcards": "flashcard",
+    "user_answers": "quiz",
+    "flashcard_sessions": "flashcard",
+}
+
+def first_present(data, *names):
+    for name in names:
+        if data.get(name) is not None:
+            return data[name]
+    return None
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+MATERIAL_NAMES = ("pdfName", "flashcardName", "activity")
+
+def material_names(database):
+    """originalName -> material id; a re-uploaded name maps to its latest material, like the Node routes"""
+    materials = database["materials"].find({}, {"originalName": 1}).sort("createdAt", 1)
+    return {doc["originalName"]: str(doc["_id"]) for doc in materials if doc.get("originalName")}
+
+def material_key(database, data):
+    """The material an attempt belongs to, by id, so one material never splits across keys.
+    Attempts saved with only a name are resolved through materials.originalName."""
+    material_id = first_present(data, "material_id")
+    if material_id is not None:
+        return str(material_id)
+    name = first_present(data, *MATERIAL_NAMES)
+    if name is None:
+        return "unknown"
+    material = database["materials"].find_one({"originalName": name}, {"_id": 1}, sort=[("createdAt", -1)])
+    return str(material["_id"]) if material else str(name)
+
+def attempt_record(kind, user_id, data, material=None):
+    """Normalize a saved attempt (Python or Node field names) into the fields the aggregates use"""
+    answers = [a for a in data.get("answers") or [] if isinstance(a, dict) and "questionIndex" in a]
+    record = {
+        "kind": kind,
+        "user_id": str(first_present(data, "user_id", "userId") or user_id),
+        "material": material or str(first_present(data, "material_id", *MATERIAL_NAMES) or "unknown"),
+        "subject": str(first_present(data, "category", "subject") or "unknown"),
+        "completed_at": parse_time(first_present(data, "completed_at", "timestamp")),
+    }
+    if kind == "quiz":
+        correct = first_present(data, "correctAnswers")
+        total = first_present(data, "totalQuestions")
+        if correct is None and answers:
+            correct = sum(1 for a in answers if a.get("isCorrect"))
+        if total is None and answers:
+            total = len(answers)
+        score = first_present(data, "score")
+        if score is None and total:
+            score = 100 * (correct or 0) / total
+        # A bank-drawn quiz's indexes point into its own draw; the bank keeps those statistics
+        record.update(score=score, correct=correct or 0, total=total or 0,
+                      answers=[] if data.get("bank_question_ids") else answers)
+    else:
+        record.update(cards_reviewed=first_present(data, "cardsReviewed") or 0, total_cards=first_present(data, "totalCards") or 0)
+    return record
+
+def scope_keys(record):
+    return {"user": record["user_id"], "material": record["material"], "subject": record["subject"]}
+
+def increments(record, scope):
+    inc = {}
+    if record["kind"] == "quiz":
+        inc.update(quiz_attempts=1, correct_answers=record["correct"], total_questions=record["total"])
+        if record["score"] is not None:
+            inc.update(scored_attempts=1, score_sum=record["score"])
+        if scope == "material":
+            # Question indexes only mean something within one material
+            for answer in record["answers"]:
+                index = answer["questionIndex"]
+                inc[f"question_stats.{index}.attempts"] = 1
+                inc[f"question_stats.{index}.misses"] = 0 if answer.get("isCorrect") else 1
+    else:
+        inc.update(flashcard_sessions=1, cards_reviewed=record["cards_reviewed"], total_cards=record["total_cards"])
+    return inc
+
+def record_attempt(database, kind, user_id, attempt):
+    """Fold one attempt into the user, material and subject documents"""
+    collection = database[COLLECTION]
+    record = attempt_record(kind, user_id, attempt, material_key(database, attempt))
+    with span("db_write", collection=COLLECTION, op="upsert"):
+        for scope, key in scope_keys(record).items():
+            update = {"$inc": increments(record, scope), "$set": {"scope": scope, "key": key}}
+            if record["completed_at"] is not None:
+                update["$max"] = {"last_activity_at": record["completed_at"]}
+            collection.update_one({"_id": f"{scope}:{key}"}, update, upsert=True)
+        if record["completed_at"] is not None:
+            update_streak(collection, f"user:{record['user_id']}", record["completed_at"].date())
+
+def update_streak(collection, doc_id, day):
+    """Consecutive active days. Attempts older than the last active day are left
+    to the batch recompute, which sees them in order."""
+    today, yesterday = day.isoformat(), (day - timedelta(days=1)).isoformat()
+    doc = collection.find_one_and_update(
+        {"_id": doc_id, "last_active_day": yesterday},
+        {"$inc": {"current_streak": 1}, "$set": {"last_active_day": today}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
+        # First activity, or a gap of more than a day
+        doc = collection.find_one_and_update(
+            {"_id": doc_id, "$or": [{"last_active_day": {"$exists": False}}, {"last_active_day": {"$lt": yesterday}}]},
+            {"$set": {"current_streak": 1, "last_active_day": today}},
+            return_document=ReturnDocument.AFTER,
+        )
+    if doc is not None:
+        collection.update_one({"_id": doc_id}, {"$max": {"longest_streak": doc["current_streak"]}})
+
+def summarize(doc):
+    """Stored sums -> the numbers a dashboard shows"""
+    if doc is None:
+        return None
+    summary = {key: value for key, value in doc.items() if key != "question_stats"}
+    if doc.get("scored_attempts"):
+        summary["mean_score"] = round(doc["score_sum"] / doc["scored_attempts"], 2)
+    if doc.get("total_questions"):
+        summary["accuracy"] = round(doc["correct_answers"] / doc["total_questions"], 4)
+    if doc.get("total_cards"):
+        summary["cards_reviewed_ratio"] = round(doc["cards_reviewed"] / doc["total_cards"], 4)
+    if doc.get("question_stats"):
+        summary["question_miss_rates"] = {
+            index: round(stats["misses"] / stats["attempts"], 4)
+            for index, stats in sorted(doc["question_stats"].items(), key=lambda item: int(item[0]))
+            if stats.get("attempts")
+        }
+    return summary
+
+def get_aggregate(database, scope, key):
+    return summarize(database[COLLECTION].find_one({"_id": f"{scope}:{key}"}))
+
+def coalesce(frame, *columns):
+    """First non-null value across columns, row by row; all-null if none of them exist"""
+    import pandas as pd
+
+    result = pd.Series([None] * len(frame), index=frame.index, dtype=object)
+    for column in reversed(columns):
+        if column in frame:
+            result = frame[column].combine_first(result)
+    return result
+
+def load_attempts(database, sources=SOURCES):
+    """All attempts as one DataFrame in attempt_record's columns"""
+    import pandas as pd
+
+    names = material_names(database)
+    frames = []
+    for collection, kind in sources.items():
+        raw = pd.DataFrame(list(database[collection].find({}, {"_id": 0, "content_hash": 0, "source_file": 0})))
+        if raw.empty:
+            continue
+        frame = pd.DataFrame({"kind": kind}, index=raw.index)
+        frame["user_id"] = coalesce(raw, "user_id", "userId").astype(str)
+        name = coalesce(raw, *MATERIAL_NAMES)
+        frame["material"] = coalesce(raw, "material_id").combine_first(name.map(names)).combine_first(name).fillna("unknown").astype(str)
+        frame["subject"] = coalesce(raw, "category", "subject").fillna("unknown").astype(str)
+        frame["completed_at"] = pd.to_datetime(coalesce(raw, "completed_at", "timestamp"), utc=True, errors="coerce", format="mixed")
+        frame["answers"] = coalesce(raw, "answers").apply(lambda value: value if isinstance(value, list) else [])
+        drawn = coalesce(raw, "bank_question_ids").apply(lambda value: isinstance(value, list) and len(value) > 0)
+        if kind == "quiz":
+            answer_count = frame["answers"].str.len()
+            answer_correct = frame["answers"].apply(lambda items: sum(1 for a in items if isinstance(a, dict) and a.get("isCorrect")))
+            frame["correct"] = pd.to_numeric(coalesce(raw, "correctAnswers").combine_first(answer_correct)).fillna(0)
+            frame["total"] = pd.to_numeric(coalesce(raw, "totalQuestions").combine_first(answer_count)).fillna(0)
+            derived = (100 * frame["correct"] / frame["total"]).where(frame["total"] > 0)
+            frame["score"] = pd.to_numeric(coalesce(raw, "score")).combine_first(derived)
+            # Counted above; kept out of question_stats like in attempt_record
+            frame["answers"] = [[] if is_drawn else items for items, is_drawn in zip(frame["answers"], drawn)]
+        else:
+            frame["cards_reviewed"] = pd.to_numeric(coalesce(raw, "cardsReviewed")).fillna(0)
+            frame["total_cards"] = pd.to_numeric(coalesce(raw, "totalCards")).fillna(0)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def build_aggregates(frame):
+    """Vectorized equivalent of replaying every attempt through record_attempt"""
+    import numpy as np
+    import pandas as pd
+
+    docs = {}
+
+    def doc(scope, key):
+        return docs.setdefault(f"{scope}:{key}", {"_id": f"{scope}:{key}", "scope": scope, "key": key})
+
+    if frame.empty:
+        return []
+    quizzes = frame[frame["kind"] == "quiz"]
+    flashcards = frame[frame["kind"] == "flashcard"]
+    for scope, column in (("user", "user_id"), ("material", "material"), ("subject", "subject")):
+        if not quizzes.empty:
+            totals = quizzes.groupby(column).agg(
+                quiz_attempts=("kind", "size"), scored_attempts=("score", "count"), score_sum=("score", "sum"),
+                correct_answers=("correct", "sum"), total_questions=("total", "sum"),
+            )
+            for key, row in totals.to_dict("index").items():
+                doc(scope, key).update({name: plain(value) for name, value in row.items()})
+        if not flashcards.empty:
+            totals = flashcards.groupby(column).agg(
+                flashcard_sessions=("kind", "size"), cards_reviewed=("cards_reviewed", "sum"), total_cards=("total_cards", "sum"),
+            )
+            for key, row in totals.to_dict("index").items():
+                doc(scope, key).update({name: plain(value) for name, value in row.items()})
+        for key, last in frame.groupby(column)["completed_at"].max().dropna().items():
+            doc(scope, key)["last_activity_at"] = last.to_pydatetime().replace(tzinfo=None)
+
+    # Per-question miss counts, one row per answered question
+    answers = quizzes[["material", "answers"]].explode("answers").dropna(subset=["answers"])
+    answers = answers[answers["answers"].apply(lambda a: isinstance(a, dict) and "questionIndex" in a)]
+    if not answers.empty:
+        answers["question"] = answers["answers"].str.get("questionIndex").astype(int).astype(str)
+        answers["missed"] = ~answers["answers"].str.get("isCorrect").fillna(False).astype(bool)
+        stats = answers.groupby(["material", "question"])["missed"].agg(attempts="size", misses="sum")
+        for (material, question), row in stats.to_dict("index").items():
+            doc("material", material).setdefault("question_stats", {})[question] = {"attempts": plain(row["attempts"]), "misses": plain(row["misses"])}
+
+    # Streaks: runs of consecutive active days per user
+    days = frame.dropna(subset=["completed_at"])[["user_id", "completed_at"]]
+    if not days.empty:
+        days = days.assign(day=days["completed_at"].dt.tz_localize(None).dt.normalize())[["user_id", "day"]].drop_duplicates().sort_values(["user_id", "day"])
+        gap = days.groupby("user_id")["day"].diff() != pd.Timedelta(days=1)
+        days["run"] = np.cumsum(gap.to_numpy())
+        runs = days.groupby(["user_id", "run"]).agg(length=("day", "size"), last=("day", "max")).reset_index()
+        per_user = runs.groupby("user_id").agg(longest_streak=("length", "max"), current_streak=("length", "last"), last_active_day=("last", "max"))
+        for user_id, row in per_user.to_dict("index").items():
+            doc("user", user_id).update({
+                "longest_streak": plain(row["longest_streak"]),
+                "current_streak": plain(row["current_streak"]),
+                "last_active_day": row["last_active_day"].date().isoformat(),
+            })
+    return list(docs.values())
+
+def plain(value):
+    # numpy scalars -> Python numbers BSON can encode
+    return value.item() if hasattr(value, "item") else value
+
+def create_indexes(collection):
+    # Imported here: db.py imports this module
+    from db import INDEXES
+    for name, keys, options in INDEXES:
+        if name == COLLECTION:
+            collection.create_index(keys, **options)
+
+def recompute(database, sources=SOURCES):
+    """Rebuild every aggregate from the raw attempts and swap them in at once"""
+    with span("analytics_recompute") as recompute_span:
+        frame = load_attempts(database, sources)
+        docs = build_aggregates(frame)
+        staging = database[f"{COLLECTION}_rebuild"]
+        staging.drop()
+        if docs:
+            staging.insert_many(docs, ordered=False)
+            # The rename replaces the collection along with its indexes, so staging gets them first
+            create_indexes(staging)
+            staging.rename(COLLECTION, dropTarget=True)
+        else:
+            database[COLLECTION].drop()
+            create_indexes(database[COLLECTION])
+        recompute_span.set(attempts=len(frame), documents=len(docs))
+    return {"attempts": len(frame), "documents": len(docs)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Learner analytics aggregates")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("recompute", help="Rebuild all aggregates from the attempt collections")
+    show = subparsers.add_parser("show", help="Print one aggregate")
+    show.add_argument("scope", choices=SCOPES)
+    show.add_argument("key")
+    args = parser.parse_args()
+
+    from db import db
+    if args.command == "recompute":
+        print(json.dumps(recompute(db.db)))
+        return
+    summary = get_aggregate(db.db, args.scope, args.key)
+    if summary is None:
+        print(f"No {args.scope} aggregate for {args.key}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(summary, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+
+CACHE_DIR = os.getenv(
+    "ARTIFACT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifact_cache")
+)
+CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_key(stage, input_digest, model=None, prompt_version=None, params=None):
+    """Content address for a stage output: same input bytes + same settings = same artifact"""
+    spec = {
+        "stage": stage,
+        "input": input_digest,
+        "model": model,
+        "prompt_version": prompt_version,
+        "params": params or {},
+    }
+    return hash_bytes(json.dumps(spec, sort_keys=True).encode("utf-8"))
+
+class ArtifactCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    key TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    meta TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_artifacts_last_access ON artifacts (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps this safe to share between
+        # threads and between the pipeline processes that run concurrently.
+        # `with conn` only commits; the connection is closed here.
+        conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _object_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def _lookup(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT key FROM artifacts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            path = self._object_path(key)
+            if not os.path.exists(path):
+                # Blob removed behind our back; forget the entry
+                conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+                return None
+            conn.execute(
+                "UPDATE artifacts SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                (time.time(), key)
+            )
+            return path
+
+    def _forget(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+
+    def _store(self, key, stage, write_blob, meta):
+        path = self._object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        write_blob(tmp_path)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (key, stage, size, created_at, last_access, hits, meta) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?)",
+                (key, stage, os.path.getsize(path), now, now, json.dumps(meta or {}))
+            )
+        self.evict()
+
+    def contains(self, key):
+        return self._lookup(key) is not None
+
+    def get_file(self, key, dest_path):
+        """Copy a cached artifact to dest_path. Returns False on a miss."""
+        path = self._lookup(key)
+        if path is None:
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+        try:
+            shutil.copyfile(path, dest_path)
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the copy
+            self._forget(key)
+            return False
+        return True
+
+    def put_file(self, key, stage, src_path, meta=None):
+        self._store(key, stage, lambda tmp: shutil.copyfile(src_path, tmp), meta)
+
+    def get_bytes(self, key):
+        path = self._lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the read
+            self._forget(key)
+            return None
+
+    def put_bytes(self, key, stage, data, meta=None):
+        def write_blob(tmp):
+            with open(tmp, "wb") as f:
+                f.write(data)
+        self._store(key, stage, write_blob, meta)
+
+    def _delete_rows(self, conn, rows):
+        for row in rows:
+            try:
+                os.remove(self._object_path(row["key"]))
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM artifacts WHERE key = ?", (row["key"],))
+        return len(rows)
+
+    def evict(self):
+        """Drop least-recently-used artifacts until the cache fits in max_bytes"""
+        with self._lock, self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            evicted = []
+            for row in conn.execute("SELECT key, size FROM artifacts ORDER BY last_access ASC"):
+                if total <= self.max_bytes:
+                    break
+                evicted.append(row)
+                total -= row["size"]
+            return self._delete_rows(conn, evicted)
+
+    def purge(self, stage=None, older_than_days=None):
+        query, args = "SELECT key FROM artifacts WHERE 1 = 1", []
+        if stage:
+            query += " AND stage = ?"
+            args.append(stage)
+        if older_than_days is not None:
+            query += " AND last_access < ?"
+            args.append(time.time() - older_than_days * 86400)
+        with self._lock, self._connect() as conn:
+            return self._delete_rows(conn, conn.execute(query, args).fetchall())
+
+    def entries(self, stage=None):
+        query, args = "SELECT * FROM artifacts", []
+        if stage:
+            query += " WHERE stage = ?"
+            args.append(stage)
+        query += " ORDER BY last_access DESC"
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, args)]
+
+    def stats(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT stage, COUNT(*) AS entries, SUM(size) AS bytes, SUM(hits) AS hits "
+                "FROM artifacts GROUP BY stage ORDER BY stage"
+            ).fetchall()
+        stages = {row["stage"]: {"entries": row["entries"], "bytes": row["bytes"], "hits": row["hits"]} for row in rows}
+        return {
+            "root": self.root,
+            "max_bytes": self.max_bytes,
+            "total_bytes": sum(s["bytes"] for s in stages.values()),
+            "total_entries": sum(s["entries"] for s in stages.values()),
+            "stages": stages,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or purge the pipeline artifact cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Show size and hit counts per stage")
+    list_parser = sub.add_parser("list", help="List cached artifacts, most recently used first")
+    list_parser.add_argument("--stage")
+    purge_parser = sub.add_parser("purge", help="Delete cached artifacts")
+    purge_parser.add_argument("--stage")
+    purge_parser.add_argument("--older-than", type=float, metavar="DAYS", help="Only artifacts unused for DAYS")
+    purge_parser.add_argument("--all", action="store_true", help="Required to purge without a filter")
+    args = parser.parse_args()
+
+    cache = ArtifactCache()
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "list":
+        for entry in cache.entries(stage=args.stage):
+            last_access = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry["last_access"]))
+            print(f"{entry['key'][:16]}  {entry['stage']:<12} {entry['size']:>10}  hits={entry['hits']:<4} {last_access}")
+    elif args.command == "purge":
+        if not (args.stage or args.older_than is not None or args.all):
+            print("Refusing to purge everything without --all", file=sys.stderr)
+            sys.exit(1)
+        removed = cache.purge(stage=args.stage, older_than_days=args.older_than)
+        print(f"Purged {removed} artifact(s)")
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,109 @@
 # backend/auth.py
 from db import db
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import asyncio
 import hashlib
+import hmac
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from fastapi import HTTPException
 import jwt
 from typing import Optional
 
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key")
 JWT_ALGORITHM = "HS256"
+TOKEN_LIFETIME = timedelta(days=7)
+
+PBKDF2_ITERATIONS = 100000
+# hashlib releases the GIL while deriving, so threads hash in parallel.
+# Bounded so a login storm queues instead of starving everything else.
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+# Verified token payloads, reused until the token expires or the TTL runs out
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+
+def hash_password(password: str, salt: bytes, iterations: int = None) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations or PBKDF2_ITERATIONS)
+
+def verify_password(password: str, salt_hex: str, key_hex: str) -> bool:
+    key = hash_password(password, bytes.fromhex(salt_hex))
+    return hmac.compare_digest(key, bytes.fromhex(key_hex))
+
+# Unknown usernames still pay for one derivation, so response time does not
+# reveal which accounts exist
+_DUMMY_SALT = os.urandom(32).hex()
+_DUMMY_KEY = hash_password("", bytes.fromhex(_DUMMY_SALT)).hex()
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+def get_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pbkdf2")
+        return _hash_pool
+
+class TokenCache:
+    """Thread-safe LRU of verified JWT payloads with a TTL capped at each token's exp"""
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        # Fixed-size keys; the tokens themselves are a few hundred bytes each
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            # Copy so a caller editing its payload cannot change the cached one
+            return dict(payload)
+
+    def put(self, token, payload):
+        expires_at = time.time() + self.ttl
+        if "exp" in payload:
+            expires_at = min(expires_at, float(payload["exp"]))
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+token_cache = TokenCache()
 
 class AuthManager:
     @staticmethod
-    def register_user(username: str, email: str, password: str, role: str):
-        """Register a new user with proper validation"""
-        # Validation checks
+    def _validate_registration(username: str, email: str, password: str, role: str):
         if not all([username, email, password, role]):
             raise HTTPException(status_code=400, detail="All fields are required")
-        
+
         if role not in ["student", "teacher"]:
             raise HTTPException(status_code=400, detail="Invalid role")
-        
+
         if len(password) < 6:
             raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
 
@@ -29,15 +111,8 @@ class AuthManager:
         if db.users.find_one({"$or": [{"username": username}, {"email": email}]}):
             raise HTTPException(status_code=400, detail="Username or email already exists")
 
-        # Hash password
-        salt = os.urandom(32)
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt,
-            100000
-        )
-        
+    @staticmethod
+    def _insert_user(username: str, email: str, role: str, salt: bytes, key: bytes):
         user_data = {
             "username": username,
             "email": email,
@@ -47,28 +122,40 @@ class AuthManager:
             "created_at": datetime.now(),
             "last_login": None
         }
-        
-        result = db.users.insert_one(user_data)
+
+        try:
+            result = db.users.insert_one(user_data)
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration; the unique index decides
+            raise HTTPException(status_code=400, detail="Username or email already exists")
         return str(result.inserted_id)
 
     @staticmethod
-    def login_user(username: str, password: str):
-        """Authenticate user and return JWT token"""
-        user = db.users.find_one({"username": username})
+    def register_user(username: str, email: str, password: str, role: str):
+        """Register a new user with proper validation"""
+        AuthManager._validate_registration(username, email, password, role)
+
+        # Hash password
+        salt = os.urandom(32)
+        key = hash_password(password, salt)
+        return AuthManager._insert_user(username, email, role, salt, key)
+
+    @staticmethod
+    async def register_user_async(username: str, email: str, password: str, role: str):
+        """register_user for async handlers: DB calls and hashing run off the event loop"""
+        await asyncio.to_thread(AuthManager._validate_registration, username, email, password, role)
+        salt = os.urandom(32)
+        key = await asyncio.get_running_loop().run_in_executor(get_hash_pool(), hash_password, password, salt)
+        return await asyncio.to_thread(AuthManager._insert_user, username, email, role, salt, key)
+
+    @staticmethod
+    def _stored_credentials(user):
         if not user:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        # Verify password
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            bytes.fromhex(user["salt"]),
-            100000
-        )
-        
-        if key.hex() != user["key"]:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
+            return _DUMMY_SALT, _DUMMY_KEY
+        return user["salt"], user["key"]
 
+    @staticmethod
+    def _issue_token(user):
         # Update last login
         db.users.update_one(
             {"_id": user["_id"]},
@@ -80,7 +167,7 @@ class AuthManager:
             "id": str(user["_id"]),
             "username": user["username"],
             "role": user["role"],
-            "exp": datetime.now() + timedelta(days=7)
+            "exp": datetime.now(timezone.utc) + TOKEN_LIFETIME
         }, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
         return {
@@ -93,11 +180,39 @@ class AuthManager:
             }
         }
 
+    @staticmethod
+    def login_user(username: str, password: str):
+        """Authenticate user and return JWT token"""
+        user = db.users.find_one({"username": username})
+
+        # Verify password
+        valid = verify_password(password, *AuthManager._stored_credentials(user))
+        if not user or not valid:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+
+        return AuthManager._issue_token(user)
+
+    @staticmethod
+    async def login_user_async(username: str, password: str):
+        """login_user for async handlers: the key derivation runs in the bounded hash pool"""
+        user = await asyncio.to_thread(db.users.find_one, {"username": username})
+        valid = await asyncio.get_running_loop().run_in_executor(
+            get_hash_pool(), verify_password, password, *AuthManager._stored_credentials(user)
+        )
+        if not user or not valid:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+
+        return await asyncio.to_thread(AuthManager._issue_token, user)
+
     @staticmethod
     def verify_token(token: str) -> Optional[dict]:
         """Verify JWT token and return payload if valid"""
+        payload = token_cache.get(token)
+        if payload is not None:
+            return payload
         try:
             payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            return payload
         except jwt.PyJWTError:
-            return None
\ No newline at end of file
+            return None
+        token_cache.put(token, dict(payload))
+        return payload
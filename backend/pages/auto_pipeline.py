@@ -2,27 +2,111 @@ import os
 import sys
 import subprocess
 import json
-from datetime import datetime
+import time
+import threading
+from datetime import datetime, timezone
 from db import db
 from bson import ObjectId
+from artifact_cache import ArtifactCache, cache_key, hash_file, hash_bytes
+from stage_graph import Stage, StageGraph, StageFailed
+from checkpoints import PipelineCheckpoint
+from retry import retry_call
+from metrics import span, event
+import extract
+import context_generator
+import quiz_generator
+import flashcard_generator
+import study_set_generator
+import vector_index
+import block_store
+import question_bank
+
+NUM_QUESTIONS = 10
+NUM_FLASHCARDS = 10
+
+# Where the follow-up work that only helps later requests (vector index,
+# tutor pre-warm, question bank) runs once a material is completed:
+#   queue    - a material_followups job for worker.py
+#   detached - a separate `auto_pipeline.py followups` process
+#   inline   - in this process before run_pipeline returns
+#   deferred - handed back in the result for the caller to run (batch_ingest)
+FOLLOWUP_MODES = ("queue", "detached", "inline", "deferred")
+FOLLOWUP_MODE = os.getenv("PIPELINE_FOLLOWUPS") or ("queue" if os.getenv("PYTHON_WORKER_MODE") == "queue" else "detached")
+CONTEXT_PARAMS = {"mode": context_generator.CONTEXT_MODE, "chunk_tokens": context_generator.CHUNK_TOKEN_BUDGET}
+
+# Which artifact each stage produces; used for checkpoints and targeted cleanup
+STAGE_ARTIFACTS = {
+    "extract": "extracted_json",
+    "context": "context_txt",
+    "quiz": "quiz_json",
+    "flashcards": "flashcards_json",
+}
+
+def encode_text(text):
+    return text.encode("utf-8")
+
+def decode_text(data):
+    return data.decode("utf-8")
+
+def encode_blocks(blocks):
+    return extract.serialize_blocks(blocks).encode("utf-8")
+
+def decode_blocks(data):
+    # Cached and resumed artifacts may be labeled JSON or a .blocks file
+    return block_store.loads(data)
 
 class PipelineRunner:
-    def __init__(self):
+    def __init__(self, in_process=None):
         self.backend_dir = os.path.dirname(os.path.abspath(__file__))
-        self.log_file = os.path.join(self.backend_dir, "pipeline_logs.txt")
+        # In-process mode runs the stage functions directly and hands results
+        # between them in memory; subprocess mode runs each stage script in a
+        # fresh interpreter, as the pipeline originally did.
+        if in_process is None:
+            in_process = os.getenv("PIPELINE_MODE", "inprocess") != "subprocess"
+        self.in_process = in_process
+        self.ocr_workers = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+        self.log_file = os.getenv("PIPELINE_LOG_FILE", os.path.join(self.backend_dir, "pipeline_logs.txt"))
+        self.log_lock = threading.Lock()
+        self.cache = None if os.getenv("ARTIFACT_CACHE", "1") == "0" else ArtifactCache()
+        self.extract_mode = os.getenv("EXTRACT_MODE", "hybrid")
+        self.ocr_raster = os.getenv("OCR_RASTER", "adaptive")
+        self.artifact_format = block_store.ARTIFACT_FORMAT
+        self.prewarm_tutor = os.getenv("TUTOR_PREWARM", "1") != "0"
+        self.build_index = os.getenv("VECTOR_INDEX", "1") != "0"
+        self.question_bank_size = question_bank.BANK_SIZE
+        if FOLLOWUP_MODE not in FOLLOWUP_MODES:
+            raise ValueError(f"PIPELINE_FOLLOWUPS must be one of {', '.join(FOLLOWUP_MODES)}")
+        self.followup_mode = FOLLOWUP_MODE
+        # Set by worker.py so follow-ups go on the queue the worker consumes
+        self.followup_queue = None
+        # Combined generation needs both outputs in one process; subprocess mode always runs them separately
+        self.generation_mode = study_set_generator.GENERATION_MODE if in_process else "separate"
         self.ensure_directories()
         self.init_logging()
 
     def init_logging(self):
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(f"\n\n=== New Pipeline Session {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
+        # Opened once per runner; line buffering keeps entries visible as they are written
+        self.log_handle = open(self.log_file, "a", encoding="utf-8", buffering=1)
+        self.log_handle.write(f"\n\n=== New Pipeline Session {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
 
     def log(self, message, status="INFO"):
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         log_entry = f"[{timestamp}] [{status}] {message}"
-        print(log_entry, flush=True)
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(log_entry + "\n")
+        # Stages can run concurrently, so keep each entry on its own line
+        with self.log_lock:
+            print(log_entry, flush=True)
+            self.log_handle.write(log_entry + "\n")
+        event("log", level=status, message=message)
+
+    def close(self):
+        with self.log_lock:
+            self.log_handle.close()
+
+    def display_path(self, path):
+        # Log paths relative to backend/pages so entries read the same on every machine
+        if not os.path.isabs(path):
+            return path
+        return os.path.relpath(path, self.backend_dir).replace(os.sep, "/")
 
     def ensure_directories(self):
         required_dirs = [
@@ -39,7 +123,7 @@ class PipelineRunner:
     def run_script(self, script_name, args, timeout=300):
         script_path = os.path.join(self.backend_dir, script_name)
         command = ["python", script_path] + args
-        self.log(f"Executing: {' '.join(command)}")
+        self.log(f"Executing: python {script_name} {' '.join(self.display_path(arg) for arg in args)}")
         try:
             result = subprocess.run(command, capture_output=True, text=True, check=False, timeout=timeout)
             if result.returncode != 0:
@@ -53,30 +137,358 @@ class PipelineRunner:
 
     def validate_file(self, path, description):
         if not os.path.exists(path):
-            self.log(f"Missing {description} file: {path}", "ERROR")
+            self.log(f"Missing {description} file: {self.display_path(path)}", "ERROR")
             return False
         return True
 
-    def cleanup_artifacts(self, artifacts):
-        for filepath in artifacts.values():
-            if os.path.exists(filepath):
+    def run_cached_stage(self, stage, script_name, args, input_path, output_path, description, model, prompt_version, params, timings=None):
+        stage_span = span("pipeline_stage", stage=stage, mode="subprocess")
+        try:
+            with stage_span:
+                stage_span.set(cached=False)
+                # Stage outputs are content-addressed: the same input bytes run through
+                # the same model, prompt and parameters always give a reusable artifact.
+                key = None
+                if self.cache is not None:
+                    key = cache_key(stage, hash_file(input_path), model=model, prompt_version=prompt_version, params=params)
+                    if self.cache.get_file(key, output_path):
+                        self.log(f"Cache hit for {stage} ({key[:12]}), reused artifact {self.display_path(output_path)}")
+                        stage_span.set(cached=True)
+                        return True
+
+                if not self.run_script(script_name, args) or not self.validate_file(output_path, description):
+                    stage_span.set(failed=True)
+                    return False
+
+                if key is not None:
+                    self.cache.put_file(key, stage, output_path, meta={"source": os.path.basename(input_path)})
+                return True
+        finally:
+            if timings is not None:
+                timings[stage] = stage_span.summary()
+
+    def with_retries(self, label, func):
+        def on_retry(attempt, error, delay):
+            self.log(f"Transient error in {label} (attempt {attempt}): {error}. Retrying in {delay:.1f}s", "WARNING")
+        return retry_call(func, on_retry=on_retry)
+
+    def write_artifact(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def extract_params(self):
+        params = {"mode": self.extract_mode, "raster": self.ocr_raster}
+        # Cached bytes are in the artifact's format; JSON keys stay as they were
+        if self.artifact_format != "json":
+            params["format"] = self.artifact_format
+        return params
+
+    def stage_key(self, stage, input_digest, module, params):
+        return cache_key(stage, input_digest, model=module.MODEL, prompt_version=module.PROMPT_VERSION, params=params)
+
+    def extract_cached(self, pdf_path):
+        # Lets batch ingestion skip OCR for a PDF whose labeled blocks are already cached
+        return self.cache is not None and self.cache.contains(self.stage_key("extract", hash_file(pdf_path), extract, self.extract_params()))
+
+    def run_memory_stage(self, stage, input_digest, module, params, output_path, compute, encode, decode, timings=None):
+        stage_span = span("pipeline_stage", stage=stage, mode="inprocess")
+        try:
+            with stage_span:
+                stage_span.set(cached=False)
+                key = None
+                if self.cache is not None:
+                    key = self.stage_key(stage, input_digest, module, params)
+                    data = self.cache.get_bytes(key)
+                    if data is not None:
+                        self.log(f"Cache hit for {stage} ({key[:12]}), reused artifact {self.display_path(output_path)}")
+                        stage_span.set(cached=True)
+                        self.write_artifact(output_path, data)
+                        return decode(data)
+
+                self.log(f"Running stage in-process: {stage}")
+                result = self.with_retries(stage, compute)
+                if result is None:
+                    raise ValueError(f"Stage {stage} produced no output")
+
+                # Artifacts are still written out for the Node backend and for the
+                # subprocess fallback, but later stages never read them back.
+                data = encode(result)
+                self.write_artifact(output_path, data)
+                if key is not None:
+                    self.cache.put_bytes(key, stage, data, meta={"source": os.path.basename(output_path)})
+                self.log(f"Stage completed: {stage}")
+                return result
+        finally:
+            if timings is not None:
+                timings[stage] = stage_span.summary()
+
+    def run_stages_in_process(self, pdf_path, subject, artifacts, checkpoint, timings=None, page_blocks=None):
+        def run_extract(results):
+            # Batch ingestion OCRs pages ahead of time in its own pool and passes
+            # the unlabeled blocks in; only the labeling is left for this stage.
+            if page_blocks is not None:
+                compute = lambda: extract.label_blocks(page_blocks)
+            else:
+                compute = lambda: extract.extract_labeled_blocks(pdf_path, workers=self.ocr_workers, mode=self.extract_mode, raster=self.ocr_raster)
+            return self.run_memory_stage(
+                "extract", hash_file(pdf_path), extract, self.extract_params(), artifacts["extracted_json"],
+                compute,
+                block_store.dumps if self.artifact_format == "blocks" else encode_blocks, decode_blocks, timings
+            )
+
+        def run_context(results):
+            blocks = results["extract"]
+            return self.run_memory_stage(
+                "context", hash_bytes(encode_blocks(blocks)), context_generator, CONTEXT_PARAMS, artifacts["context_txt"],
+                lambda: context_generator.build_context(blocks, cache=self.cache),
+                encode_text, decode_text, timings
+            )
+
+        # In combined/shared_prefix mode the quiz and flashcard stages draw from
+        # one SharedStudySet, so the context is sent to the model only once.
+        combined = self.generation_mode != "separate"
+        generator_modules = (study_set_generator, study_set_generator) if combined else (quiz_generator, flashcard_generator)
+        study_set_lock = threading.Lock()
+        study_sets = []
+
+        def shared_study_set(context):
+            with study_set_lock:
+                if not study_sets:
+                    study_sets.append(study_set_generator.SharedStudySet(context, NUM_QUESTIONS, NUM_FLASHCARDS, self.generation_mode))
+                return study_sets[0]
+
+        def run_quiz(results):
+            context = results["context"]
+            if combined:
+                compute = lambda: shared_study_set(context).quiz()
+            else:
+                compute = lambda: quiz_generator.generate_quiz(context, num_questions=NUM_QUESTIONS)
+            return self.run_memory_stage(
+                "quiz", hash_bytes(encode_text(context)), generator_modules[0],
+                {"num_questions": NUM_QUESTIONS, "generation_mode": self.generation_mode, "stream": quiz_generator.STREAM_GENERATION}, artifacts["quiz_json"],
+                compute, encode_text, decode_text, timings
+            )
+
+        def run_flashcards(results):
+            context = results["context"]
+            if combined:
+                compute = lambda: shared_study_set(context).flashcards()
+            else:
+                compute = lambda: flashcard_generator.generate_flashcards(context, num_flashcards=NUM_FLASHCARDS)
+            return self.run_memory_stage(
+                "flashcards", hash_bytes(encode_text(context)), generator_modules[1],
+                {"num_flashcards": NUM_FLASHCARDS, "generation_mode": self.generation_mode, "stream": flashcard_generator.STREAM_GENERATION}, artifacts["flashcards_json"],
+                compute, encode_text, decode_text, timings
+            )
+
+        graph = StageGraph([
+            Stage("extract", run_extract),
+            Stage("context", run_context, deps=["extract"]),
+            # Quiz and flashcards only need the context, so they run side by side
+            Stage("quiz", run_quiz, deps=["context"]),
+            Stage("flashcards", run_flashcards, deps=["context"]),
+        ])
+        # Resumed runs load finished stages from their artifacts instead of rerunning them
+        decoders = {"extract": decode_blocks, "context": decode_text, "quiz": decode_text, "flashcards": decode_text}
+        results = {}
+        for stage in checkpoint.completed_stages():
+            with open(artifacts[STAGE_ARTIFACTS[stage]], "rb") as f:
+                results[stage] = decoders[stage](f.read())
+            self.log(f"Resuming: {stage} already completed, loaded {self.display_path(artifacts[STAGE_ARTIFACTS[stage]])}")
+
+        results = graph.run(
+            results=results,
+            on_finish=lambda stage: checkpoint.mark_complete(stage, [artifacts[STAGE_ARTIFACTS[stage]]])
+        )
+        return results["quiz"]
+
+    def run_stages_subprocess(self, pdf_path, subject, artifacts, checkpoint, timings=None):
+        stages = [
+            ("extract", "extract.py", [pdf_path, subject, "--mode", self.extract_mode, "--raster", self.ocr_raster, "--format", self.artifact_format],
+             pdf_path, "extracted text", extract, self.extract_params()),
+            ("context", "context_generator.py", [artifacts["extracted_json"]],
+             artifacts["extracted_json"], "context text", context_generator, CONTEXT_PARAMS),
+            ("quiz", "quiz_generator.py", [artifacts["context_txt"], subject, str(NUM_QUESTIONS)],
+             artifacts["context_txt"], "quiz", quiz_generator, {"num_questions": NUM_QUESTIONS, "stream": quiz_generator.STREAM_GENERATION}),
+            ("flashcards", "flashcard_generator.py", [artifacts["context_txt"], subject, str(NUM_FLASHCARDS)],
+             artifacts["context_txt"], "flashcards", flashcard_generator, {"num_flashcards": NUM_FLASHCARDS, "stream": flashcard_generator.STREAM_GENERATION}),
+        ]
+        for stage, script_name, args, input_path, description, module, params in stages:
+            output_path = artifacts[STAGE_ARTIFACTS[stage]]
+            if checkpoint.is_complete(stage):
+                self.log(f"Resuming: {stage} already completed, reusing {self.display_path(output_path)}")
+                continue
+            if not self.run_cached_stage(
+                stage, script_name, args, input_path, output_path, description,
+                module.MODEL, module.PROMPT_VERSION, params, timings
+            ):
+                raise StageFailed(stage, f"{script_name} did not produce {description}")
+            checkpoint.mark_complete(stage, [output_path])
+
+        with open(artifacts["quiz_json"], "r", encoding="utf-8") as f:
+            return f.read()
+
+    def cleanup_artifacts(self, artifacts, stages):
+        # Only the failed stage's output is suspect; finished stages stay on
+        # disk so a resumed run can pick up from them.
+        for stage in stages:
+            filepath = artifacts.get(STAGE_ARTIFACTS.get(stage))
+            if filepath and os.path.exists(filepath):
                 os.remove(filepath)
 
-    def execute_pipeline(self, input_pdf, material_id):
+    def build_vector_index(self, material_id, extracted_json):
+        # Optional like the pre-warm: without an index the tutor explains
+        # from the question alone, so a failure here only logs a warning.
+        try:
+            blocks = block_store.read_blocks(extracted_json, types=context_generator.CONTENT_TYPES, fields=("text",))
+            result = vector_index.build_for_material(material_id, blocks)
+            if result["rebuilt"]:
+                self.log(f"Vector index built: {result['passages']} passage(s)")
+            else:
+                self.log("Vector index unchanged, reused")
+            return vector_index.load_for_material(material_id)
+        except Exception as e:
+            self.log(f"Vector index build failed: {e}", "WARNING")
+            return None
+
+    def prewarm_tutor_explanations(self, quiz_data, index=None):
+        # The material is already marked completed; this only fills the shared
+        # explanation cache so tutor requests for this quiz become lookups.
+        try:
+            import ai_tutor
+            self.log("Pre-warming tutor explanations for every distractor...")
+            result = ai_tutor.prewarm_explanations(quiz_data, index=index)
+            self.log(f"Tutor explanation cache warmed: {result['generated']} new explanation(s)")
+        except Exception as e:
+            self.log(f"Tutor explanation pre-warm failed: {e}", "WARNING")
+
+    def fill_question_bank(self, material_id, quiz_data, context_path):
+        # Like the pre-warm, the material is already usable; this only widens the
+        # pool later quizzes are drawn from. The bank can be refilled with
+        # `python question_bank.py fill <material_id>` or a question_bank job.
+        try:
+            question_bank.seed_bank(db.db, material_id, quiz_data, context_path)
+            result = question_bank.fill_bank(db.db, material_id, size=self.question_bank_size)
+            self.log(f"Question bank holds {result['size']} question(s): {result['added']} new, {result['duplicates']} near-duplicate(s) dropped")
+        except Exception as e:
+            self.log(f"Question bank fill failed: {e}", "WARNING")
+
+    def followup_payload(self, material_id, artifacts):
+        steps = [step for step, enabled in (
+            ("vector_index", self.build_index),
+            ("prewarm", self.prewarm_tutor),
+            ("question_bank", bool(self.question_bank_size)),
+        ) if enabled]
+        if not steps:
+            return None
+        return {
+            "material_id": str(material_id),
+            "steps": steps,
+            "extracted_json": artifacts["extracted_json"],
+            "context_txt": artifacts["context_txt"],
+        }
+
+    def dispatch_followups(self, payload):
+        """Start the follow-up work for a completed material without holding this pipeline slot"""
+        mode = "queue" if self.followup_queue is not None else self.followup_mode
+        try:
+            if mode == "inline":
+                self.run_followups(**payload)
+            elif mode == "queue":
+                from job_queue import MongoJobQueue
+                queue = self.followup_queue or MongoJobQueue(db.db["jobs"])
+                queue.enqueue("material_followups", payload)
+                self.log(f"Queued follow-ups: {', '.join(payload['steps'])}")
+            elif mode == "detached":
+                # Own session so it outlives this process (and Node's wait on it)
+                with open(self.log_file, "a", encoding="utf-8") as log_handle:
+                    subprocess.Popen(
+                        [sys.executable, os.path.abspath(__file__), "followups", json.dumps(payload)],
+                        cwd=os.path.dirname(os.path.abspath(__file__)),
+                        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log_handle,
+                        start_new_session=True,
+                    )
+                self.log(f"Started follow-ups in the background: {', '.join(payload['steps'])}")
+        except Exception as e:
+            # The material is already completed; losing the follow-ups only costs later lookups
+            self.log(f"Could not start follow-ups: {e}", "WARNING")
+            return {"mode": mode, "error": str(e)}
+        return {"mode": mode, **payload}
+
+    def run_followups(self, material_id, steps, extracted_json=None, context_txt=None):
+        """Vector index, then the pre-warm (grounded on it), then the question bank"""
+        material = db.materials.find_one({"_id": ObjectId(material_id)}, {"quiz_content": 1})
+        quiz_data = (material or {}).get("quiz_content")
+        if not quiz_data:
+            self.log(f"No quiz for material {material_id}, skipping follow-ups", "WARNING")
+            return {"material_id": material_id, "steps": []}
+        if "vector_index" in steps:
+            index = self.build_vector_index(material_id, extracted_json)
+        elif "prewarm" in steps:
+            index = vector_index.load_for_material(material_id)
+        if "prewarm" in steps:
+            self.prewarm_tutor_explanations(quiz_data, index)
+        if "question_bank" in steps:
+            self.fill_question_bank(material_id, quiz_data, context_txt)
+        return {"material_id": material_id, "steps": steps}
+
+    def resume(self, material_id):
+        checkpoint = PipelineCheckpoint(material_id, db.materials)
+        if not checkpoint.load() or not checkpoint.input_pdf:
+            message = f"No checkpoint found for material {material_id}"
+            self.log(message, "ERROR")
+            return {"status": "error", "message": message}
+
+        self.update_material(material_id, {"$set": {"status": "processing"}, "$unset": {"error": "", "failed_at": ""}})
+        return self.execute_pipeline(checkpoint.input_pdf, material_id, resume=True)
+
+    def update_material(self, material_id, update):
+        def write():
+            with span("db_write", collection="materials", op="update_one"):
+                return db.materials.update_one({"_id": ObjectId(material_id)}, update)
+        return self.with_retries("database update", write)
+
+    def queued_seconds(self, material_id):
+        # Time between the upload (Node sets createdAt) and this run starting
+        try:
+            material = db.materials.find_one({"_id": ObjectId(material_id)}, {"createdAt": 1})
+        except Exception:
+            return None
+        created = material.get("createdAt") if material else None
+        if not isinstance(created, datetime):
+            return None
+        now = datetime.now(timezone.utc) if created.tzinfo else datetime.now(timezone.utc).replace(tzinfo=None)
+        return round((now - created).total_seconds(), 3)
+
+    def execute_pipeline(self, input_pdf, material_id, resume=False, page_blocks=None):
+        # The root span: every stage, LLM call and DB write below shares its trace id
+        with span("pipeline", mode="inprocess" if self.in_process else "subprocess") as pipeline_span:
+            pipeline_span.set(material_id=str(material_id), input_pdf=input_pdf, resume=resume)
+            result = self.run_pipeline(input_pdf, material_id, resume, page_blocks)
+            pipeline_span.labels["outcome"] = result["status"]
+            return result
+
+    def run_pipeline(self, input_pdf, material_id, resume=False, page_blocks=None):
         artifacts = {}
+        checkpoint = PipelineCheckpoint(material_id, db.materials)
+        # Per-stage durations, stored on the material so slow uploads can be diagnosed later
+        started = time.perf_counter()
+        stage_timings = {"mode": "inprocess" if self.in_process else "subprocess", "resumed": resume, "stages": {}}
         try:
-            self.log(f"Starting pipeline for PDF: {input_pdf} with Material ID: {material_id}")
+            self.log(f"{'Resuming' if resume else 'Starting'} pipeline for PDF: {input_pdf} with Material ID: {material_id}")
             pdf_path = os.path.join(self.backend_dir, input_pdf)
+            if not resume:
+                stage_timings["queued_seconds"] = self.queued_seconds(material_id)
             
             if not os.path.isfile(pdf_path):
-                raise ValueError(f"PDF not found: {pdf_path}")
+                raise ValueError(f"PDF not found: {input_pdf}")
 
             base_name = os.path.splitext(os.path.basename(input_pdf))[0]
             safe_name = base_name.replace(" ", "_").replace(",", "")
             subject = os.path.basename(os.path.dirname(input_pdf))
 
             artifacts = {
-                "extracted_json": os.path.join(self.backend_dir, f"extracted_text/{subject}/{safe_name}_labeled.json"),
+                "extracted_json": block_store.artifact_path(os.path.join(self.backend_dir, f"extracted_text/{subject}/{safe_name}_labeled"), self.artifact_format),
                 "context_txt": os.path.join(self.backend_dir, f"extracted_text/{subject}/{safe_name}_llama_context.txt"),
                 "quiz_json": os.path.join(self.backend_dir, f"generated_quizzes/{subject}/{safe_name}_quiz.json"),
                 "flashcards_json": os.path.join(self.backend_dir, f"generated_flashcards/{subject}/{safe_name}_flashcards.json")
@@ -84,19 +496,22 @@ class PipelineRunner:
             for path in artifacts.values():
                 os.makedirs(os.path.dirname(path), exist_ok=True)
 
-            if not self.run_script("extract.py", [pdf_path, subject]) or not self.validate_file(artifacts["extracted_json"], "extracted text"):
-                raise ValueError("PDF extraction failed")
+            if resume:
+                checkpoint.load()
+            else:
+                checkpoint.state = {"input_pdf": input_pdf, "stages": {}}
+            checkpoint.start(input_pdf)
 
-            if not self.run_script("context_generator.py", [artifacts["extracted_json"]]) or not self.validate_file(artifacts["context_txt"], "context text"):
-                raise ValueError("Context generation failed")
-
-            if not self.run_script("quiz_generator.py", [artifacts["context_txt"], subject, "10"]) or not self.validate_file(artifacts["quiz_json"], "quiz"):
-                raise ValueError("Quiz generation failed")
-                
-            # --- THIS IS THE CORRECTED LINE ---
-            # Added the 'subject' argument and error checking for the flashcard generation step.
-            if not self.run_script("flashcard_generator.py", [artifacts["context_txt"], subject, "10"]) or not self.validate_file(artifacts["flashcards_json"], "flashcards"):
-                raise ValueError("Flashcard generation failed")
+            try:
+                if self.in_process:
+                    quiz_json = self.run_stages_in_process(pdf_path, subject, artifacts, checkpoint, stage_timings["stages"], page_blocks)
+                else:
+                    quiz_json = self.run_stages_subprocess(pdf_path, subject, artifacts, checkpoint, stage_timings["stages"])
+            except StageFailed as e:
+                self.log(str(e), "ERROR")
+                checkpoint.mark_failed(e.stage, e.error)
+                self.cleanup_artifacts(artifacts, [e.stage])
+                raise ValueError(f"{e.stage} stage failed: {e.error}")
 
             self.log("Attempting to finalize material record in database...")
             try:
@@ -104,16 +519,14 @@ class PipelineRunner:
                     "status": "completed",
                     "completed_at": datetime.now()
                 }
-                with open(artifacts["quiz_json"], "r", encoding="utf-8") as f:
-                    update_data["quiz_content"] = json.load(f)
+                update_data["quiz_content"] = json.loads(quiz_json)
+                stage_timings["total_seconds"] = round(time.perf_counter() - started, 3)
+                update_data["stage_timings"] = stage_timings
                 
                 query_filter = {"_id": ObjectId(material_id)}
                 print(f"Executing DB update with filter: {query_filter}")
 
-                result = db.materials.update_one(
-                    query_filter,
-                    {"$set": update_data}
-                )
+                result = self.update_material(material_id, {"$set": update_data})
 
                 if result.modified_count == 0:
                     raise Exception("Material document was not found or not modified in the database.")
@@ -124,33 +537,54 @@ class PipelineRunner:
                 self.log(f"DATABASE UPDATE FAILED: {str(e)}", "CRITICAL")
                 raise ValueError(f"Database update failed: {str(e)}")
 
+            checkpoint.clear()
             self.log(f"Pipeline completed for {input_pdf}")
-            return {"status": "success", "material_id": str(material_id)}
+
+            result = {"status": "success", "material_id": str(material_id)}
+            followups = self.followup_payload(material_id, artifacts)
+            if followups:
+                result["followups"] = self.dispatch_followups(followups)
+            return result
 
         except Exception as e:
             error_message = f"Pipeline failed: {str(e)}"
             self.log(error_message, "CRITICAL")
-            self.cleanup_artifacts(artifacts)
-            
-            db.materials.update_one(
-                {"_id": ObjectId(material_id)},
-                {"$set": {"status": "failed", "error": str(e), "failed_at": datetime.now()}}
-            )
+
+            stage_timings["total_seconds"] = round(time.perf_counter() - started, 3)
+            self.update_material(material_id, {"$set": {
+                "status": "failed", "error": str(e), "failed_at": datetime.now(), "stage_timings": stage_timings
+            }})
+            self.log(f"Resume with: python auto_pipeline.py resume {material_id}")
             return {"status": "error", "message": error_message}
 
 def main():
-    if len(sys.argv) != 3:
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if args[:1] == ["followups"] and len(args) == 2 and not flags:
+        pipeline = PipelineRunner()
+        try:
+            result = pipeline.run_followups(**json.loads(args[1]))
+        finally:
+            pipeline.close()
+        print(json.dumps(result))
+        return
+    if len(args) != 2 or set(flags) - {"--subprocess"}:
         print(json.dumps({
             "status": "error",
-            "message": "Usage: python auto_pipeline.py <relative_pdf_path> <material_id>"
+            "message": "Usage: python auto_pipeline.py <relative_pdf_path> <material_id> [--subprocess]\n"
+                       "       python auto_pipeline.py resume <material_id> [--subprocess]\n"
+                       "       python auto_pipeline.py followups <payload_json>"
         }))
         sys.exit(2) 
 
-    pdf_path_arg = sys.argv[1]
-    material_id_arg = sys.argv[2]
-    
-    pipeline = PipelineRunner()
-    result = pipeline.execute_pipeline(pdf_path_arg, material_id_arg)
+    pipeline = PipelineRunner(in_process=False if "--subprocess" in flags else None)
+    try:
+        if args[0] == "resume":
+            result = pipeline.resume(args[1])
+        else:
+            result = pipeline.execute_pipeline(args[0], args[1])
+    finally:
+        pipeline.close()
     print(json.dumps(result))
 
 if __name__ == "__main__":
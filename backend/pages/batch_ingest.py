@@ -0,0 +1,351 @@
+"""Ingest a directory (or manifest) of PDFs as materials, several documents at a time.
+
+    python batch_ingest.py ../course_pdfs --subject python --uploaded-by <teacher_id>
+    python batch_ingest.py ../course_pdfs/batch_manifest.json   # resume
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import fitz
+from bson import ObjectId
+from db import db
+from metrics import span, inc
+from checkpoints import PipelineCheckpoint
+from auto_pipeline import PipelineRunner
+import extract
+
+# The Material model's subject enum
+SUBJECTS = ["python", "java", "cpp", "c", "mixed"]
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "input_pdfs")
+MANIFEST_NAME = "batch_manifest.json"
+
+# Documents in OCR at once, in model stages at once, and extracted ones waiting for an LLM slot
+OCR_SLOTS = int(os.getenv("BATCH_OCR_SLOTS", "1"))
+LLM_SLOTS = int(os.getenv("BATCH_LLM_SLOTS", "2"))
+QUEUE_DEPTH = int(os.getenv("BATCH_QUEUE_DEPTH", "2"))
+
+_DONE = object()
+
+class Manifest:
+    """Per-document state of a batch, rewritten atomically after every change"""
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.state = state or {"documents": []}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        # Relative sources in a hand-written manifest are relative to the manifest
+        base = os.path.dirname(os.path.abspath(path))
+        for doc in state.setdefault("documents", []):
+            doc["source"] = os.path.normpath(os.path.join(base, doc["source"]))
+            # Hand-written entries may name a material_id without a status
+            doc.setdefault("status", "pending")
+        return cls(path, state)
+
+    @property
+    def documents(self):
+        return self.state["documents"]
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, indent=2, default=str)
+            os.replace(tmp_path, self.path)
+
+    def update(self, doc, **fields):
+        with self.lock:
+            doc.update(fields)
+        self.save()
+
+def open_manifest(source, manifest_path=None):
+    """The manifest for a directory of PDFs (new files are added on every run) or a manifest file"""
+    if os.path.isfile(source):
+        return Manifest.load(source)
+    if not os.path.isdir(source):
+        raise ValueError(f"Not a directory or manifest: {source}")
+
+    manifest_path = manifest_path or os.path.join(source, MANIFEST_NAME)
+    manifest = Manifest.load(manifest_path) if os.path.exists(manifest_path) else Manifest(manifest_path)
+    known = {doc["source"] for doc in manifest.documents}
+    for path in sorted(glob.glob(os.path.join(source, "**", "*.pdf"), recursive=True)):
+        path = os.path.normpath(os.path.abspath(path))
+        if path not in known:
+            manifest.documents.append({"source": path})
+    return manifest
+
+def prepare_documents(manifest, subject=None, uploaded_by=None):
+    """Give every new document its upload path and material id, copy the PDFs into
+    input_pdfs/<subject>/ as the upload route does, and create the missing material
+    records in one insert. Safe to repeat: names and ids are saved before anything is written."""
+    manifest.state["subject"] = subject = subject or manifest.state.get("subject")
+    manifest.state["uploaded_by"] = uploaded_by = uploaded_by or manifest.state.get("uploaded_by")
+    if not uploaded_by or not ObjectId.is_valid(uploaded_by):
+        raise ValueError("A valid --uploaded-by user id is required")
+    manifest.state.setdefault("created_at", datetime.now().isoformat())
+
+    stamp = int(time.time() * 1000)
+    for i, doc in enumerate(manifest.documents):
+        if doc.get("material_id"):
+            continue
+        doc_subject = (doc.get("subject") or subject or "").lower()
+        if doc_subject not in SUBJECTS:
+            raise ValueError(f"Invalid subject {doc_subject!r} for {doc['source']}; expected one of {SUBJECTS}")
+        # Upload names are <ms>_<name>; adding the index keeps them unique within a batch
+        filename = f"{stamp + i}_{os.path.basename(doc['source']).replace(' ', '_')}"
+        doc.update({
+            "subject": doc_subject,
+            "filename": filename,
+            "input_pdf": os.path.abspath(os.path.join(INPUT_DIR, doc_subject, filename)),
+            "material_id": str(ObjectId()),
+            "status": "pending",
+        })
+    manifest.save()
+
+    for doc in manifest.documents:
+        if doc["status"] == "completed":
+            continue
+        if not os.path.exists(doc["input_pdf"]):
+            os.makedirs(os.path.dirname(doc["input_pdf"]), exist_ok=True)
+            shutil.copyfile(doc["source"], doc["input_pdf"])
+        if "pages" not in doc:
+            with fitz.open(doc["input_pdf"]) as pdf:
+                doc["pages"] = pdf.page_count
+    manifest.save()
+
+    ids = [ObjectId(doc["material_id"]) for doc in manifest.documents]
+    existing = {material["_id"] for material in db.materials.find({"_id": {"$in": ids}}, {"_id": 1})}
+    now = datetime.now(timezone.utc)
+    missing = [{
+        "_id": ObjectId(doc["material_id"]),
+        "originalName": os.path.basename(doc["source"]),
+        "filename": doc["filename"],
+        "filePath": doc["input_pdf"],
+        "subject": doc["subject"],
+        "status": "processing",
+        "uploadedBy": ObjectId(uploaded_by),
+        "createdAt": now,
+        "quiz_content": [],
+    } for doc in manifest.documents if ObjectId(doc["material_id"]) not in existing]
+    if missing:
+        with span("db_write", collection="materials", op="insert_many") as write_span:
+            db.materials.insert_many(missing)
+            write_span.set(documents=len(missing))
+    return len(missing)
+
+class BatchIngest:
+    def __init__(self, manifest, runner=None, ocr_slots=OCR_SLOTS, llm_slots=LLM_SLOTS, queue_depth=QUEUE_DEPTH):
+        # Stages hand blocks over in memory, so the runner is always in-process
+        self.runner = runner or PipelineRunner(in_process=True)
+        if self.runner.followup_mode != "queue":
+            # Follow-ups would hold an LLM slot per document; they run once every document is through
+            self.runner.followup_mode = "deferred"
+        self.manifest = manifest
+        self.ocr_slots = max(1, ocr_slots)
+        self.llm_slots = max(1, llm_slots)
+        self.ocr_workers = max(1, self.runner.ocr_workers // self.ocr_slots)
+        self.pending = queue.Queue()
+        self.ready = queue.Queue(maxsize=max(1, queue_depth))
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.totals = {"completed": 0, "failed": 0, "pages": 0, "ocr_s": 0.0, "llm_s": 0.0, "followups": 0}
+
+    def progress(self, doc, seconds):
+        with self.lock:
+            self.totals[doc["status"]] += 1
+            self.totals["pages"] += doc.get("pages") or 0
+            finished = self.totals["completed"] + self.totals["failed"]
+            elapsed = time.perf_counter() - self.started
+            rate = finished / elapsed
+            eta = (self.total - finished) / rate if rate else 0
+            print(f"[{finished}/{self.total}] {doc['status']} {os.path.basename(doc['source'])} in {seconds:.1f}s | "
+                  f"{rate * 3600:.1f} docs/h, {self.totals['pages'] * 60 / elapsed:.1f} pages/min, "
+                  f"eta {eta / 60:.1f} min", file=sys.stderr, flush=True)
+        inc("batch_documents_total", status=doc["status"])
+
+    def fail(self, doc, error, started):
+        self.runner.update_material(doc["material_id"], {"$set": {
+            "status": "failed", "error": str(error), "failed_at": datetime.now()
+        }})
+        self.manifest.update(doc, status="failed", error=str(error))
+        self.progress(doc, time.perf_counter() - started)
+
+    def ocr_loop(self):
+        while not self.stopping.is_set():
+            try:
+                doc = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            checkpoint = PipelineCheckpoint(doc["material_id"])
+            resume = checkpoint.load() and checkpoint.input_pdf == doc["input_pdf"]
+            page_blocks = None
+            # Nothing to OCR when an interrupted run got past extraction or the blocks are cached
+            if not (resume and checkpoint.is_complete("extract")) and not self.runner.extract_cached(doc["input_pdf"]):
+                self.manifest.update(doc, status="extracting")
+                try:
+                    with span("batch_ocr", subject=doc["subject"]) as ocr_span:
+                        ocr_span.set(material_id=doc["material_id"], pages=doc.get("pages"))
+                        page_blocks = extract.extract_page_blocks(
+                            doc["input_pdf"], workers=self.ocr_workers, mode=self.runner.extract_mode, raster=self.runner.ocr_raster
+                        )
+                except Exception as e:
+                    self.runner.log(f"Extraction failed for {doc['source']}: {e}", "ERROR")
+                    self.fail(doc, f"extract stage failed: {e}", started)
+                    continue
+            with self.lock:
+                self.totals["ocr_s"] += time.perf_counter() - started
+            self.manifest.update(doc, status="queued")
+            # Blocks while every LLM slot is busy and the queue is full
+            self.ready.put((doc, page_blocks, resume, started))
+
+    def llm_loop(self):
+        while True:
+            item = self.ready.get()
+            if item is _DONE:
+                return
+            doc, page_blocks, resume, started = item
+            if self.stopping.is_set():
+                # Extracted but not started; the next run extracts it again
+                self.manifest.update(doc, status="pending")
+                continue
+            llm_started = time.perf_counter()
+            retrying = doc.get("error") is not None
+            self.manifest.update(doc, status="running")
+            try:
+                if retrying:
+                    self.runner.update_material(doc["material_id"], {"$set": {"status": "processing"}, "$unset": {"error": "", "failed_at": ""}})
+                result = self.runner.execute_pipeline(doc["input_pdf"], doc["material_id"], resume=resume, page_blocks=page_blocks)
+            except Exception as e:
+                # execute_pipeline reports its own failures; this is e.g. the database going away
+                result = {"status": "error", "message": str(e)}
+            with self.lock:
+                self.totals["llm_s"] += time.perf_counter() - llm_started
+            if result["status"] == "success":
+                followups = result.get("followups") or {}
+                self.manifest.update(doc, status="completed", error=None, seconds=round(time.perf_counter() - started, 3),
+                                     followups=followups if followups.get("mode") == "deferred" else None)
+            else:
+                self.manifest.update(doc, status="failed", error=result.get("message"))
+            self.progress(doc, time.perf_counter() - started)
+
+    def close_queue(self, ocr_threads):
+        for thread in ocr_threads:
+            thread.join()
+        for _ in range(self.llm_slots):
+            self.ready.put(_DONE)
+
+    def run_followups(self):
+        # Includes follow-ups an interrupted run left behind for completed documents
+        todo = [doc for doc in self.manifest.documents if doc.get("followups") and doc["status"] == "completed"]
+        if not todo or self.stopping.is_set():
+            return
+        print(f"Running follow-ups for {len(todo)} document(s)", file=sys.stderr, flush=True)
+
+        def run(doc):
+            if self.stopping.is_set():
+                return
+            payload = {key: value for key, value in doc["followups"].items() if key != "mode"}
+            self.runner.run_followups(**payload)
+            self.manifest.update(doc, followups=None)
+            with self.lock:
+                self.totals["followups"] += 1
+
+        with ThreadPoolExecutor(max_workers=self.llm_slots) as pool:
+            list(pool.map(run, todo))
+
+    def run(self):
+        todo = [doc for doc in self.manifest.documents if doc["status"] != "completed"]
+        for doc in todo:
+            self.pending.put(doc)
+        self.total = len(todo)
+        self.started = time.perf_counter()
+        print(f"Ingesting {len(todo)} of {len(self.manifest.documents)} document(s): "
+              f"{self.ocr_slots} OCR slot(s) x {self.ocr_workers} worker(s), {self.llm_slots} LLM slot(s)", file=sys.stderr)
+
+        ocr_threads = [threading.Thread(target=self.ocr_loop, daemon=True) for _ in range(self.ocr_slots)]
+        threads = ocr_threads + [threading.Thread(target=self.llm_loop, daemon=True) for _ in range(self.llm_slots)]
+        threads.append(threading.Thread(target=self.close_queue, args=(ocr_threads,), daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            # Documents already in a model stage finish; a second interrupt exits at once
+            print("Interrupted: finishing documents in progress, rerun to resume the rest", file=sys.stderr)
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+        try:
+            self.run_followups()
+        except KeyboardInterrupt:
+            print("Interrupted: rerun to finish the remaining follow-ups", file=sys.stderr)
+            self.stopping.set()
+        return self.summary(len(self.manifest.documents) - len(todo))
+
+    def summary(self, skipped):
+        wall = time.perf_counter() - self.started
+        finished = self.totals["completed"] + self.totals["failed"]
+        status = "interrupted" if self.stopping.is_set() else "success" if not self.totals["failed"] else "partial"
+        return {
+            "status": status,
+            "manifest": self.manifest.path,
+            "documents": len(self.manifest.documents),
+            "completed": self.totals["completed"],
+            "failed": self.totals["failed"],
+            "skipped": skipped,
+            "followups": self.totals["followups"],
+            "pages": self.totals["pages"],
+            "wall_s": round(wall, 3),
+            "documents_per_hour": round(finished * 3600 / wall, 2) if wall else None,
+            "pages_per_min": round(self.totals["pages"] * 60 / wall, 2) if wall else None,
+            # Share of the run each pool spent working; both near 1 means neither waited on the other
+            "ocr_busy": round(self.totals["ocr_s"] / (wall * self.ocr_slots), 3) if wall else None,
+            "llm_busy": round(self.totals["llm_s"] / (wall * self.llm_slots), 3) if wall else None,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Create materials for a directory or manifest of PDFs and run their pipelines together")
+    parser.add_argument("source", help="Directory of PDFs, or a manifest JSON (also how an interrupted batch is resumed)")
+    parser.add_argument("--subject", choices=SUBJECTS, help="Subject of every document without its own")
+    parser.add_argument("--uploaded-by", help="User id of the teacher the materials belong to")
+    parser.add_argument("--manifest", help=f"Where to keep batch state for a directory (default: <dir>/{MANIFEST_NAME})")
+    parser.add_argument("--ocr-slots", type=int, default=OCR_SLOTS, help="Documents extracted at once")
+    parser.add_argument("--llm-slots", type=int, default=LLM_SLOTS, help="Documents in model stages at once")
+    parser.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH, help="Extracted documents that may wait for an LLM slot")
+    args = parser.parse_args()
+
+    try:
+        manifest = open_manifest(args.source, args.manifest)
+        created = prepare_documents(manifest, args.subject, args.uploaded_by)
+    except (ValueError, OSError) as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        sys.exit(2)
+    if created:
+        print(f"Created {created} material record(s)", file=sys.stderr)
+
+    runner = PipelineRunner(in_process=True)
+    try:
+        result = BatchIngest(manifest, runner, args.ocr_slots, args.llm_slots, args.queue_depth).run()
+    finally:
+        runner.close()
+    print(json.dumps(result))
+    sys.exit(0 if result["status"] == "success" else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from common import SYNTHETIC_VOCABULARY, peak_rss_mb, environment_info, finish_report, add_report_arguments
+
+import block_store
+import context_generator
+from extract import serialize_blocks
+
+# Roughly the label mix of a lecture PDF after classification
+TYPE_WEIGHTS = {"text": 55, "title": 5, "question": 15, "option": 15, "answer": 5, "header": 5}
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def synthetic_blocks(count, blocks_per_page=12, seed=0):
+    rng = random.Random(seed)
+    types, weights = list(TYPE_WEIGHTS), list(TYPE_WEIGHTS.values())
+    blocks = []
+    for i in range(count):
+        block_type = rng.choices(types, weights)[0]
+        words = rng.randint(4, 12) if block_type in ("title", "header", "option") else rng.randint(30, 120)
+        x0, y0 = rng.uniform(40, 300), rng.uniform(40, 700)
+        blocks.append({
+            "page": i // blocks_per_page + 1,
+            "bbox": [round(x0, 2), round(y0, 2), round(x0 + 250, 2), round(y0 + 40, 2)],
+            "text": " ".join(rng.choice(SYNTHETIC_VOCABULARY) for _ in range(words)).capitalize() + ".",
+            "type": block_type,
+            "extraction": {"method": "text_layer", "page_ms": round(rng.uniform(0.5, 5), 1)},
+        })
+    return blocks
+
+def best_of(repeats, func):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings), 6), result
+
+def run_size(count, args, workdir):
+    blocks = synthetic_blocks(count)
+    last_page = blocks[-1]["page"]
+    pages = (last_page // 2, last_page // 2 + args.page_span - 1)
+    paths = {"json": os.path.join(workdir, f"{count}_labeled.json"), "blocks": os.path.join(workdir, f"{count}_labeled.blocks")}
+
+    def write_json():
+        with open(paths["json"], "w", encoding="utf-8") as f:
+            f.write(serialize_blocks(blocks))
+
+    results = {}
+    for artifact_format, write in (("json", write_json), ("blocks", lambda: block_store.write_blocks(paths["blocks"], blocks))):
+        path = paths[artifact_format]
+        write_s, _ = best_of(args.repeats, write)
+        read_s, everything = best_of(args.repeats, lambda: block_store.read_blocks(path))
+        content_s, content = best_of(args.repeats, lambda: context_generator.load_blocks(path))
+        pages_s, page_range = best_of(args.repeats, lambda: block_store.read_blocks(path, pages=pages))
+        results[f"{artifact_format}/{count}"] = {
+            "blocks": len(everything),
+            "mb": round(os.path.getsize(path) / 2**20, 3),
+            "write_s": write_s,
+            "read_all_s": read_s,
+            "read_content_s": content_s,
+            "content_blocks": len(content),
+            "read_pages_s": pages_s,
+            "page_blocks": len(page_range),
+        }
+    json_result, blocks_result = results[f"json/{count}"], results[f"blocks/{count}"]
+    blocks_result["size_ratio"] = round(blocks_result["mb"] / json_result["mb"], 3)
+    blocks_result["content_speedup"] = round(json_result["read_content_s"] / blocks_result["read_content_s"], 2)
+    blocks_result["pages_speedup"] = round(json_result["read_pages_s"] / blocks_result["read_pages_s"], 2)
+    print(f"{count} blocks: {json_result['mb']} MB JSON -> {blocks_result['mb']} MB, "
+          f"content read {blocks_result['content_speedup']}x, page range {blocks_result['pages_speedup']}x", file=sys.stderr)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Size and read time of labeled JSON against .blocks artifacts")
+    parser.add_argument("--sizes", type=int_list, default=[2000, 20000, 100000], help="Blocks per document, e.g. 2000,20000")
+    parser.add_argument("--page-span", type=int, default=10, help="Pages in the page-range read")
+    parser.add_argument("--repeats", type=int, default=3, help="Best of this many runs per measurement")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_artifacts_")
+    report = {
+        "benchmark": "artifacts",
+        "environment": environment_info(),
+        "config": {"sizes": args.sizes, "page_span": args.page_span, "repeats": args.repeats, "codec": "msgpack" if block_store.msgpack else "json"},
+        "scenarios": {},
+    }
+    try:
+        for count in args.sizes:
+            report["scenarios"].update(run_size(count, args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report["peak_rss_mb"] = peak_rss_mb()
+    sys.exit(finish_report(report, "artifacts", args.output, args.baseline, args.save_baseline, args.tolerance, args.require_baseline))
+
+if __name__ == "__main__":
+    main()
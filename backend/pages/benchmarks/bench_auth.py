@@ -0,0 +1,101 @@
+import sys
+import time
+import asyncio
+import argparse
+
+from common import Meter, percentile, peak_rss_mb, use_database, environment_info, finish_report, add_report_arguments
+
+PASSWORD = "benchmark-password"
+
+async def loop_lag(stop, interval=0.01):
+    """Longest time the event loop was late waking a 10ms sleeper, i.e. how long handlers were blocked"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+async def login_storm(login, usernames, logins):
+    latencies = []
+
+    async def one(i):
+        await login(usernames[i % len(usernames)], PASSWORD)
+        latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    # Let the lag probe start before the storm hits
+    await asyncio.sleep(0)
+    # Every login arrives at once, so latency counts from the start of the
+    # storm: a blocking handler makes the others wait before they even start
+    started = time.perf_counter()
+    with Meter() as meter:
+        await asyncio.gather(*(one(i) for i in range(logins)))
+    stop.set()
+    return {
+        **meter.result(),
+        "p50_s": round(percentile(latencies, 0.5), 4),
+        "p95_s": round(percentile(latencies, 0.95), 4),
+        "p99_s": round(percentile(latencies, 0.99), 4),
+        "ops_per_s": round(logins / meter.wall, 2),
+        "loop_lag_max_s": round(await lag, 4),
+    }
+
+def verify_throughput(auth, tokens, rounds, cached):
+    calls = 0
+    with Meter() as meter:
+        for _ in range(rounds):
+            if not cached:
+                auth.token_cache.clear()
+            for token in tokens:
+                assert auth.AuthManager.verify_token(token) is not None
+                calls += 1
+    return {**meter.result(), "ops_per_s": round(calls / meter.wall, 2)}
+
+async def run(args):
+    use_database(args.mongo)
+    import auth
+
+    auth.PBKDF2_ITERATIONS = args.iterations
+    AuthManager = auth.AuthManager
+    usernames = [f"bench_user_{i}" for i in range(args.users)]
+    await asyncio.gather(*(AuthManager.register_user_async(name, f"{name}@example.com", PASSWORD, "student") for name in usernames))
+
+    async def blocking_login(username, password):
+        # What an `async def` handler calling the synchronous method does
+        return AuthManager.login_user(username, password)
+
+    scenarios = {}
+    for name, login in (("sync", blocking_login), ("async", AuthManager.login_user_async)):
+        print(f"Running login_storm/{name}...", file=sys.stderr)
+        scenarios[f"login_storm/{name}"] = await login_storm(login, usernames, args.logins)
+
+    tokens = [(await AuthManager.login_user_async(name, PASSWORD))["token"] for name in usernames]
+    for cached in (False, True):
+        name = "cached" if cached else "uncached"
+        print(f"Running verify_token/{name}...", file=sys.stderr)
+        scenarios[f"verify_token/{name}"] = verify_throughput(auth, tokens, args.verify_rounds, cached)
+    scenarios["login_storm/async"]["peak_rss_mb"] = peak_rss_mb()
+    return scenarios
+
+def main():
+    parser = argparse.ArgumentParser(description="Login storm and token verification benchmark for AuthManager")
+    parser.add_argument("--logins", type=int, default=300, help="Concurrent logins per storm")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=100000, help="PBKDF2 iterations (production uses 100000)")
+    parser.add_argument("--verify-rounds", type=int, default=200, help="Passes over the issued tokens")
+    parser.add_argument("--mongo", choices=["mock", "local"], default="mock", help="mongomock, or MONGO_URI with a scratch database")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "auth",
+        "environment": environment_info(),
+        "config": {key: getattr(args, key) for key in ("logins", "users", "iterations", "verify_rounds", "mongo")},
+        "scenarios": asyncio.run(run(args)),
+    }
+    sys.exit(finish_report(report, "auth", args.output, args.baseline, args.save_baseline, args.tolerance, args.require_baseline))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+from common import Meter, peak_rss_mb, make_synthetic_pdf, run_isolated, environment_info, finish_report, add_report_arguments
+
+SETTINGS = {
+    "fixed": {"raster": "fixed", "memory_mb": 0},
+    "adaptive": {"raster": "adaptive", "memory_mb": 0},
+    "adaptive_capped": {"raster": "adaptive", "memory_mb": None},  # --memory-mb
+}
+
+def make_slides_pdf(path, pages, width=960, height=540, fontsize=32):
+    """Widescreen slide deck with a few lines of large type per page"""
+    import fitz
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        page = doc.new_page(width=width, height=height)
+        page.insert_textbox(fitz.Rect(40, 40, width - 40, height - 40),
+                            f"Slide {number}\nGenerators yield values lazily\nClosures capture their scope", fontsize=fontsize)
+    doc.save(path, deflate=True)
+    return path
+
+def make_poster_pdf(path, pages):
+    """A1-sized pages of body text, where a fixed 300 dpi raster is over 80 megapixels"""
+    import fitz
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=1684, height=2384)
+        page.insert_textbox(fitz.Rect(60, 60, 1624, 2324), "iterator decorator closure comprehension " * 1000, fontsize=10)
+    doc.save(path, deflate=True)
+    return path
+
+def run_scenario(scenario):
+    """Extract one PDF with every page forced through OCR in the scenario's raster setting"""
+    if scenario["skip_tesseract"]:
+        # Measure rasterization and the hand-off alone on machines without Tesseract
+        import pytesseract
+        pytesseract.image_to_string = lambda image, *args, **kwargs: ""
+    import extract
+
+    with Meter() as meter:
+        results = list(extract.iter_page_results(scenario["pdf"], workers=scenario["workers"], mode="ocr", raster=scenario["raster"]))
+    summary = extract.summarize_extraction(results)
+    return {
+        **meter.result(),
+        "pages": len(results),
+        "pages_per_s": round(len(results) / meter.wall, 2),
+        "ocr_dpi_mean": summary.get("ocr_dpi_mean"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR throughput and peak memory of each rasterization setting")
+    parser.add_argument("--pages", type=int, default=8, help="Pages per generated document")
+    parser.add_argument("--workers", type=int, default=2, help="OCR worker processes (1 = serial)")
+    parser.add_argument("--memory-mb", type=int, default=256, help="OCR_WORKER_MEMORY_MB of the capped setting")
+    parser.add_argument("--skip-tesseract", action="store_true", help="Rasterize and hand off pages without running Tesseract")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    if args.scenario:
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(run_scenario(json.loads(args.scenario)), f)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_ocr_")
+    documents = {
+        "scanned": make_synthetic_pdf(os.path.join(workdir, "scanned.pdf"), args.pages, scanned=True),
+        "text": make_synthetic_pdf(os.path.join(workdir, "text.pdf"), args.pages),
+        "slides": make_slides_pdf(os.path.join(workdir, "slides.pdf"), args.pages),
+        "poster": make_poster_pdf(os.path.join(workdir, "poster.pdf"), max(1, args.pages // 4)),
+    }
+    report = {
+        "benchmark": "ocr",
+        "environment": environment_info(),
+        "config": {key: getattr(args, key) for key in ("pages", "workers", "memory_mb", "skip_tesseract")},
+        "scenarios": {},
+    }
+    try:
+        for setting, options in SETTINGS.items():
+            memory_mb = args.memory_mb if options["memory_mb"] is None else options["memory_mb"]
+            for document, pdf in documents.items():
+                label = f"{setting}/{document}"
+                print(f"Running {label}...", file=sys.stderr)
+                scenario = {"pdf": pdf, "raster": options["raster"], "workers": args.workers, "skip_tesseract": args.skip_tesseract}
+                report["scenarios"][label] = run_isolated(os.path.abspath(__file__), scenario, {"OCR_WORKER_MEMORY_MB": str(memory_mb)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(finish_report(report, "ocr", args.output, args.baseline, args.save_baseline, args.tolerance, args.require_baseline))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (
+    PAGES_DIR, Meter, percentile, peak_rss_mb, use_database, make_synthetic_pdf, start_fake_llm,
+    llm_stats, llm_delta, run_isolated, environment_info, finish_report, add_report_arguments,
+)
+
+# Benchmark inputs and outputs live under their own subject so cleanup never
+# touches real materials.
+SUBJECT = "benchmark"
+INPUT_DIR = os.path.join(PAGES_DIR, "input_pdfs", SUBJECT)
+OUTPUT_DIRS = [os.path.join(PAGES_DIR, folder, SUBJECT) for folder in ("input_pdfs", "extracted_text", "generated_quizzes", "generated_flashcards")]
+CHECKED_IN_PDFS = os.path.join(PAGES_DIR, "..", "input_pdfs", "python", "*.pdf")
+
+def llm_metrics(before):
+    delta = llm_delta(before, llm_stats(os.environ["OLLAMA_HOST"]))
+    return {
+        "llm_calls": delta["calls"],
+        "llm_prompt_tokens": delta["prompt_tokens"],
+        "llm_output_tokens": delta["output_tokens"],
+        "llm_max_in_flight": delta["max_in_flight"],
+        "llm_by_kind": delta["by_kind"],
+    }
+
+def run_pipeline_scenario(scenario):
+    """Upload one PDF `copies` times at once and time the whole pipeline and each stage"""
+    use_database(scenario["mongo"])
+    import fitz
+    import auto_pipeline
+
+    class MeasuredRunner(auto_pipeline.PipelineRunner):
+        stage_timings = []
+
+        def init_logging(self):
+            self.log_file = scenario["log_file"]
+            super().init_logging()
+
+        def run_memory_stage(self, stage, *args, **kwargs):
+            with Meter() as meter:
+                result = super().run_memory_stage(stage, *args, **kwargs)
+            self.stage_timings.append((stage, meter.result()))
+            return result
+
+    source = os.path.join(PAGES_DIR, scenario["pdf"])
+    pages = len(fitz.open(source))
+    copies = scenario["copies"]
+    uploads = []
+    for i in range(copies):
+        # Distinct names so concurrent uploads do not share artifact paths
+        name = os.path.basename(source) if copies == 1 else f"{os.path.splitext(os.path.basename(source))[0]}_c{i}.pdf"
+        target = os.path.join(INPUT_DIR, name)
+        if os.path.abspath(target) != os.path.abspath(source):
+            shutil.copyfile(source, target)
+        material_id = auto_pipeline.db.materials.insert_one({"filename": name, "subject": SUBJECT, "status": "processing"}).inserted_id
+        uploads.append((f"input_pdfs/{SUBJECT}/{name}", str(material_id)))
+
+    latencies, statuses = [], []
+    lock = threading.Lock()
+
+    def upload(args):
+        with Meter() as meter:
+            result = MeasuredRunner().execute_pipeline(*args)
+        with lock:
+            latencies.append(meter.wall)
+            statuses.append(result["status"])
+
+    before = llm_stats(os.environ["OLLAMA_HOST"], reset_peak=True)
+    with Meter() as meter:
+        with ThreadPoolExecutor(max_workers=copies) as pool:
+            list(pool.map(upload, uploads))
+
+    stages = {}
+    for stage, timing in MeasuredRunner.stage_timings:
+        totals = stages.setdefault(stage, {"wall_s": 0.0, "cpu_s": 0.0})
+        for metric, value in timing.items():
+            totals[metric] += value / copies
+    result = {
+        "pdf": scenario["pdf"],
+        "pages": pages,
+        "uploads": copies,
+        "succeeded": statuses.count("success"),
+        **meter.result(),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {stage: {metric: round(value, 4) for metric, value in totals.items()} for stage, totals in stages.items()},
+        **llm_metrics(before),
+    }
+    if copies > 1:
+        result.update({
+            "p50_s": round(percentile(latencies, 0.5), 4),
+            "p95_s": round(percentile(latencies, 0.95), 4),
+            "uploads_per_min": round(copies * 60 / meter.wall, 2),
+            "pages_per_s": round(copies * pages / meter.wall, 2),
+        })
+    return {scenario["name"]: result}
+
+def run_batch_scenario(scenario):
+    """The same documents through execute_pipeline one after another, then through batch_ingest"""
+    use_database(scenario["mongo"])
+    os.environ["PIPELINE_LOG_FILE"] = scenario["log_file"]
+    import fitz
+    import auto_pipeline
+    import batch_ingest
+
+    # Batch copies land in input_pdfs/<subject>/ like uploads; keep them under the benchmark subject
+    batch_ingest.INPUT_DIR = os.path.join(PAGES_DIR, "input_pdfs")
+    batch_ingest.SUBJECTS = [SUBJECT]
+    source = os.path.join(PAGES_DIR, scenario["pdf"])
+    pages = len(fitz.open(source))
+    count = scenario["documents"]
+    source_dir = os.path.join(INPUT_DIR, "batch_source")
+    os.makedirs(source_dir, exist_ok=True)
+    for i in range(count):
+        shutil.copyfile(source, os.path.join(source_dir, f"doc_{i}.pdf"))
+        # Sequential runs read from the subject folder itself so artifacts stay under it
+        shutil.copyfile(source, os.path.join(INPUT_DIR, f"sequential_{i}.pdf"))
+
+    runner = auto_pipeline.PipelineRunner(in_process=True)
+    results = {}
+    before = llm_stats(os.environ["OLLAMA_HOST"], reset_peak=True)
+    statuses = []
+    with Meter() as meter:
+        for i in range(count):
+            material_id = auto_pipeline.db.materials.insert_one({"filename": f"sequential_{i}.pdf", "subject": SUBJECT, "status": "processing"}).inserted_id
+            statuses.append(runner.execute_pipeline(f"input_pdfs/{SUBJECT}/sequential_{i}.pdf", str(material_id))["status"])
+    results[f"sequential/{count}"] = {
+        "documents": count,
+        "succeeded": statuses.count("success"),
+        **meter.result(),
+        "documents_per_min": round(count * 60 / meter.wall, 2),
+        "pages_per_s": round(count * pages / meter.wall, 2),
+        **llm_metrics(before),
+    }
+
+    manifest = batch_ingest.open_manifest(source_dir, os.path.join(INPUT_DIR, "batch_manifest.json"))
+    batch_ingest.prepare_documents(manifest, SUBJECT, "0" * 24)
+    before = llm_stats(os.environ["OLLAMA_HOST"], reset_peak=True)
+    with Meter() as meter:
+        summary = batch_ingest.BatchIngest(manifest, runner, scenario["ocr_slots"], scenario["llm_slots"]).run()
+    runner.close()
+    results[f"batch/{count}"] = {
+        "documents": count,
+        "succeeded": summary["completed"],
+        **meter.result(),
+        "documents_per_min": round(count * 60 / meter.wall, 2),
+        "pages_per_s": round(count * pages / meter.wall, 2),
+        "ocr_busy": summary["ocr_busy"],
+        "llm_busy": summary["llm_busy"],
+        "peak_rss_mb": peak_rss_mb(),
+        **llm_metrics(before),
+    }
+    return results
+
+def synthetic_quiz(num_questions=10):
+    return [{
+        "question": f"Benchmark question {i + 1}?",
+        "options": {"A": f"Option A{i}", "B": f"Option B{i}", "C": f"Option C{i}", "D": f"Option D{i}"},
+        "answer": "ABCD"[i % 4],
+    } for i in range(num_questions)]
+
+def wrong_answers(quiz, offset=1):
+    return [{
+        "questionIndex": i,
+        "selectedOption": "ABCD"[("ABCD".index(q["answer"]) + offset) % 4],
+        "isCorrect": False,
+    } for i, q in enumerate(quiz)]
+
+def run_tutor_scenario(scenario):
+    """One student through ai_tutor.main (cold, then warm cache), then N students at once"""
+    database = use_database(scenario["mongo"])
+    import ai_tutor
+    import explanation_cache
+
+    ai_tutor.TUTOR_EXPLANATIONS_DIR = scenario["output_dir"]
+    quiz = synthetic_quiz()
+    material_id = str(database.materials.insert_one({"filename": "benchmark_quiz.pdf", "status": "completed", "quiz_content": quiz}).inserted_id)
+    answers_path = os.path.join(scenario["output_dir"], "answers.json")
+    os.makedirs(scenario["output_dir"], exist_ok=True)
+    with open(answers_path, "w", encoding="utf-8") as f:
+        json.dump({"answers": wrong_answers(quiz)}, f)
+
+    results = {}
+    for phase in ("cold", "warm"):
+        before = llm_stats(os.environ["OLLAMA_HOST"], reset_peak=True)
+        sys.argv = ["ai_tutor.py", material_id, answers_path, f"bench-{phase}", "benchmark"]
+        with Meter() as meter:
+            ai_tutor.main()
+        results[f"tutor/{phase}"] = {**meter.result(), "peak_rss_mb": peak_rss_mb(), **llm_metrics(before)}
+
+    # Concurrent students start from an empty cache and pick different wrong options
+    database.db.drop_collection("explanation_cache")
+    explanation_cache._default_cache = None
+    students = scenario["students"]
+    latencies = []
+
+    def session(student):
+        with Meter() as meter:
+            ai_tutor.run_tutor_session(material_id, wrong_answers(quiz, 1 + student % 3), f"bench-{student}", "benchmark")
+        latencies.append(meter.wall)
+
+    before = llm_stats(os.environ["OLLAMA_HOST"], reset_peak=True)
+    with Meter() as meter:
+        with ThreadPoolExecutor(max_workers=students) as pool:
+            list(pool.map(session, range(students)))
+    results[f"tutor/concurrent-{students}"] = {
+        **meter.result(),
+        "peak_rss_mb": peak_rss_mb(),
+        "p50_s": round(percentile(latencies, 0.5), 4),
+        "p95_s": round(percentile(latencies, 0.95), 4),
+        "sessions_per_s": round(students / meter.wall, 2),
+        **llm_metrics(before),
+    }
+    return results
+
+SCENARIOS = {
+    "pipeline": run_pipeline_scenario,
+    "tutor": run_tutor_scenario,
+    "batch": run_batch_scenario,
+}
+
+def prepare_inputs(args):
+    os.makedirs(INPUT_DIR, exist_ok=True)
+    pdfs = []
+    for path in sorted(glob.glob(CHECKED_IN_PDFS)):
+        target = os.path.join(INPUT_DIR, os.path.basename(path))
+        shutil.copyfile(path, target)
+        pdfs.append(target)
+    for pages in args.synthetic_pages:
+        kind = "scanned" if args.scanned else "text"
+        pdfs.append(make_synthetic_pdf(os.path.join(INPUT_DIR, f"synthetic_{kind}_{pages}p.pdf"), pages, scanned=args.scanned))
+    return [os.path.relpath(path, PAGES_DIR) for path in pdfs]
+
+def build_scenarios(args, pdfs):
+    common = {"mongo": args.mongo, "log_file": os.path.join(INPUT_DIR, "pipeline_logs.txt")}
+    scenarios = []
+    if "pipeline" in args.only:
+        for pdf in pdfs:
+            name = os.path.splitext(os.path.basename(pdf))[0]
+            scenarios.append({**common, "kind": "pipeline", "name": f"pipeline/{name}", "pdf": pdf, "copies": 1})
+    if "concurrent" in args.only and pdfs:
+        for copies in args.concurrency:
+            scenarios.append({**common, "kind": "pipeline", "name": f"concurrent/{copies}", "pdf": pdfs[0], "copies": copies})
+    if "batch" in args.only and pdfs:
+        scenarios.append({**common, "kind": "batch", "name": f"batch/{args.batch_documents}", "pdf": pdfs[0],
+                          "documents": args.batch_documents, "ocr_slots": args.batch_ocr_slots, "llm_slots": args.batch_llm_slots})
+    if "tutor" in args.only:
+        scenarios.append({**common, "kind": "tutor", "students": args.tutor_students, "output_dir": os.path.join(INPUT_DIR, "tutor")})
+    return scenarios
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the material pipeline and AI tutor against a stub LLM")
+    parser.add_argument("--only", type=lambda v: v.split(","), default=["pipeline", "concurrent", "batch", "tutor"],
+                        help="Comma-separated subset of pipeline,concurrent,batch,tutor")
+    parser.add_argument("--synthetic-pages", type=int_list, default=[40, 160], help="Sizes of generated PDFs, e.g. 40,160 ('' for none)")
+    parser.add_argument("--scanned", action="store_true", help="Generate image-only PDFs so every page is OCR'd")
+    parser.add_argument("--concurrency", type=int_list, default=[4], help="Concurrent uploads of the first PDF, e.g. 2,4,8")
+    parser.add_argument("--batch-documents", type=int, default=6, help="Copies of the first PDF ingested sequentially, then as one batch")
+    parser.add_argument("--batch-ocr-slots", type=int, default=1)
+    parser.add_argument("--batch-llm-slots", type=int, default=2)
+    parser.add_argument("--tutor-students", type=int, default=8)
+    parser.add_argument("--mongo", choices=["mock", "local"], default="mock", help="mongomock, or MONGO_URI with a scratch database")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Stub LLM delay per request")
+    parser.add_argument("--ms-per-token", type=float, default=0.5, help="Stub LLM delay per output token")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the artifact cache on (measures cache hits, not work)")
+    parser.add_argument("--verbose", action="store_true", help="Show scenario output")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    if args.scenario:
+        # Child process: run one scenario and hand the numbers back through a file
+        scenario = json.loads(args.scenario)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(SCENARIOS[scenario["kind"]](scenario), f)
+        return
+
+    server, url = start_fake_llm(args.latency_ms, args.ms_per_token)
+    env = {
+        "OLLAMA_HOST": url,
+        "ARTIFACT_CACHE": "1" if args.warm_cache else "0",
+        "TUTOR_PREWARM": "0",
+        "QUESTION_BANK_SIZE": "0",
+        # Keep the vector index inside the measured run rather than a detached process
+        "PIPELINE_FOLLOWUPS": "inline",
+        "EXPLANATION_CACHE_BACKEND": "mongo",
+    }
+    report = {
+        "benchmark": "pipeline",
+        "environment": environment_info(),
+        "config": {key: getattr(args, key) for key in ("synthetic_pages", "scanned", "concurrency", "batch_documents", "batch_ocr_slots", "batch_llm_slots", "tutor_students", "mongo", "latency_ms", "ms_per_token", "warm_cache")},
+        "scenarios": {},
+    }
+    try:
+        pdfs = prepare_inputs(args)
+        for scenario in build_scenarios(args, pdfs):
+            label = scenario.get("name", scenario["kind"])
+            print(f"Running {label}...", file=sys.stderr)
+            result = run_isolated(os.path.abspath(__file__), scenario, env, verbose=args.verbose)
+            if "error" in result:
+                report["scenarios"][label] = result
+            else:
+                report["scenarios"].update(result)
+    finally:
+        server.terminate()
+        for path in OUTPUT_DIRS:
+            shutil.rmtree(path, ignore_errors=True)
+
+    sys.exit(finish_report(report, "pipeline", args.output, args.baseline, args.save_baseline, args.tolerance, args.require_baseline))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from common import Meter, percentile, peak_rss_mb, environment_info, finish_report, add_report_arguments
+
+import vector_index
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+class FixedEmbedder:
+    # Vectors are generated up front; only the name is recorded in the index
+    backend = "bench"
+    model = "synthetic"
+
+def synthetic_corpus(size, dim, topics, rng):
+    """Passages drawn around `topics` centres, like chapters of many materials"""
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, size)
+    vectors = centres[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    passages = [{"page": int(i // 4) + 1, "text": f"passage {i}"} for i in range(size)]
+    return vectors, passages, centres
+
+def time_queries(index, queries, k, probes):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(index.search(query, k, probes)[0])
+        latencies.append(time.perf_counter() - started)
+    return latencies, results
+
+def run_size(size, args, rng, workdir):
+    vectors, passages, centres = synthetic_corpus(size, args.dim, max(8, size // 500), rng)
+    # Queries sit near a passage, as a question sits near the text it was written from
+    picks = rng.integers(0, size, args.queries)
+    queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    results = {}
+    layouts = [("flat", 0)]
+    if size >= args.partition_from:
+        layouts.append(("partitioned", int(np.sqrt(size))))
+    exact = None
+    for layout, partitions in layouts:
+        path = os.path.join(workdir, f"{size}_{layout}")
+        with Meter() as build:
+            index = vector_index.VectorIndex.write(path, passages, vectors, FixedEmbedder(), f"{size:012d}{layout}", partitions=partitions)
+        # Reopen so searches go through the memory map, as the tutor's do
+        index = vector_index.VectorIndex(path, index.meta)
+        latencies, found = time_queries(index, queries, args.k, args.probes)
+        result = {
+            "passages": size,
+            "build_s": build.result()["wall_s"],
+            "p50_s": round(percentile(latencies, 0.5), 6),
+            "p95_s": round(percentile(latencies, 0.95), 6),
+            "p99_s": round(percentile(latencies, 0.99), 6),
+            "ops_per_s": round(len(latencies) / sum(latencies), 1),
+            "index_mb": round(os.path.getsize(os.path.join(path, index.meta["vectors_file"])) / 2**20, 2),
+        }
+        ids = [{hit[1]["text"] for hit in hits} for hits in found]
+        if exact is None:
+            exact = ids
+        else:
+            result["recall_at_k"] = round(float(np.mean([len(a & b) / max(1, len(a)) for a, b in zip(exact, ids)])), 4)
+        results[f"{layout}/{size}"] = result
+        print(f"{layout}/{size}: p50 {result['p50_s'] * 1000:.2f} ms", file=sys.stderr)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector index query latency against corpus size")
+    parser.add_argument("--sizes", type=int_list, default=[1000, 10000, 100000], help="Passages per corpus, e.g. 1000,10000")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding width (nomic-embed-text is 768)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=3, help="Passages per query, as the tutor asks for")
+    parser.add_argument("--probes", type=int, default=vector_index.DEFAULT_PROBES, help="Clusters scanned per query")
+    parser.add_argument("--partition-from", type=int, default=10000, help="Also measure a clustered index from this size up")
+    parser.add_argument("--seed", type=int, default=0)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench_vector_index_")
+    report = {
+        "benchmark": "vector_index",
+        "environment": environment_info(),
+        "config": {key: getattr(args, key) for key in ("sizes", "dim", "queries", "k", "probes", "partition_from", "seed")},
+        "scenarios": {},
+    }
+    try:
+        for size in args.sizes:
+            report["scenarios"].update(run_size(size, args, rng, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report["peak_rss_mb"] = peak_rss_mb()
+    sys.exit(finish_report(report, "vector_index", args.output, args.baseline, args.save_baseline, args.tolerance, args.require_baseline))
+
+if __name__ == "__main__":
+    main()
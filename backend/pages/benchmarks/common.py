@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import subprocess
+import urllib.request
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS, everything else still works
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGES_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+BENCH_DB_NAME = "MCQ-Benchmark"
+
+# Benchmarks import the page scripts the same way they import each other
+if PAGES_DIR not in sys.path:
+    sys.path.insert(0, PAGES_DIR)
+
+def cpu_seconds():
+    """CPU time of this process plus its reaped children (OCR pool workers)"""
+    if resource is None:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its largest reaped child"""
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / scale, 1)
+
+class Meter:
+    """Wall and CPU time of a block: `with Meter() as m: ...; m.result()`"""
+
+    def __enter__(self):
+        self.wall_start, self.cpu_start = time.perf_counter(), cpu_seconds()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall_start
+        self.cpu = cpu_seconds() - self.cpu_start
+
+    def result(self):
+        return {"wall_s": round(self.wall, 4), "cpu_s": round(self.cpu, 4)}
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+SYNTHETIC_VOCABULARY = (
+    "python function variable list tuple dictionary set loop iteration recursion class object "
+    "inheritance method attribute module package import exception handling generator iterator "
+    "decorator closure scope lambda comprehension string slicing file context manager thread "
+    "process memory garbage collection interpreter bytecode typing annotation testing"
+).split()
+
+def make_synthetic_pdf(path, pages, scanned=False, seed=0, dpi=150):
+    """Write a deterministic lecture-notes style PDF.
+
+    Scanned PDFs carry each page as an image with no text layer, so every page
+    goes through OCR; otherwise the text layer is used.
+    """
+    import random
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        page = doc.new_page(width=595, height=842)
+        paragraphs = [f"Chapter {number}: {rng.choice(SYNTHETIC_VOCABULARY).title()} and {rng.choice(SYNTHETIC_VOCABULARY)}"]
+        for _ in range(5):
+            words = [rng.choice(SYNTHETIC_VOCABULARY) for _ in range(rng.randint(50, 80))]
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        page.insert_textbox(fitz.Rect(50, 50, 545, 792), "\n\n".join(paragraphs), fontsize=10)
+
+    if scanned:
+        images = fitz.open()
+        for page in doc:
+            pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            images.new_page(width=page.rect.width, height=page.rect.height).insert_image(page.rect, pixmap=pixmap)
+        doc = images
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc.save(path, deflate=True)
+    return path
+
+def use_database(mongo):
+    """Point `from db import db` at a throwaway benchmark database; must run before importing the pipeline.
+
+    "mock" keeps everything in process memory (needs mongomock); "local" uses
+    MONGO_URI but a separate database that is dropped first.
+    """
+    import db as db_module
+    if mongo == "mock":
+        import mongomock
+        db_module.MongoClient = mongomock.MongoClient
+    database = db_module.Database(db_name=BENCH_DB_NAME)
+    database.client.drop_database(BENCH_DB_NAME)
+    database.ensure_indexes()
+    db_module.set_database(database)
+    return database
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_fake_llm(latency_ms=0, ms_per_token=0):
+    """Run fake_ollama.py in its own process so its CPU does not count against the code under test"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(PAGES_DIR, "fake_ollama.py"), "--port", str(port),
+         "--latency-ms", str(latency_ms), "--ms-per-token", str(ms_per_token)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/api/version", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Fake LLM server did not start")
+
+def llm_stats(url, reset_peak=False):
+    with urllib.request.urlopen(f"{url}/_stats{'?reset_peak=1' if reset_peak else ''}", timeout=5) as response:
+        return json.loads(response.read())
+
+def llm_delta(before, after):
+    """LLM calls and tokens spent between two /_stats snapshots (take `before` with reset_peak)"""
+    by_kind = {}
+    for kind, totals in after["by_kind"].items():
+        start = before["by_kind"].get(kind, {})
+        delta = {name: value - start.get(name, 0) for name, value in totals.items()}
+        if delta["calls"]:
+            by_kind[kind] = delta
+    return {
+        "calls": after["chat"] - before["chat"],
+        "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+        "output_tokens": after["output_tokens"] - before["output_tokens"],
+        "max_in_flight": after["max_in_flight"],
+        "by_kind": by_kind,
+    }
+
+def run_isolated(script, scenario, env, verbose=False, timeout=3600):
+    """Run one scenario in a fresh interpreter so peak RSS and module state belong to it alone"""
+    result_path = os.path.join(BENCH_DIR, f".result_{os.getpid()}_{time.time_ns()}.json")
+    command = [sys.executable, script, "--scenario", json.dumps(scenario), "--result", result_path]
+    output = None if verbose else subprocess.DEVNULL
+    try:
+        completed = subprocess.run(command, cwd=PAGES_DIR, env={**os.environ, **env}, stdout=output, stderr=output, timeout=timeout)
+        if completed.returncode != 0 or not os.path.exists(result_path):
+            return {"error": f"scenario exited with status {completed.returncode}"}
+        with open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        if os.path.exists(result_path):
+            os.remove(result_path)
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+# Metrics compared against the baseline. Counts are deterministic with the
+# stub LLM, so any increase is a regression; timings get a noise tolerance.
+LOWER_IS_BETTER = {"wall_s", "cpu_s", "peak_rss_mb", "p50_s", "p95_s", "p99_s", "loop_lag_max_s"}
+EXACT_COUNTS = {"llm_calls", "llm_prompt_tokens"}
+EXACT_MINIMUMS = {"succeeded"}
+# Sub-second timings vary by about 0.1 s between identical runs
+MIN_TIMING_DELTA_S = 0.15
+HIGHER_IS_BETTER = {"uploads_per_min", "pages_per_s", "sessions_per_s", "ops_per_s", "recall_at_k"}
+
+def flatten_metrics(report):
+    metrics = {}
+    for name, scenario in report.get("scenarios", {}).items():
+        for metric, value in scenario.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics[f"{name}.{metric}"] = value
+        for stage, timing in scenario.get("stages", {}).items():
+            for metric, value in timing.items():
+                metrics[f"{name}.stages.{stage}.{metric}"] = value
+    return metrics
+
+def compare_to_baseline(report, baseline, tolerance=0.25):
+    """Return a list of regressions: metrics that got worse than the baseline by more than the tolerance"""
+    current, previous = flatten_metrics(report), flatten_metrics(baseline)
+    regressions = []
+    for key, old in previous.items():
+        new = current.get(key)
+        metric = key.rsplit(".", 1)[-1]
+        if new is None or old is None:
+            continue
+        if metric in EXACT_COUNTS:
+            worse = new > old
+        elif metric in EXACT_MINIMUMS:
+            worse = new < old
+        elif metric in LOWER_IS_BETTER:
+            worse = new > old * (1 + tolerance) and new - old > MIN_TIMING_DELTA_S
+        elif metric in HIGHER_IS_BETTER:
+            worse = new < old * (1 - tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append({"metric": key, "baseline": old, "current": new})
+    return regressions
+
+def finish_report(report, name, output=None, baseline=None, save_baseline=False, tolerance=0.25, require_baseline=False):
+    """Write the report, compare it to the stored baseline and return the process exit code"""
+    baseline_path = baseline or os.path.join(BASELINE_DIR, f"{name}.json")
+    missing_baseline = not save_baseline and not os.path.exists(baseline_path)
+    if missing_baseline:
+        print(f"WARNING: no baseline at {baseline_path}; nothing to compare against (--save-baseline records one)", file=sys.stderr)
+    elif not save_baseline:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        report["regressions"] = compare_to_baseline(report, stored, tolerance)
+        if stored.get("config") != report.get("config"):
+            print("WARNING: baseline was recorded with a different configuration", file=sys.stderr)
+        report["baseline"] = os.path.relpath(baseline_path, PAGES_DIR)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+    if save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Baseline saved to {baseline_path}", file=sys.stderr)
+        return 0
+
+    if missing_baseline and require_baseline:
+        return 2
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']}", file=sys.stderr)
+    return 1 if report.get("regressions") else 0
+
+def add_report_arguments(parser):
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Baseline report to compare against (default: benchmarks/baselines/<name>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--require-baseline", action="store_true", help="Fail (exit 2) when there is no baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown for timings before it counts as a regression")
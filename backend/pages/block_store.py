@@ -0,0 +1,313 @@
+"""Compact columnar file for labeled blocks, readable without loading the whole document.
+
+Layout of a .blocks file (little-endian):
+
+    MAGIC
+    row group 0: text chunk, rest chunk
+    row group 1: ...
+    page column (int32 per block), type column (uint8 per block)
+    footer (JSON)
+    footer length (uint32), MAGIC
+
+Blocks are stored ROW_GROUP at a time. In each group the texts and the
+remaining fields (bbox, extraction, ...) are compressed separately, so a
+reader that only wants text never decodes the rest. The page and type columns
+are stored uncompressed and memory-mapped; filters run on them first and only
+the row groups holding a match are decompressed.
+
+Labeled JSON stays a first-class format: read_blocks() accepts either, and
+the CLI converts both ways.
+
+    python block_store.py from-json extracted_text/python/Unit_2_labeled.json
+    python block_store.py to-json extracted_text/python/Unit_2_labeled.blocks
+    python block_store.py info extracted_text/python/Unit_2_labeled.blocks
+"""
+
+import os
+import mmap
+import json
+import zlib
+import struct
+import argparse
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # the rest chunks fall back to JSON, which any reader can decode
+    msgpack = None
+
+MAGIC = b"MCQBLK1\n"
+FORMAT_VERSION = 1
+ROW_GROUP = 256
+# Level 1 already makes files ~5x smaller than the JSON; higher levels cost more write time than they save
+COMPRESSION_LEVEL = 1
+INDEXED_FIELDS = ("page", "type")
+TEXT_FIELD = "text"
+
+# json:   pretty-printed labeled JSON (original behaviour, read by hand and by older tools)
+# blocks: this module's columnar file
+ARTIFACT_FORMATS = ["json", "blocks"]
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "json")
+EXTENSIONS = {"json": ".json", "blocks": ".blocks"}
+
+def _pack(values):
+    if msgpack is not None:
+        return "msgpack", msgpack.packb(values, use_bin_type=True)
+    return "json", json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _unpack(codec, data):
+    if codec == "json":
+        return json.loads(data)
+    if msgpack is None:
+        raise RuntimeError("This block file was written with msgpack, which is not installed")
+    return msgpack.unpackb(data, raw=False)
+
+def _encode_texts(texts):
+    encoded = [text.encode("utf-8") for text in texts]
+    lengths = np.array([len(item) for item in encoded], dtype="<u4")
+    return zlib.compress(lengths.tobytes() + b"".join(encoded), COMPRESSION_LEVEL)
+
+def _decode_texts(data, rows):
+    raw = zlib.decompress(data)
+    lengths = np.frombuffer(raw, dtype="<u4", count=rows)
+    ends = (np.cumsum(lengths, dtype=np.int64) + lengths.nbytes).tolist()
+    starts = [lengths.nbytes] + ends[:-1]
+    return [raw[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+
+def dumps(blocks, row_group=ROW_GROUP):
+    """Encode blocks (any iterable of dicts with page/type/text) into .blocks bytes"""
+    parts, offset = [MAGIC], len(MAGIC)
+    pages, types, groups, type_names, type_codes = [], [], [], [], {}
+    codec, key_order = None, None
+
+    def add(data):
+        nonlocal offset
+        parts.append(data)
+        offset += len(data)
+        return [offset - len(data), len(data)]
+
+    batch = []
+
+    def flush():
+        nonlocal codec
+        texts = [block.get(TEXT_FIELD) or "" for block in batch]
+        rest = [{key: value for key, value in block.items() if key not in INDEXED_FIELDS and key != TEXT_FIELD} for block in batch]
+        codec, packed = _pack(rest)
+        groups.append({"rows": len(batch), "text": add(_encode_texts(texts)), "rest": add(zlib.compress(packed, COMPRESSION_LEVEL))})
+        batch.clear()
+
+    for block in blocks:
+        if key_order is None:
+            key_order = list(block)
+        block_type = block.get("type") or "unknown"
+        if block_type not in type_codes:
+            type_codes[block_type] = len(type_names)
+            type_names.append(block_type)
+        pages.append(block.get("page") or 0)
+        types.append(type_codes[block_type])
+        batch.append(block)
+        if len(batch) == row_group:
+            flush()
+    if batch:
+        flush()
+    if len(type_names) > 255:
+        raise ValueError("More than 255 distinct block types")
+
+    footer = {
+        "version": FORMAT_VERSION,
+        "count": len(pages),
+        "codec": codec or _pack([])[0],
+        "types": type_names,
+        # Blocks are rebuilt with their keys in this order, so re-encoding them to JSON gives the same bytes
+        "key_order": key_order or [],
+        "row_group": row_group,
+        "groups": groups,
+        # Page numbers of 0 mean the block had none
+        "page": add(np.asarray(pages, dtype="<i4").tobytes()),
+        "type": add(np.asarray(types, dtype="u1").tobytes()),
+    }
+    footer_bytes = json.dumps(footer, separators=(",", ":")).encode("utf-8")
+    parts += [footer_bytes, struct.pack("<I", len(footer_bytes)), MAGIC]
+    return b"".join(parts)
+
+class BlockFile:
+    """Reader over a .blocks file or its bytes; only the footer and index columns are read up front"""
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._file, self.buffer = None, memoryview(source)
+        else:
+            self._file = open(source, "rb")
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        tail = bytes(self.buffer[-(len(MAGIC) + 4):])
+        if bytes(self.buffer[:len(MAGIC)]) != MAGIC or tail[4:] != MAGIC:
+            self.close()
+            raise ValueError("Not a block file")
+        footer_len = struct.unpack("<I", tail[:4])[0]
+        footer_end = len(self.buffer) - len(MAGIC) - 4
+        self.footer = json.loads(bytes(self.buffer[footer_end - footer_len:footer_end]))
+        if self.footer["version"] != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported block file version {self.footer['version']}")
+        self.count = self.footer["count"]
+        self.types = self.footer["types"]
+        self.page = np.frombuffer(self.buffer, dtype="<i4", count=self.count, offset=self.footer["page"][0])
+        self.type_code = np.frombuffer(self.buffer, dtype="u1", count=self.count, offset=self.footer["type"][0])
+        self._group_starts = np.cumsum([0] + [group["rows"] for group in self.footer["groups"]])
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views into the map must go before it can be closed
+        self.page = self.type_code = None
+        if self._file is not None:
+            self.buffer.close()
+            self._file.close()
+            self._file = None
+
+    def select(self, types=None, pages=None):
+        """Row numbers of the blocks whose type is in `types` and page in `pages` ((first, last) or a set)"""
+        mask = np.ones(self.count, dtype=bool)
+        if types is not None:
+            codes = [code for code, name in enumerate(self.types) if name in set(types)]
+            mask &= np.isin(self.type_code, codes)
+        if pages is not None:
+            if isinstance(pages, tuple):
+                mask &= (self.page >= pages[0]) & (self.page <= pages[1])
+            else:
+                mask &= np.isin(self.page, list(pages))
+        return np.flatnonzero(mask)
+
+    def _chunk(self, span):
+        start, length = span
+        return bytes(self.buffer[start:start + length])
+
+    def iter_blocks(self, types=None, pages=None, fields=None):
+        """Yield matching blocks in document order, decoding one row group at a time.
+        `fields` limits what is decoded beyond page and type (e.g. ("text",))."""
+        rows = self.select(types, pages)
+        if not len(rows):
+            return
+        want_text = fields is None or TEXT_FIELD in fields
+        want_rest = fields is None or any(field not in INDEXED_FIELDS and field != TEXT_FIELD for field in fields)
+        key_order = self.footer["key_order"]
+        row_list = rows.tolist()
+        page_list = self.page[rows].tolist()
+        type_list = [self.types[code] for code in self.type_code[rows].tolist()]
+        # Rows are sorted, so each row group's matches are one contiguous run
+        group_of = np.searchsorted(self._group_starts, rows, side="right") - 1
+        bounds = (np.flatnonzero(np.diff(group_of)) + 1).tolist()
+        for start, end in zip([0] + bounds, bounds + [len(rows)]):
+            group_index = int(group_of[start])
+            group = self.footer["groups"][group_index]
+            first = int(self._group_starts[group_index])
+            texts = _decode_texts(self._chunk(group["text"]), group["rows"]) if want_text else None
+            rest = _unpack(self.footer["codec"], zlib.decompress(self._chunk(group["rest"]))) if want_rest else None
+            for i in range(start, end):
+                local = row_list[i] - first
+                values = {"page": page_list[i] or None, "type": type_list[i]}
+                if texts is not None:
+                    values[TEXT_FIELD] = texts[local]
+                if rest is not None:
+                    extra = rest[local]
+                    values.update(extra if fields is None else {key: value for key, value in extra.items() if key in fields})
+                block = {key: values.pop(key) for key in key_order if key in values}
+                block.update(values)
+                yield block
+
+    def read(self, types=None, pages=None, fields=None):
+        return list(self.iter_blocks(types, pages, fields))
+
+def is_block_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def filter_blocks(blocks, types=None, pages=None):
+    """The same filters over blocks already in memory (labeled JSON)"""
+    def keep(block):
+        if types is not None and block.get("type") not in types:
+            return False
+        if pages is None:
+            return True
+        page = block.get("page") or 0
+        return pages[0] <= page <= pages[1] if isinstance(pages, tuple) else page in pages
+    return [block for block in blocks if keep(block)]
+
+def read_blocks(path, types=None, pages=None, fields=None):
+    """Blocks from a .blocks file or a labeled JSON file, filtered by type and page"""
+    if is_block_file(path):
+        with BlockFile(path) as blocks:
+            return blocks.read(types, pages, fields)
+    with open(path, "r", encoding="utf-8") as f:
+        return filter_blocks(json.load(f), types, pages)
+
+def loads(data, types=None, pages=None, fields=None):
+    """Decode artifact bytes in either format"""
+    if bytes(data[:len(MAGIC)]) == MAGIC:
+        return BlockFile(data).read(types, pages, fields)
+    return filter_blocks(json.loads(data.decode("utf-8")), types, pages)
+
+def write_blocks(path, blocks, row_group=ROW_GROUP):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(dumps(blocks, row_group))
+    os.replace(tmp_path, path)
+    return path
+
+def artifact_path(base_path, artifact_format=None):
+    """`<name>_labeled` plus the extension of the chosen format"""
+    return base_path + EXTENSIONS[artifact_format or ARTIFACT_FORMAT]
+
+def swap_extension(path, artifact_format):
+    for extension in EXTENSIONS.values():
+        if path.endswith(extension):
+            return path[:-len(extension)] + EXTENSIONS[artifact_format]
+    return path + EXTENSIONS[artifact_format]
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert and inspect labeled block artifacts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("from-json", "labeled JSON to .blocks"), ("to-json", ".blocks to labeled JSON")):
+        command = subparsers.add_parser(name, help=help_text)
+        command.add_argument("source")
+        command.add_argument("dest", nargs="?")
+    info = subparsers.add_parser("info")
+    info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        with BlockFile(args.path) as blocks:
+            counts = np.bincount(blocks.type_code, minlength=len(blocks.types))
+            pages = blocks.page[blocks.page > 0]
+            print(json.dumps({
+                "blocks": len(blocks),
+                "row_groups": len(blocks.footer["groups"]),
+                "codec": blocks.footer["codec"],
+                "pages": [int(pages.min()), int(pages.max())] if len(pages) else None,
+                "types": {name: int(count) for name, count in zip(blocks.types, counts)},
+                "bytes": os.path.getsize(args.path),
+            }, indent=2))
+        return
+
+    if args.command == "from-json":
+        dest = args.dest or swap_extension(args.source, "blocks")
+        with open(args.source, "r", encoding="utf-8") as f:
+            write_blocks(dest, json.load(f))
+    else:
+        dest = args.dest or swap_extension(args.source, "json")
+        with open(dest, "w", encoding="utf-8") as f:
+            f.write(json.dumps(read_blocks(args.source), indent=2, ensure_ascii=False))
+    print(f"{args.source} -> {dest} ({os.path.getsize(args.source)} -> {os.path.getsize(dest)} bytes)")
+
+if __name__ == "__main__":
+    main()
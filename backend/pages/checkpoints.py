@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+from datetime import datetime
+from metrics import span
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_checkpoints")
+
+class PipelineCheckpoint:
+    """Per-material record of which pipeline stages finished and where their artifacts are.
+
+    Written to pipeline_checkpoints/<material_id>.json and mirrored onto the
+    material document's `pipeline` field, so a run can be resumed from either.
+    """
+
+    def __init__(self, material_id, collection=None):
+        self.material_id = str(material_id)
+        self.collection = collection
+        self.path = os.path.join(CHECKPOINT_DIR, f"{self.material_id}.json")
+        self.state = {"input_pdf": None, "stages": {}}
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+            return True
+
+        if self.collection is not None:
+            from bson import ObjectId
+            material = self.collection.find_one({"_id": ObjectId(self.material_id)}, {"pipeline": 1})
+            if material and material.get("pipeline"):
+                self.state = material["pipeline"]
+                return True
+        return False
+
+    def save(self):
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+
+        if self.collection is not None:
+            # The file is the source of truth; the DB copy is for the dashboard
+            try:
+                from bson import ObjectId
+                with span("db_write", collection="materials", op="checkpoint"):
+                    self.collection.update_one({"_id": ObjectId(self.material_id)}, {"$set": {"pipeline": self.state}})
+            except Exception as e:
+                print(f"Could not mirror checkpoint to the database: {e}", file=sys.stderr)
+
+    @property
+    def input_pdf(self):
+        return self.state.get("input_pdf")
+
+    def start(self, input_pdf):
+        if self.state.get("input_pdf") != input_pdf:
+            # A different PDF under the same material invalidates old progress
+            self.state = {"input_pdf": input_pdf, "stages": {}}
+        self.state["started_at"] = datetime.now().isoformat()
+        self.save()
+
+    def is_complete(self, stage):
+        entry = self.state["stages"].get(stage)
+        if not entry or entry.get("status") != "completed":
+            return False
+        return all(os.path.exists(path) for path in entry.get("artifacts", []))
+
+    def completed_stages(self):
+        return [stage for stage in self.state["stages"] if self.is_complete(stage)]
+
+    def mark_complete(self, stage, artifacts=()):
+        self.state["stages"][stage] = {
+            "status": "completed",
+            "artifacts": list(artifacts),
+            "completed_at": datetime.now().isoformat(),
+        }
+        self.save()
+
+    def mark_failed(self, stage, error):
+        self.state["stages"][stage] = {
+            "status": "failed",
+            "error": str(error),
+            "failed_at": datetime.now().isoformat(),
+        }
+        self.save()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
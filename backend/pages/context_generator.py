@@ -1,14 +1,31 @@
 # backend/llama_context_generator.py
 
-import json
+import os
+import re
 import sys
-from ollama import Client
+from concurrent.futures import ThreadPoolExecutor
+from llm_client import get_client, MODEL
+from artifact_cache import ArtifactCache, cache_key, hash_bytes
+from metrics import in_current_trace
+import block_store
 
-client = Client(host='http://localhost:11434')
+# Bump when the prompt changes so cached artifacts from the old prompt are not reused
+PROMPT_VERSION = 1
+
+CONTENT_TYPES = ["title", "text", "answer"]
+
+# single:  one prompt with the whole document (original behaviour)
+# chunked: summarize token-budgeted chunks concurrently, then merge the notes
+# auto:    single when the document fits in one chunk, chunked otherwise
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "auto")
+CHUNK_TOKEN_BUDGET = int(os.getenv("CONTEXT_CHUNK_TOKENS", "3000"))
+CONTEXT_MAX_CONCURRENCY = int(os.getenv("CONTEXT_MAX_CONCURRENCY", "2"))
+# Fold rounds of the reduce step before giving up and truncating the notes
+MAX_FOLD_ROUNDS = 4
 
 def load_blocks(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    # Only content blocks are used; a .blocks file skips the rest without decoding it
+    return block_store.read_blocks(path, types=CONTENT_TYPES, fields=("text",))
 
 def generate_context(text):
     prompt = f"""
@@ -32,24 +49,135 @@ Respond in this format:
 • Concept ( n number of times )
     points+Explanation...
     """
-    response = client.chat(model="gemma3", messages=[
+    response = get_client().chat(model=MODEL, messages=[
+        {"role": "user", "content": prompt}
+    ])
+    return response['message']['content']
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for English prose and code
+    return len(text) // 4 + 1
+
+# Lines, then sentences, then words; a single word over budget is cut by characters
+SPLIT_LEVELS = ((re.compile(r"\n"), "\n"), (re.compile(r"(?<=[.!?])\s+"), " "), (re.compile(r"\s+"), " "))
+
+def split_oversized(text, token_budget, level=0):
+    if estimate_tokens(text) <= token_budget:
+        return [text]
+    if level == len(SPLIT_LEVELS):
+        size = max(1, (token_budget - 1) * 4)
+        return [text[start:start + size] for start in range(0, len(text), size)]
+    pattern, joiner = SPLIT_LEVELS[level]
+    pieces, current = [], ""
+    for part in pattern.split(text):
+        for piece in split_oversized(part, token_budget, level + 1):
+            if current and estimate_tokens(current) + estimate_tokens(piece) > token_budget:
+                pieces.append(current)
+                current = ""
+            current = f"{current}{joiner}{piece}" if current else piece
+    if current:
+        pieces.append(current)
+    return pieces
+
+def chunk_blocks(blocks, token_budget=CHUNK_TOKEN_BUDGET):
+    """Group content blocks into chunks of at most token_budget, preferring to cut at titles and page breaks"""
+    chunks, current, current_tokens, last_page = [], [], 0, None
+    for block in blocks:
+        if block["type"] not in CONTENT_TYPES or not block["text"].strip():
+            continue
+        for text in split_oversized(block["text"], token_budget):
+            tokens = estimate_tokens(text)
+            natural_break = block["type"] == "title" or block.get("page") != last_page
+            # Past half the budget, a title or new page is a good place to start a new chunk
+            if current and (current_tokens + tokens > token_budget or (natural_break and current_tokens > token_budget // 2)):
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+            last_page = block.get("page")
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def summarize_chunk(text):
+    prompt = f"""
+You are an expert education assistant. The following is one section of text extracted from a subject PDF.
+Write concise study notes for this section: list every important concept as a bullet with the key points and a short explanation.
+Do not include code and do not add anything that is not in the text.
+Text:
+{text}
+    """
+    response = get_client().chat(model=MODEL, messages=[
         {"role": "user", "content": prompt}
     ])
     return response['message']['content']
 
+def summarize_chunks(chunks, cache=None, max_concurrency=CONTEXT_MAX_CONCURRENCY):
+    """Map step: summarize chunks concurrently, reusing cached summaries of unchanged chunks"""
+    def summarize(chunk):
+        key = None
+        if cache is not None:
+            key = cache_key("context_chunk", hash_bytes(chunk.encode("utf-8")), model=MODEL, prompt_version=PROMPT_VERSION)
+            cached = cache.get_bytes(key)
+            if cached is not None:
+                return cached.decode("utf-8"), True
+        summary = summarize_chunk(chunk)
+        if key is not None:
+            cache.put_bytes(key, "context_chunk", summary.encode("utf-8"))
+        return summary, False
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(chunks)))) as pool:
+        results = list(pool.map(in_current_trace(summarize), chunks))
+    reused = sum(1 for _, hit in results if hit)
+    print(f"Summarized {len(chunks)} chunk(s), {reused} reused from cache")
+    return [summary for summary, _ in results]
+
+def build_context_chunked(blocks, token_budget=CHUNK_TOKEN_BUDGET, cache=None):
+    chunks = chunk_blocks(blocks, token_budget)
+    print(f"Generating context map-reduce over {len(chunks)} chunk(s)...")
+    notes = summarize_chunks(chunks, cache=cache)
+
+    # Reduce step: merge the notes with the original prompt. Very long documents
+    # can produce more notes than fit in one prompt, so fold them again first.
+    # A fold must merge notes to make progress; when one does not (every note
+    # already fills a chunk), stop and cut the notes to the budget instead.
+    for _ in range(MAX_FOLD_ROUNDS):
+        if estimate_tokens("\n\n".join(notes)) <= token_budget or len(notes) <= 1:
+            break
+        note_blocks = [{"type": "text", "text": note, "page": i} for i, note in enumerate(notes)]
+        chunks = chunk_blocks(note_blocks, token_budget)
+        if len(chunks) >= len(notes):
+            break
+        notes = summarize_chunks(chunks, cache=cache)
+    merged = "\n\n".join(notes)
+    if estimate_tokens(merged) > token_budget:
+        print(f"Notes still exceed {token_budget} tokens after folding; truncating", file=sys.stderr)
+        merged = merged[:token_budget * 4]
+    return generate_context(merged)
+
+def build_context(blocks, mode=CONTEXT_MODE, token_budget=CHUNK_TOKEN_BUDGET, cache=None):
+    combined_text = "\n".join(block["text"] for block in blocks if block["type"] in CONTENT_TYPES)
+    if not combined_text.strip():
+        return None
+
+    if mode == "chunked" or (mode == "auto" and estimate_tokens(combined_text) > token_budget):
+        if cache is None and os.getenv("ARTIFACT_CACHE", "1") != "0":
+            cache = ArtifactCache()
+        return build_context_chunked(blocks, token_budget, cache)
+
+    print("Generating context using LLaMA...")
+    return generate_context(combined_text)
+
 def main(json_path):
     print(f"Reading: {json_path}")
     blocks = load_blocks(json_path)
 
-    combined_text = "\n".join(block["text"] for block in blocks if block["type"] in ["title", "text", "answer"])
-    if not combined_text.strip():
+    result = build_context(blocks)
+    if result is None:
         print("No valid content found to process.")
         return
 
-    print("Generating context using LLaMA...")
-    result = generate_context(combined_text)
-
-    out_path = json_path.replace("_labeled.json", "_llama_context.txt")
+    out_path = re.sub(r"_labeled\.(json|blocks)$", "_llama_context.txt", json_path)
     with open(out_path, "w", encoding="utf-8") as f:
         f.write(result)
 
@@ -1,49 +1,246 @@
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime
 import os
+import sys
+import threading
 from dotenv import load_dotenv
+from metrics import span
 
 load_dotenv()
 
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+DB_NAME = os.getenv("MONGO_DB_NAME", "MCQ-Homemade")
+# One pool per process shared by every thread; pymongo opens sockets on demand
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# Milliseconds. Fail fast when Mongo is down instead of pymongo's 30s default;
+# no socket timeout by default since some aggregations legitimately run long.
+CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None
+DEBUG = os.getenv("MONGO_DEBUG", "0") == "1"
+
+BULK_BATCH_SIZE = 1000
+DUPLICATE_KEY = 11000
+
+# (collection, keys, options). Usernames and emails match the unique indexes
+# mongoose builds from models/user.js, so either side may create them first.
+INDEXES = [
+    ("users", [("username", 1)], {"unique": True}),
+    ("users", [("email", 1)], {"unique": True}),
+    ("materials", [("status", 1), ("subject", 1)], {}),
+    ("quizzes", [("user_id", 1), ("completed_at", -1)], {}),
+    ("flashcards", [("user_id", 1), ("completed_at", -1)], {}),
+    # Session files imported by migrate_answers.py; the hash makes re-imports no-ops
+    ("user_answers", [("content_hash", 1)], {"unique": True}),
+    ("user_answers", [("user_id", 1), ("completed_at", -1)], {}),
+    ("flashcard_sessions", [("content_hash", 1)], {"unique": True}),
+    ("flashcard_sessions", [("user_id", 1), ("completed_at", -1)], {}),
+    ("learner_analytics", [("scope", 1), ("key", 1)], {}),
+    ("card_states", [("user_id", 1), ("chunk", 1)], {}),
+    ("question_bank", [("material_id", 1)], {}),
+]
+
 class Database:
-    def __init__(self):
-        mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-        db_name = "MCQ-Homemade"
-        
-        # --- DEBUG LOGS ---
-        print("--- Python DB Connection ---")
-        print(f"Attempting to connect to MONGO_URI: {mongo_uri}")
-        print(f"Using database: {db_name}")
-        # --- END DEBUG LOGS ---
-        
-        self.client = MongoClient(mongo_uri)
+    def __init__(self, mongo_uri=None, db_name=None):
+        mongo_uri = mongo_uri or MONGO_URI
+        db_name = db_name or DB_NAME
+
+        if DEBUG:
+            print("--- Python DB Connection ---", file=sys.stderr)
+            print(f"Attempting to connect to MONGO_URI: {mongo_uri}", file=sys.stderr)
+            print(f"Using database: {db_name}", file=sys.stderr)
+
+        self.client = MongoClient(
+            mongo_uri,
+            maxPoolSize=MAX_POOL_SIZE,
+            minPoolSize=MIN_POOL_SIZE,
+            connectTimeoutMS=CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=SOCKET_TIMEOUT_MS,
+        )
         self.db = self.client[db_name]
-        
+
         # Collections
         self.users = self.db["users"]
         self.quizzes = self.db["quizzes"]
         self.flashcards = self.db["flashcards"]
         self.materials = self.db["materials"]
-        
+
+    def ensure_indexes(self):
+        """Create the indexes the lookups rely on; safe to run on every start.
+        Returns the names created or already present."""
+        names = []
+        for collection, keys, options in INDEXES:
+            try:
+                names.append(self.db[collection].create_index(keys, **options))
+            except OperationFailure as e:
+                # Existing duplicates, or an index with the same keys but other options
+                print(f"Could not create index {keys} on {collection}: {e}", file=sys.stderr)
+        return names
+
+    def bulk_insert(self, collection, documents, batch_size=BULK_BATCH_SIZE, ordered=False):
+        """Insert documents in batches of insert_many.
+
+        Unordered by default, so one duplicate does not stop the rest of its
+        batch; duplicate-key errors are counted, any other error is raised.
+        Returns {"inserted": n, "duplicates": n}.
+        """
+        totals = {"inserted": 0, "duplicates": 0}
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                self._insert_batch(collection, batch, ordered, totals)
+                batch = []
+        if batch:
+            self._insert_batch(collection, batch, ordered, totals)
+        return totals
+
+    def _insert_batch(self, collection, batch, ordered, totals):
+        with span("db_write", collection=collection, op="insert_many") as write_span:
+            write_span.set(documents=len(batch))
+            try:
+                totals["inserted"] += len(self.db[collection].insert_many(batch, ordered=ordered).inserted_ids)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                    raise
+                totals["inserted"] += e.details.get("nInserted", 0)
+                totals["duplicates"] += len(errors)
+
+    def bulk_writer(self, collection, batch_size=BULK_BATCH_SIZE, ordered=False):
+        return BulkWriter(self, collection, batch_size, ordered)
+
     def create_user(self, user_data):
         if self.users.find_one({"username": user_data["username"]}):
             raise ValueError("Username already exists")
         user_data["created_at"] = datetime.now()
         user_data["last_login"] = datetime.now()
-        result = self.users.insert_one(user_data)
+        with span("db_write", collection="users", op="insert_one"):
+            result = self.users.insert_one(user_data)
         return result.inserted_id
-    
+
     def save_quiz_attempt(self, user_id, quiz_data):
         quiz_data["user_id"] = user_id
         quiz_data["completed_at"] = datetime.now()
-        return self.quizzes.insert_one(quiz_data)
-    
+        with span("db_write", collection="quizzes", op="insert_one"):
+            result = self.quizzes.insert_one(quiz_data)
+        self._record_analytics("quiz", user_id, quiz_data)
+        if quiz_data.get("bank_question_ids"):
+            try:
+                # Imported here, like the other per-save modules: the bank pulls in numpy and the LLM client
+                import question_bank
+                question_bank.record_answers(self.db, quiz_data.get("material_id"), quiz_data["bank_question_ids"], quiz_data.get("answers"))
+            except Exception as e:
+                print(f"Could not update question bank statistics: {e}", file=sys.stderr)
+        return result
+
     def save_flashcard_session(self, user_id, session_data):
         session_data["user_id"] = user_id
         session_data["completed_at"] = datetime.now()
-        return self.flashcards.insert_one(session_data)
-    
+        with span("db_write", collection="flashcards", op="insert_one"):
+            result = self.flashcards.insert_one(session_data)
+        self._record_analytics("flashcard", user_id, session_data)
+        if session_data.get("cards"):
+            # Per-card results reschedule the cards; saved as a few chunk writes, not one per card
+            try:
+                import spaced_repetition
+                spaced_repetition.record_session(self.db, user_id, session_data)
+            except Exception as e:
+                print(f"Could not update card schedule for user {user_id}: {e}", file=sys.stderr)
+        return result
+
+    def _record_analytics(self, kind, user_id, attempt):
+        # The attempt is already saved; a failed rollup is fixed by `analytics.py recompute`
+        try:
+            import analytics
+            analytics.record_attempt(self.db, kind, user_id, attempt)
+        except Exception as e:
+            print(f"Could not update analytics for {kind} attempt: {e}", file=sys.stderr)
+
     def save_generated_material(self, material_data):
-        return self.materials.insert_one(material_data)
+        with span("db_write", collection="materials", op="insert_one"):
+            return self.materials.insert_one(material_data)
+
+class BulkWriter:
+    """Buffers documents and inserts them a batch at a time:
+    `with db.bulk_writer("quizzes") as writer: writer.add(doc)`"""
+
+    def __init__(self, database, collection, batch_size=BULK_BATCH_SIZE, ordered=False):
+        self.database = database
+        self.collection = collection
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.pending = []
+        self.totals = {"inserted": 0, "duplicates": 0}
+        self._lock = threading.Lock()
+
+    def add(self, document):
+        with self._lock:
+            self.pending.append(document)
+            if len(self.pending) < self.batch_size:
+                return
+            batch, self.pending = self.pending, []
+        self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self._write(batch)
+        return self.totals
+
+    def _write(self, batch):
+        written = self.database.bulk_insert(self.collection, batch, len(batch), self.ordered)
+        with self._lock:
+            for name, value in written.items():
+                self.totals[name] += value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+_database = None
+_database_pid = None
+_database_lock = threading.Lock()
+
+def get_database():
+    """The process-wide Database, created on first use.
+
+    MongoClient is not fork-safe, so a forked child (OCR pool, subprocess
+    stages) gets its own client instead of inheriting the parent's sockets.
+    """
+    global _database, _database_pid
+    with _database_lock:
+        if _database is None or _database_pid != os.getpid():
+            _database = Database()
+            _database_pid = os.getpid()
+        return _database
+
+def set_database(database):
+    """Swap the shared Database, e.g. for a scratch database in benchmarks"""
+    global _database, _database_pid
+    with _database_lock:
+        _database, _database_pid = database, os.getpid()
+
+class _LazyDatabase:
+    # Keeps `from db import db; db.users...` working without connecting at import
+    def __getattr__(self, name):
+        return getattr(get_database(), name)
+
+    def __repr__(self):
+        return f"<lazy {DB_NAME} database>"
+
+db = _LazyDatabase()
 
-db = Database()
\ No newline at end of file
+if __name__ == "__main__":
+    if sys.argv[1:] != ["ensure-indexes"]:
+        print("Usage: python db.py ensure-indexes", file=sys.stderr)
+        sys.exit(1)
+    for name in db.ensure_indexes():
+        print(name)
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import atexit
+import hashlib
+import threading
+from datetime import datetime
+from metrics import span
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "explanation_cache")
+# Hit counts are only statistics, so they are written in batches and a cache
+# read stays a plain read.
+HIT_FLUSH_EVERY = int(os.getenv("EXPLANATION_CACHE_HIT_FLUSH", "50"))
+
+def explanation_key(question, options, selected_option, correct_option, prompt_version, model):
+    """Same question, same wrong pick, same prompt -> same explanation, whoever the student is"""
+    spec = {
+        "question": question,
+        "options": options,
+        "selected": selected_option,
+        "correct": correct_option,
+        "prompt_version": prompt_version,
+        "model": model,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class ExplanationCache:
+    """Explanations shared across students, stored in Mongo with a local-file fallback.
+
+    If the database cannot be reached the cache switches to files under
+    explanation_cache/ for the rest of the process instead of failing the request.
+    """
+
+    def __init__(self, collection=None, cache_dir=CACHE_DIR):
+        self.collection = collection
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._pending_hits = 0
+
+    def _use_files(self, error):
+        with self._lock:
+            if self.collection is not None:
+                print(f"Explanation cache falling back to local files: {error}", file=sys.stderr)
+                self.collection = None
+
+    def _file_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({"_id": key}, {"explanation": 1})
+            except Exception as e:
+                self._use_files(e)
+            else:
+                if doc is None:
+                    return None
+                self._record_hit(key)
+                return doc["explanation"]
+
+        path = self._file_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["explanation"]
+
+    def missing(self, keys):
+        """The keys without a cached explanation, looked up in one query and not counted as hits"""
+        keys = list(keys)
+        if self.collection is not None:
+            try:
+                found = {doc["_id"] for doc in self.collection.find({"_id": {"$in": keys}}, {"_id": 1})}
+                return [key for key in keys if key not in found]
+            except Exception as e:
+                self._use_files(e)
+        return [key for key in keys if not os.path.exists(self._file_path(key))]
+
+    def _record_hit(self, key):
+        with self._lock:
+            self._hits[key] = self._hits.get(key, 0) + 1
+            self._pending_hits += 1
+            full = self._pending_hits >= HIT_FLUSH_EVERY
+        if full:
+            self.flush_hits()
+
+    def flush_hits(self):
+        with self._lock:
+            hits, self._hits, self._pending_hits = self._hits, {}, 0
+            collection = self.collection
+        if not hits or collection is None:
+            return
+        # One update per distinct count instead of one per key
+        by_count = {}
+        for key, count in hits.items():
+            by_count.setdefault(count, []).append(key)
+        try:
+            with span("db_write", collection="explanation_cache", op="hits"):
+                for count, keys in by_count.items():
+                    collection.update_many({"_id": {"$in": keys}}, {"$inc": {"hits": count}, "$set": {"last_hit_at": datetime.now()}})
+        except Exception as e:
+            print(f"Could not record explanation cache hits: {e}", file=sys.stderr)
+
+    def put(self, key, explanation, meta=None):
+        record = {"explanation": explanation, "created_at": datetime.now(), "hits": 0, **(meta or {})}
+        if self.collection is not None:
+            try:
+                # Two students racing on the same miss both write the same thing; keep the first
+                with span("db_write", collection="explanation_cache", op="upsert"):
+                    self.collection.update_one({"_id": key}, {"$setOnInsert": record}, upsert=True)
+                return
+            except Exception as e:
+                self._use_files(e)
+
+        path = self._file_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        self.flush_hits()
+        if self.collection is not None:
+            try:
+                rows = list(self.collection.aggregate([
+                    {"$group": {"_id": None, "entries": {"$sum": 1}, "hits": {"$sum": "$hits"}}}
+                ]))
+                return {"backend": "mongo", "entries": rows[0]["entries"] if rows else 0, "hits": rows[0]["hits"] if rows else 0}
+            except Exception as e:
+                self._use_files(e)
+        entries = sum(len(files) for _, _, files in os.walk(self.cache_dir)) if os.path.isdir(self.cache_dir) else 0
+        return {"backend": "files", "entries": entries}
+
+_default_cache = None
+
+def get_explanation_cache():
+    global _default_cache
+    if _default_cache is None:
+        collection = None
+        if os.getenv("EXPLANATION_CACHE_BACKEND", "mongo") == "mongo":
+            try:
+                from db import db
+                collection = db.db["explanation_cache"]
+            except Exception as e:
+                print(f"Explanation cache database unavailable, using local files: {e}", file=sys.stderr)
+        _default_cache = ExplanationCache(collection)
+        atexit.register(_default_cache.flush_hits)
+    return _default_cache
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("stats", "prewarm") or (sys.argv[1] == "prewarm" and len(sys.argv) != 3):
+        print("Usage: python explanation_cache.py stats\n       python explanation_cache.py prewarm <material_id>", file=sys.stderr)
+        sys.exit(1)
+
+    if sys.argv[1] == "stats":
+        print(json.dumps(get_explanation_cache().stats(), indent=2))
+    else:
+        import ai_tutor
+        import vector_index
+        _, quiz_data = ai_tutor.load_material(sys.argv[2])
+        # Tutor sessions key explanations by their grounding passages, so warm with the same index
+        index = vector_index.load_for_material(sys.argv[2])
+        print(json.dumps(ai_tutor.prewarm_explanations(quiz_data, index=index)))
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,457 @@
 import os
 import sys
 import json
+import time
+import re
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 from PIL import Image
 import pytesseract
 import fitz
-from ollama import Client
+from llm_client import get_client, MODEL
+from metrics import span, inc, observe, in_current_trace
+import block_store
 
-def extract_text_blocks(pdf_path):
-    # This function is correct, no changes needed here.
-    doc = fitz.open(pdf_path)
-    blocks = []
-    for page_num, page in enumerate(doc):
-        pix = page.get_pixmap(dpi=300)
+# Bump when the prompt or the output's shape changes so old cached artifacts are not reused
+PROMPT_VERSION = 3
+
+OCR_DPI = 300
+
+# adaptive: grayscale, resolution chosen per page, pixmap handed straight to Tesseract
+# fixed:    RGB at OCR_DPI copied into a PIL image (original behaviour)
+RASTER_MODES = ["adaptive", "fixed"]
+
+# Adaptive pages get OCR_DPI when their text is BODY_TEXT_PT or smaller and
+# proportionally less for larger type, down to OCR_MIN_DPI. Text size comes
+# from a PROBE_DPI render of at most PROBE_MAX_PIXELS, so posters stay cheap.
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+BODY_TEXT_PT = 10
+PROBE_DPI = 72
+PROBE_MAX_PIXELS = 1_000_000
+# Scans are never rendered above their own resolution unless it is below OCR_MIN_DPI
+SCAN_COVERAGE = 0.9
+
+# Memory one OCR worker may use, including the Tesseract process it runs
+# (0 = no cap). Rasters are shrunk until the worker's current RSS plus the
+# page and Tesseract's working copies of it (about TESSERACT_COPIES times the
+# raster) fit, even if that means going below OCR_MIN_DPI. Serial OCR runs in
+# the caller's process, whose RSS is not ours to budget, so there only the
+# raster and its copies count against the cap.
+OCR_WORKER_MEMORY_MB = int(os.getenv("OCR_WORKER_MEMORY_MB", "512"))
+TESSERACT_COPIES = 4
+
+# How many pages each OCR worker may have queued or rendering at once.
+# Bounds memory: only workers * OCR_PREFETCH full-resolution pages exist at a time.
+OCR_PREFETCH = 2
+
+# hybrid: use the embedded text layer when it is usable, OCR otherwise
+# native: text layer only, never OCR
+# ocr:    rasterize and OCR every page (original behaviour)
+EXTRACT_MODES = ["hybrid", "native", "ocr"]
+
+# A page needs at least this many real characters in its text layer before
+# we trust it over Tesseract; below that it is treated as scanned.
+MIN_TEXT_LAYER_CHARS = 40
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def gray_array(pix):
+    """View of a grayscale pixmap as a (height, width) array; shares the pixmap's memory"""
+    return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+def probe_text_pt(page):
+    """Typical text line height in points from a low-resolution render, or None for an empty page"""
+    # Large pages are probed through a centred window rather than at lower
+    # resolution, which would blur small lines together
+    rect = page.rect
+    side = (PROBE_MAX_PIXELS ** 0.5) * 72 / PROBE_DPI
+    clip = fitz.Rect(
+        max(rect.x0, (rect.x0 + rect.x1 - side) / 2), max(rect.y0, (rect.y0 + rect.y1 - side) / 2),
+        min(rect.x1, (rect.x0 + rect.x1 + side) / 2), min(rect.y1, (rect.y0 + rect.y1 + side) / 2),
+    )
+    pix = page.get_pixmap(dpi=PROBE_DPI, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+    inked = (gray_array(pix) < 160).any(axis=1)
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], inked.astype(np.int8), [0]])))
+    heights = edges[1::2] - edges[::2]
+    return float(np.median(heights)) * 72 / PROBE_DPI if len(heights) else None
+
+def scan_dpi(page):
+    """Resolution of the image covering the page, if the page is a scan"""
+    page_area = page.rect.width * page.rect.height
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        if (x1 - x0) * (y1 - y0) >= SCAN_COVERAGE * page_area and x1 > x0:
+            return info["width"] / ((x1 - x0) / 72)
+    return None
+
+def choose_dpi(page):
+    text_pt = probe_text_pt(page)
+    # Nothing inked at probe resolution: nothing small enough to need more than the minimum
+    dpi = OCR_MIN_DPI if text_pt is None else OCR_DPI * BODY_TEXT_PT / max(text_pt, 1.0)
+    dpi = max(OCR_MIN_DPI, min(OCR_DPI, dpi))
+    source = scan_dpi(page)
+    if source:
+        dpi = min(dpi, max(OCR_MIN_DPI, source))
+    if OCR_WORKER_MEMORY_MB:
+        budget = OCR_WORKER_MEMORY_MB * 2**20 - (current_rss_bytes() if _worker_doc is not None else 0)
+        inches = page.rect.width * page.rect.height / 72 ** 2
+        fits = (max(budget, 0) / TESSERACT_COPIES / inches) ** 0.5
+        if fits < dpi:
+            inc("ocr_memory_capped_total")
+            dpi = max(PROBE_DPI, fits)
+    return int(dpi)
+
+def tesseract_pixmap(pix):
+    """OCR a pixmap without copying it into PIL: Tesseract reads it from a PGM file.
+    Falls back to a PIL view sharing the pixmap's memory when no temp file can be written."""
+    try:
+        fd, path = tempfile.mkstemp(prefix="ocr_", suffix=".pgm")
+        os.close(fd)
+    except OSError:
+        return pytesseract.image_to_string(Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1))
+    try:
+        pix.save(path)
+        return pytesseract.image_to_string(path)
+    finally:
+        os.remove(path)
+
+def ocr_page(page, raster="adaptive"):
+    """OCR one page; returns (text, dpi)"""
+    if raster == "fixed":
+        pix = page.get_pixmap(dpi=OCR_DPI)
         img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        text = pytesseract.image_to_string(img)
-        if text.strip():
-            blocks.append({
-                "page": page_num + 1,
-                "bbox": None,
-                "text": text.strip(),
-                "type": "unknown"
-            })
+        return pytesseract.image_to_string(img), OCR_DPI
+    dpi = choose_dpi(page)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    try:
+        return tesseract_pixmap(pix), dpi
+    finally:
+        del pix
+
+def make_block(page_num, text, bbox=None):
+    return {
+        "page": page_num + 1,
+        "bbox": bbox,
+        "text": text.strip(),
+        "type": "unknown"
+    }
+
+def native_page_blocks(page, page_num):
+    blocks = []
+    for x0, y0, x1, y1, text, _block_no, block_type in page.get_text("blocks"):
+        # block_type 1 is an image block; it has no text to offer
+        if block_type != 0 or not text.strip():
+            continue
+        bbox = [round(x0, 2), round(y0, 2), round(x1, 2), round(y1, 2)]
+        blocks.append(make_block(page_num, text, bbox))
     return blocks
 
-def classify_text_blocks_llama(blocks):
-    # This function is correct, no changes needed here.
-    client = Client(host='http://localhost:11434')
-    labeled_blocks = []
+def has_usable_text_layer(blocks):
+    text = "".join(block["text"] for block in blocks)
+    chars = sum(1 for c in text if not c.isspace())
+    if chars < MIN_TEXT_LAYER_CHARS:
+        return False
+    # Broken font encodings come out as U+FFFD; OCR does better on those pages
+    return text.count("\ufffd") / chars < 0.05
+
+def page_has_visual_content(page):
+    return bool(page.get_images(full=False) or page.get_drawings())
+
+def extract_text_blocks(pdf_path, workers=1, mode="hybrid", raster="adaptive"):
+    return list(iter_text_blocks(pdf_path, workers=workers, mode=mode, raster=raster))
+
+# --- OCR workers ---
+# Every worker process opens its own handle on the PDF, so only page numbers
+# and OCR'd text cross the process boundary. Pixmaps never leave the worker.
+_worker_doc = None
+_worker_raster = "adaptive"
+
+def _init_ocr_worker(pdf_path, raster="adaptive"):
+    global _worker_doc, _worker_raster
+    _worker_doc = fitz.open(pdf_path)
+    _worker_raster = raster
+
+def _ocr_page_worker(page_num):
+    start = time.perf_counter()
+    text, dpi = ocr_page(_worker_doc[page_num], _worker_raster)
+    return text, dpi, (time.perf_counter() - start) * 1000
+
+def _page_result(page_num, text, method, page_ms, native_blocks=None, dpi=None, height=None):
+    extraction = {"method": method, "page_ms": round(page_ms, 1)}
+    if dpi:
+        extraction["dpi"] = dpi
+    blocks = native_blocks if method == "text_layer" else ([make_block(page_num, text)] if text.strip() else [])
     for block in blocks:
-        prompt = f"""Classify this text block into ["title", "question", "option", "answer", "text", "header"]:\n{block['text']}\nRespond with only the label."""
-        response = client.chat(model="gemma3", messages=[{"role": "user", "content": prompt}])
-        label = response["message"]["content"].strip().lower()
-        block["type"] = label if label in ["title", "question", "option", "answer", "text", "header"] else "text"
-        labeled_blocks.append(block)
-    return labeled_blocks
+        block["extraction"] = extraction
+    return {"page": page_num + 1, **extraction, "height": height, "blocks": blocks}
+
+def iter_page_results(pdf_path, workers=1, mode="hybrid", prefetch=OCR_PREFETCH, raster="adaptive"):
+    """Yield one result per page, in page order, with the extraction decision and its timing"""
+    if mode not in EXTRACT_MODES:
+        raise ValueError(f"Unknown extraction mode: {mode}")
+    if raster not in RASTER_MODES:
+        raise ValueError(f"Unknown raster mode: {raster}")
+
+    doc = fitz.open(pdf_path)
+    workers = max(1, min(workers or os.cpu_count() or 1, doc.page_count or 1))
+    pool = None
+    if workers > 1 and mode != "native":
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker, initargs=(pdf_path, raster))
+    window = workers * max(1, prefetch)
+
+    # Pages are queued in order; OCR pages hold a future until their worker
+    # finishes. Nothing is yielded ahead of an earlier page still being OCR'd.
+    queue = deque()
+    in_flight = 0
+
+    def resolve(entry):
+        page_num, native_ms, future, result, height = entry
+        if future is None:
+            return result
+        text, dpi, ocr_ms = future.result()
+        return _page_result(page_num, text, "ocr", native_ms + ocr_ms, dpi=dpi, height=height)
+
+    try:
+        for page_num, page in enumerate(doc):
+            native_ms = 0.0
+            height = round(page.rect.height, 2)
+            needs_ocr = mode == "ocr"
+            if mode != "ocr":
+                start = time.perf_counter()
+                blocks = native_page_blocks(page, page_num)
+                native_ms = (time.perf_counter() - start) * 1000
+                if mode == "native" or has_usable_text_layer(blocks):
+                    queue.append((page_num, native_ms, None, _page_result(page_num, None, "text_layer", native_ms, blocks, height=height), height))
+                elif not page_has_visual_content(page):
+                    # Nothing drawn on the page, so there is nothing for Tesseract to read
+                    queue.append((page_num, native_ms, None, _page_result(page_num, "", "blank", native_ms, height=height), height))
+                else:
+                    needs_ocr = True
+
+            if needs_ocr and pool is None:
+                start = time.perf_counter()
+                text, dpi = ocr_page(page, raster)
+                ocr_ms = (time.perf_counter() - start) * 1000
+                queue.append((page_num, native_ms, None, _page_result(page_num, text, "ocr", native_ms + ocr_ms, dpi=dpi, height=height), height))
+            elif needs_ocr:
+                queue.append((page_num, native_ms, pool.submit(_ocr_page_worker, page_num), None, height))
+                in_flight += 1
+
+            # Drain finished pages from the front; block on the oldest OCR page
+            # once the window is full so workers never run too far ahead.
+            while queue and (queue[0][2] is None or in_flight >= window):
+                entry = queue.popleft()
+                if entry[2] is not None:
+                    in_flight -= 1
+                yield resolve(entry)
+
+        while queue:
+            yield resolve(queue.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        doc.close()
+
+def page_record(result):
+    """A text-less block holding the page's extraction decision, so blank pages are recorded too"""
+    extraction = {key: value for key, value in result.items() if key not in ("page", "blocks")}
+    return {"page": result["page"], "bbox": None, "text": "", "type": PAGE_TYPE, "extraction": extraction}
+
+def iter_text_blocks(pdf_path, workers=1, mode="hybrid", raster="adaptive"):
+    for result in iter_page_results(pdf_path, workers=workers, mode=mode, raster=raster):
+        yield from result["blocks"]
+
+def summarize_extraction(page_results):
+    summary = {"pages": len(page_results), "text_layer": 0, "ocr": 0, "blank": 0}
+    ocr_ms, dpis = 0.0, []
+    for result in page_results:
+        summary[result["method"]] += 1
+        if result["method"] == "ocr":
+            ocr_ms += result["page_ms"]
+            dpis.append(result.get("dpi", OCR_DPI))
+    summary["total_ms"] = round(sum(r["page_ms"] for r in page_results), 1)
+    # Estimated from this document's own OCR pages, when it had any
+    if summary["ocr"]:
+        summary["est_ocr_ms_saved"] = round(ocr_ms / summary["ocr"] * (summary["text_layer"] + summary["blank"]), 1)
+        summary["ocr_dpi_mean"] = round(sum(dpis) / len(dpis))
+    return summary
+
+# --- Block classification ---
+BLOCK_LABELS = ["title", "question", "option", "answer", "text", "header"]
+# Type of the per-page decision records; never classified
+PAGE_TYPE = "page"
+
+# Blocks packed into a single classification request, and how many of those
+# requests may be in flight against the local model at once.
+CLASSIFY_BATCH_SIZE = 20
+CLASSIFY_MAX_CONCURRENCY = 2
+# Labels only need the start of a block; long pages are cut to keep batches small
+CLASSIFY_SNIPPET_CHARS = 400
+
+# Only unambiguous shapes are labeled without the model, since its label is
+# final: "Unit 2", "Chapter IV: Loops", and "Page 3", "3 of 12" or a bare "3"
+# alone in the top or bottom margin of its page. A sentence that merely starts
+# with "Unit 2 ..." or a number in the body (which may be an answer) goes to
+# the model like any other block.
+TITLE_PATTERN = re.compile(r"^(unit|chapter|module|lesson|part|section)\s+(\d+(\.\d+)*|(?=[ivx])x{0,3}(ix|iv|v?i{0,3}))(\s*[:.\-\u2013\u2014]\s*\S.*)?$", re.IGNORECASE)
+HEADER_PATTERN = re.compile(r"^(page\s+)?\d+(\s*(/|of)\s*\d+)?$", re.IGNORECASE)
+TITLE_MAX_WORDS = 10
+# Share of the page height at the top and bottom where running headers and page numbers sit
+HEADER_MARGIN = 0.1
+
+def in_page_margin(block, page_height):
+    # OCR'd blocks have no bbox, so they never count as being in a margin
+    if not page_height or not block.get("bbox"):
+        return False
+    _x0, y0, _x1, y1 = block["bbox"]
+    margin = page_height * HEADER_MARGIN
+    return y1 <= margin or y0 >= page_height - margin
+
+def heuristic_label(block, page_height=None):
+    """Label blocks that are certainly a title or running header; None sends the block to the model"""
+    text = block["text"].strip()
+    if "\n" in text or len(text) > 80:
+        return None
+    if HEADER_PATTERN.match(text) and in_page_margin(block, page_height):
+        return "header"
+    if TITLE_PATTERN.match(text) and len(text.split()) <= TITLE_MAX_WORDS and not text.endswith(("?", ".")):
+        return "title"
+    return None
+
+def normalize_label(label):
+    label = str(label).strip().strip('".').lower()
+    return label if label in BLOCK_LABELS else "text"
+
+def classify_batch_llama(batch):
+    """Classify (block_id, block) pairs in one request and return {block_id: label}"""
+    payload = [{"id": block_id, "text": block["text"][:CLASSIFY_SNIPPET_CHARS]} for block_id, block in batch]
+    prompt = f"""Classify each of the following text blocks into one of {json.dumps(BLOCK_LABELS)}.
+Blocks:
+{json.dumps(payload, ensure_ascii=False)}
+Respond ONLY with a JSON object mapping every block id to its label, for example {{"0": "title", "1": "text"}}."""
+    try:
+        response = get_client().chat(model=MODEL, messages=[{"role": "user", "content": prompt}], format="json")
+        raw_labels = json.loads(response["message"]["content"])
+    except Exception as e:
+        print(f"Block classification batch failed, defaulting to 'text': {e}", file=sys.stderr)
+        raw_labels = {}
+
+    if not isinstance(raw_labels, dict):
+        raw_labels = {}
+    # Ids come back as strings in JSON; anything missing falls back to "text"
+    return {block_id: normalize_label(raw_labels.get(str(block_id), "text")) for block_id, _ in batch}
+
+def classify_text_blocks_llama(blocks, batch_size=CLASSIFY_BATCH_SIZE, max_concurrency=CLASSIFY_MAX_CONCURRENCY):
+    pending, pages, heights = [], 0, {}
+    for block_id, block in enumerate(blocks):
+        if block["type"] == PAGE_TYPE:
+            # Page records lead their blocks, so the height is known by the time they come
+            pages += 1
+            heights[block["page"]] = block["extraction"].get("height")
+            continue
+        label = heuristic_label(block, heights.get(block["page"]))
+        if label:
+            block["type"] = label
+        else:
+            pending.append((block_id, block))
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as pool:
+            for labels in pool.map(in_current_trace(classify_batch_llama), batches):
+                for block_id, label in labels.items():
+                    blocks[block_id]["type"] = label
+
+    print(f"Classified {len(blocks) - pages} blocks: {len(blocks) - pages - len(pending)} by heuristic, "
+          f"{len(pending)} in {len(batches)} model request(s)")
+    return blocks
+
+def extract_page_blocks(pdf_path, workers=None, mode="hybrid", raster="adaptive"):
+    """Unlabeled blocks of every page: the CPU-bound half of extraction (text layer and OCR)"""
+    with span("extract_pages", mode=mode, raster=raster) as extract_span:
+        started = time.perf_counter()
+        page_results = list(iter_page_results(pdf_path, workers=workers, mode=mode, raster=raster))
+        elapsed = time.perf_counter() - started
+        summary = summarize_extraction(page_results)
+        summary["pages_per_s"] = round(len(page_results) / elapsed, 2) if elapsed else None
+        extract_span.set(**summary)
+        extract_span.count("pages", len(page_results))
+    for result in page_results:
+        inc("pages_extracted_total", method=result["method"])
+        observe("page_extract_seconds", result["page_ms"] / 1000, method=result["method"])
+    print(f"Extraction summary: {json.dumps(summary)}")
+
+    # Each page's decision record leads its blocks, so the output shows how every page was read
+    return [block for result in page_results for block in (page_record(result), *result["blocks"])]
+
+def label_blocks(blocks):
+    """The model-bound half: label the blocks of extract_page_blocks"""
+    with span("classify_blocks"):
+        return classify_text_blocks_llama(blocks)
+
+def extract_labeled_blocks(pdf_path, workers=None, mode="hybrid", raster="adaptive"):
+    return label_blocks(extract_page_blocks(pdf_path, workers=workers, mode=mode, raster=raster))
+
+def serialize_blocks(blocks):
+    return json.dumps(blocks, indent=2, ensure_ascii=False)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(usage="python extract.py <PDF_PATH> <SUBJECT> [--workers N] [--mode hybrid|native|ocr] [--raster adaptive|fixed] [--format json|blocks]")
+    parser.add_argument("pdf_path")
+    parser.add_argument("subject")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("OCR_WORKERS", os.cpu_count() or 1)),
+        help="OCR worker processes (1 = serial, default: all cores)"
+    )
+    parser.add_argument(
+        "--mode", choices=EXTRACT_MODES, default=os.getenv("EXTRACT_MODE", "hybrid"),
+        help="hybrid uses the PDF text layer where usable and OCRs the rest"
+    )
+    parser.add_argument(
+        "--raster", choices=RASTER_MODES, default=os.getenv("OCR_RASTER", "adaptive"),
+        help="adaptive renders grayscale at a per-page DPI within OCR_WORKER_MEMORY_MB"
+    )
+    parser.add_argument(
+        "--format", choices=block_store.ARTIFACT_FORMATS, default=block_store.ARTIFACT_FORMAT,
+        help="blocks writes the compact columnar file instead of labeled JSON"
+    )
+    return parser.parse_args(argv)
 
 def main():
-    # UPDATED: Now expects 2 arguments: pdf_path and subject
-    if len(sys.argv) != 3:
-        print("Usage: python extract.py <PDF_PATH> <SUBJECT>")
-        sys.exit(1)
+    args = parse_args(sys.argv[1:])
 
-    pdf_path = os.path.abspath(sys.argv[1])
-    subject = sys.argv[2] # The subject (e.g., "python") is now an argument
+    pdf_path = os.path.abspath(args.pdf_path)
+    subject = args.subject # The subject (e.g., "python") is now an argument
 
     if not os.path.isfile(pdf_path):
         print(f"Error: PDF not found at {pdf_path}")
         sys.exit(1)
 
-    print(f"Extracting text from: {os.path.basename(pdf_path)}")
-    blocks = extract_text_blocks(pdf_path)
-    labeled = classify_text_blocks_llama(blocks)
+    print(f"Extracting text from: {os.path.basename(pdf_path)} (mode={args.mode}, raster={args.raster}, {args.workers} OCR worker(s))")
+    labeled = extract_labeled_blocks(pdf_path, workers=args.workers, mode=args.mode, raster=args.raster)
 
     # UPDATED: The output directory now includes the subject subfolder
     output_dir = os.path.join(os.path.dirname(__file__), "extracted_text", subject)
     os.makedirs(output_dir, exist_ok=True)
-    
+
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    output_path = os.path.join(output_dir, f"{base_name}_labeled.json")
+    output_path = block_store.artifact_path(os.path.join(output_dir, f"{base_name}_labeled"), args.format)
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(labeled, f, indent=2, ensure_ascii=False)
+    if args.format == "blocks":
+        block_store.write_blocks(output_path, labeled)
+    else:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(serialize_blocks(labeled))
 
     print(f"Success: Output saved to {output_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,298 @@
+"""Stand-in for the Ollama HTTP API with canned, deterministic answers.
+
+Serves /api/chat (streaming and not), /api/embed, /api/tags and /api/version well enough
+for the ollama Python client, and shapes each answer after the prompt that
+asked for it (block labels, quiz, flashcards, study notes, tutor explanation)
+so the pipeline and tutor run end to end. Latency is simulated per request and
+per output token, which makes throughput measurable on a box without a model:
+
+    python fake_ollama.py --port 11434 --latency-ms 200 --ms-per-token 2
+    OLLAMA_HOST=http://localhost:11434 python auto_pipeline.py ...
+"""
+
+import re
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_VERSION = "0.0.0-fake"
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def content_words(text, limit=10):
+    # Topic words for the canned answers: the longest distinct words in the prompt
+    words = []
+    for word in re.findall(r"[A-Za-z][A-Za-z_]{4,}", text):
+        if word.lower() not in (w.lower() for w in words):
+            words.append(word)
+    return sorted(words, key=len, reverse=True)[:limit] or ["concept"]
+
+QUIZ_REQUEST = re.compile(r"(\d+) multiple choice questions")
+FLASHCARD_REQUEST = re.compile(r"(\d+) flashcards")
+
+def requested_count(pattern, prompt, default=10):
+    match = pattern.search(prompt)
+    return int(match.group(1)) if match else default
+
+def quiz_items(count, topics):
+    return [{
+        "question": f"Which statement about {topics[i % len(topics)]} is correct? ({i + 1})",
+        "options": {
+            "A": f"{topics[i % len(topics)]} is unrelated to the material",
+            "B": f"{topics[i % len(topics)]} is described in the material",
+            "C": "None of the above",
+            "D": "All of the above",
+        },
+        "answer": "B",
+    } for i in range(count)]
+
+def flashcard_items(count, topics):
+    return [{
+        "question": f"What is {topics[i % len(topics)]}? ({i + 1})",
+        "answer": f"{topics[i % len(topics)]} is a key idea covered in this section.",
+    } for i in range(count)]
+
+def canned_response(prompt, format=None, rules=(), context=""):
+    """Pick an answer shaped like what the prompt (the last message) asks for.
+    Returns (kind, content); the kind is what the request was for.
+
+    Topic words come from the whole conversation so a shared system message
+    holding the content still shows up in the answer.
+    """
+    for rule in rules:
+        if rule["match"] in prompt:
+            return "rule", rule["content"]
+
+    if "Classify each" in prompt and "Blocks:" in prompt:
+        try:
+            blocks = json.loads(prompt.split("Blocks:\n", 1)[1].split("\nRespond", 1)[0])
+        except (IndexError, json.JSONDecodeError):
+            blocks = []
+        return "classify", json.dumps({str(block["id"]): "text" for block in blocks})
+
+    topics = content_words(f"{context}\n{prompt}")
+    if format == "json" and '"quiz"' in prompt and '"flashcards"' in prompt:
+        return "study_set", json.dumps({
+            "quiz": quiz_items(requested_count(QUIZ_REQUEST, prompt), topics),
+            "flashcards": flashcard_items(requested_count(FLASHCARD_REQUEST, prompt), topics),
+        })
+    if QUIZ_REQUEST.search(prompt):
+        return "quiz", "```json\n" + json.dumps(quiz_items(requested_count(QUIZ_REQUEST, prompt), topics), indent=2) + "\n```"
+    if FLASHCARD_REQUEST.search(prompt):
+        return "flashcards", json.dumps(flashcard_items(requested_count(FLASHCARD_REQUEST, prompt), topics), indent=2)
+    if "AI tutor" in prompt:
+        return "tutor", ("The correct answer matches what the material states, while the chosen option "
+                "describes something the material does not say. Review the section on "
+                f"{topics[0]} to see why.")
+    # Context generation and chunk summaries
+    return "notes", "\n\n".join(f"• {topic}\n  Key points and a short explanation of {topic}." for topic in topics)
+
+EMBED_DIM = 256
+
+def fake_embedding(text, dim=EMBED_DIM):
+    # Hashed bag of words: texts sharing words get similar vectors, so
+    # retrieval over fake embeddings still ranks related passages first
+    vector = [0.0] * dim
+    for word in re.findall(r"[a-z0-9_]+", text.lower()):
+        vector[zlib.crc32(word.encode("utf-8")) % dim] += 1.0
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, model="gemma3", latency_ms=0, ms_per_token=0, chunk_chars=16, error_every=0, rules=()):
+        super().__init__(address, FakeOllamaHandler)
+        self.model = model
+        self.latency_ms = latency_ms
+        self.ms_per_token = ms_per_token
+        self.chunk_chars = chunk_chars
+        self.error_every = error_every
+        self.rules = list(rules)
+        self.stats = {"requests": 0, "chat": 0, "embed": 0, "stream": 0, "errors": 0, "prompt_tokens": 0, "output_tokens": 0, "in_flight": 0, "max_in_flight": 0}
+        self.by_kind = {}
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients hang up mid-stream once they have all the items they need
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_kind(self, kind, prompt_tokens, output_tokens):
+        with self._lock:
+            totals = self.by_kind.setdefault(kind, {"calls": 0, "prompt_tokens": 0, "output_tokens": 0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["output_tokens"] += output_tokens
+
+    def snapshot(self, reset_peak=False):
+        with self._lock:
+            snapshot = {**self.stats, "by_kind": {kind: dict(totals) for kind, totals in self.by_kind.items()}}
+            if reset_peak:
+                # Lets a benchmark measure the peak concurrency of one phase
+                self.stats["max_in_flight"] = self.stats["in_flight"]
+            return snapshot
+
+    def count(self, **changes):
+        with self._lock:
+            for name, value in changes.items():
+                self.stats[name] += value
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+            return self.stats["requests"]
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive, as they would against Ollama
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, content_type="application/json"):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunk(self, body):
+        data = (json.dumps(body) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/api/version":
+            self.send_json(200, {"version": FAKE_VERSION})
+        elif self.path == "/api/tags":
+            self.send_json(200, {"models": [{
+                "name": server.model, "model": server.model, "size": 0, "digest": "fake",
+                "modified_at": datetime.now(timezone.utc).isoformat(),
+                "details": {"format": "gguf", "family": "fake"},
+            }]})
+        elif self.path.split("?")[0] == "/_stats":
+            self.send_json(200, server.snapshot(reset_peak="reset_peak" in self.path))
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/api/embed":
+            self.embed(body)
+            return
+        if self.path != "/api/chat":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        request_number = server.count(requests=1)
+        if server.error_every and request_number % server.error_every == 0:
+            server.count(errors=1)
+            self.send_json(503, {"error": "fake overload"})
+            return
+
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        kind, content = canned_response(messages[-1].get("content", "") if messages else "", body.get("format"), server.rules, prompt)
+        prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        stream = body.get("stream", True)
+        server.count(chat=1, stream=int(bool(stream)), prompt_tokens=prompt_tokens, output_tokens=output_tokens, in_flight=1)
+        server.count_kind(kind, prompt_tokens, output_tokens)
+        try:
+            started = time.perf_counter()
+            time.sleep(server.latency_ms / 1000)
+            model = body.get("model") or server.model
+
+            def final(extra):
+                elapsed = int((time.perf_counter() - started) * 1e9)
+                return {
+                    "model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": True,
+                    "done_reason": "stop", "total_duration": elapsed, "load_duration": 0,
+                    "prompt_eval_count": prompt_tokens, "prompt_eval_duration": 0,
+                    "eval_count": output_tokens, "eval_duration": elapsed, **extra,
+                }
+
+            if not stream:
+                time.sleep(server.ms_per_token * output_tokens / 1000)
+                self.send_json(200, final({"message": {"role": "assistant", "content": content}}))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(content), server.chunk_chars):
+                piece = content[start:start + server.chunk_chars]
+                time.sleep(server.ms_per_token * estimate_tokens(piece) / 1000)
+                self.send_chunk({
+                    "model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                    "message": {"role": "assistant", "content": piece}, "done": False,
+                })
+            self.send_chunk(final({"message": {"role": "assistant", "content": ""}}))
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            server.count(in_flight=-1)
+
+    def embed(self, body):
+        server = self.server
+        texts = body.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        prompt_tokens = sum(estimate_tokens(text) for text in texts)
+        server.count(requests=1, embed=1, prompt_tokens=prompt_tokens)
+        server.count_kind("embed", prompt_tokens, 0)
+        time.sleep(server.latency_ms / 1000)
+        self.send_json(200, {
+            "model": body.get("model") or server.model,
+            "embeddings": [fake_embedding(text) for text in texts],
+            "total_duration": 0, "load_duration": 0, "prompt_eval_count": prompt_tokens,
+        })
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """Start a fake server on a background thread; port 0 picks a free one. Returns the server (see .url)."""
+    server = FakeOllamaServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def load_rules(path):
+    """Canned overrides: a JSON list of {"match": substring of the prompt, "content": reply}"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic Ollama-compatible stub server for tests and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--model", default="gemma3")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before every response")
+    parser.add_argument("--ms-per-token", type=float, default=0, help="Extra delay per output token")
+    parser.add_argument("--error-every", type=int, default=0, help="Answer every Nth chat request with a 503")
+    parser.add_argument("--responses", help="JSON file of canned responses checked before the built-in ones")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(
+        (args.host, args.port), model=args.model, latency_ms=args.latency_ms, ms_per_token=args.ms_per_token,
+        error_every=args.error_every, rules=load_rules(args.responses) if args.responses else (),
+    )
+    print(f"Fake Ollama listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.snapshot()), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
 import sys
 import os
 import json
-from ollama import Client
+from llm_client import get_client, MODEL
+from json_stream import generate_items_streaming
 
-client = Client(host='http://localhost:11434')
+# Bump when the prompt changes so cached artifacts from the old prompt are not reused
+PROMPT_VERSION = 1
 
-def generate_flashcards(text, num_flashcards=10):
+def validate_flashcard_item(item):
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get("question"), str) and item["question"].strip() != ""
+        and isinstance(item.get("answer"), str) and item["answer"].strip() != ""
+    )
+
+def validate_flashcard_items(items):
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if validate_flashcard_item(item)]
+
+# Parse flashcards out of the streamed response one at a time instead of
+# waiting for (and possibly losing) the whole list. Opt-in.
+STREAM_GENERATION = os.getenv("STREAM_GENERATION", "0") == "1"
+
+def build_flashcard_prompt(text, num_flashcards, existing=()):
     prompt = f"""
 You are a helpful education assistant.
 
@@ -21,7 +39,32 @@ Respond ONLY in JSON format as a list of dicts. Each dict should have:
 - "question" (str)
 - "answer" (str)
     """
-    response = client.chat(model="gemma3", messages=[
+    if existing:
+        # Top-up request after a partly malformed response: ask only for new cards
+        asked = "\n".join(f"- {item['question']}" for item in existing)
+        prompt += f"\nDo not repeat any of these flashcards:\n{asked}\n"
+    return prompt
+
+def generate_flashcards_streaming(text, num_flashcards=10):
+    flashcards = generate_items_streaming(
+        get_client(), MODEL,
+        lambda count, existing: build_flashcard_prompt(text, count, existing),
+        validate_flashcard_item, num_flashcards,
+        key=lambda item: item["question"].strip().lower()
+    )
+    if not flashcards:
+        print("ERROR: No valid flashcards found in the model's streamed response.", file=sys.stderr)
+        return None
+    if len(flashcards) < num_flashcards:
+        print(f"WARNING: Only {len(flashcards)} of {num_flashcards} flashcards were valid.", file=sys.stderr)
+    return json.dumps(flashcards, indent=2, ensure_ascii=False)
+
+def generate_flashcards(text, num_flashcards=10, stream=STREAM_GENERATION):
+    if stream:
+        return generate_flashcards_streaming(text, num_flashcards)
+
+    prompt = build_flashcard_prompt(text, num_flashcards)
+    response = get_client().chat(model=MODEL, messages=[
         {"role": "user", "content": prompt}
     ])
 
@@ -65,7 +108,7 @@ def main():
         except ValueError:
             pass
 
-    print(f"Generating {num_flashcards} flashcards for subject '{subject}' using Gemma3...")
+    print(f"Generating {num_flashcards} flashcards for subject '{subject}' using {MODEL}...")
     flashcard_json = generate_flashcards(text, num_flashcards=num_flashcards)
 
     if flashcard_json is None:
@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Lower number = served first. Tutor requests are interactive and should
+# never sit behind a batch of PDF uploads.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 10
+PRIORITY_BACKGROUND = 15
+
+DEFAULT_PRIORITIES = {
+    "tutor": PRIORITY_INTERACTIVE,
+    "pipeline": PRIORITY_BULK,
+    # Index, cache pre-warm and bank fill only speed up later requests
+    "material_followups": PRIORITY_BACKGROUND,
+    "question_bank": PRIORITY_BACKGROUND,
+    "bank_answers": PRIORITY_BACKGROUND,
+}
+
+DEFAULT_VISIBILITY_TIMEOUT = 15 * 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+def utcnow():
+    # Node writes jobs with JS Dates (UTC); keep both sides on the same clock
+    return datetime.now(timezone.utc)
+
+def new_job(job_type, payload, priority=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    now = utcnow()
+    return {
+        "type": job_type,
+        "payload": payload,
+        "priority": DEFAULT_PRIORITIES.get(job_type, PRIORITY_NORMAL) if priority is None else priority,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "available_at": now,
+        "locked_until": None,
+        "worker_id": None,
+        "created_at": now,
+    }
+
+class MongoJobQueue:
+    """Job queue stored in a Mongo collection, shared by the Node backend and Python workers.
+
+    A claimed job is invisible to other workers until `locked_until`; a worker
+    that dies mid-job lets the lock lapse and the job is picked up again.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index([("status", 1), ("type", 1), ("priority", 1), ("created_at", 1)])
+        self.collection.create_index([("status", 1), ("locked_until", 1)])
+
+    def enqueue(self, job_type, payload, priority=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        return self.collection.insert_one(new_job(job_type, payload, priority, max_attempts)).inserted_id
+
+    def claim(self, job_types, worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        from pymongo import ReturnDocument
+
+        now = utcnow()
+        return self.collection.find_one_and_update(
+            {
+                "type": {"$in": list(job_types)},
+                "$or": [
+                    {"status": "queued", "available_at": {"$lte": now}},
+                    {"status": "running", "locked_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "locked_until": now + timedelta(seconds=visibility_timeout),
+                    "worker_id": worker_id,
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", 1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, job_id, worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        self.collection.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": "running"},
+            {"$set": {"locked_until": utcnow() + timedelta(seconds=visibility_timeout)}}
+        )
+
+    def complete(self, job_id, worker_id, result=None):
+        """False when the worker's lock lapsed and the job is no longer its to finish"""
+        return self.collection.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": "running"},
+            {"$set": {"status": "completed", "result": result, "finished_at": utcnow(), "locked_until": None}}
+        ).matched_count == 1
+
+    def fail(self, job_id, worker_id, error, retry_delay=None):
+        """Requeue the job after retry_delay seconds, or mark it failed for good when None.
+        False, like complete(), when the worker no longer holds the job."""
+        if retry_delay is None:
+            update = {"status": "failed", "error": str(error), "finished_at": utcnow(), "locked_until": None}
+        else:
+            update = {
+                "status": "queued",
+                "error": str(error),
+                "available_at": utcnow() + timedelta(seconds=retry_delay),
+                "locked_until": None,
+            }
+        return self.collection.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": "running"}, {"$set": update}
+        ).matched_count == 1
+
+    def counts(self):
+        pipeline = [{"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}}]
+        return {(row["_id"]["type"], row["_id"]["status"]): row["count"] for row in self.collection.aggregate(pipeline)}
+
+class InMemoryJobQueue:
+    """Same interface as MongoJobQueue, kept in process memory. Used for tests and local runs."""
+
+    def __init__(self):
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        pass
+
+    def enqueue(self, job_type, payload, priority=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        with self._lock:
+            job = new_job(job_type, payload, priority, max_attempts)
+            job["_id"] = next(self._ids)
+            self.jobs[job["_id"]] = job
+            return job["_id"]
+
+    def claim(self, job_types, worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        now = utcnow()
+        with self._lock:
+            candidates = [
+                (job["priority"], job["created_at"], job["_id"])
+                for job in self.jobs.values()
+                if job["type"] in job_types and (
+                    (job["status"] == "queued" and job["available_at"] <= now)
+                    or (job["status"] == "running" and job["locked_until"] < now)
+                )
+            ]
+            if not candidates:
+                return None
+            job = self.jobs[heapq.nsmallest(1, candidates)[0][2]]
+            job.update({
+                "status": "running",
+                "locked_until": now + timedelta(seconds=visibility_timeout),
+                "worker_id": worker_id,
+                "started_at": now,
+                "attempts": job["attempts"] + 1,
+            })
+            return dict(job)
+
+    def heartbeat(self, job_id, worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job and job["worker_id"] == worker_id and job["status"] == "running":
+                job["locked_until"] = utcnow() + timedelta(seconds=visibility_timeout)
+
+    def _held(self, job_id, worker_id):
+        job = self.jobs.get(job_id)
+        return job if job and job["worker_id"] == worker_id and job["status"] == "running" else None
+
+    def complete(self, job_id, worker_id, result=None):
+        with self._lock:
+            job = self._held(job_id, worker_id)
+            if job is None:
+                return False
+            job.update({"status": "completed", "result": result, "finished_at": utcnow(), "locked_until": None})
+            return True
+
+    def fail(self, job_id, worker_id, error, retry_delay=None):
+        with self._lock:
+            job = self._held(job_id, worker_id)
+            if job is None:
+                return False
+            if retry_delay is None:
+                job.update({"status": "failed", "error": str(error), "finished_at": utcnow(), "locked_until": None})
+            else:
+                job.update({
+                    "status": "queued",
+                    "error": str(error),
+                    "available_at": utcnow() + timedelta(seconds=retry_delay),
+                    "locked_until": None,
+                })
+            return True
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                key = (job["type"], job["status"])
+                counts[key] = counts.get(key, 0) + 1
+            return counts
@@ -0,0 +1,96 @@
+import sys
+import json
+
+class JsonArrayStreamParser:
+    """Incrementally pulls items out of a JSON array as model output arrives.
+
+    Text before the opening '[' (prose, ```json fences) is skipped. Each
+    element is parsed the moment its closing brace or bracket is seen, so a
+    malformed element later in the response does not lose the earlier ones.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.item = []
+        self.errors = 0
+
+    def feed(self, text):
+        items = []
+        for ch in text:
+            if self.finished:
+                break
+            if not self.started:
+                if ch == "[":
+                    self.started = True
+                continue
+
+            if self.depth == 0:
+                # Between elements of the top-level array
+                if ch == "]":
+                    self.finished = True
+                elif ch in "{[":
+                    self.depth = 1
+                    self.item = [ch]
+                continue
+
+            self.item.append(ch)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        items.append(json.loads("".join(self.item)))
+                    except json.JSONDecodeError:
+                        self.errors += 1
+                    self.item = []
+        return items
+
+def stream_chat_items(client, model, messages, validate, **kwargs):
+    """Yield valid array items from a streaming chat response as soon as each one closes"""
+    parser = JsonArrayStreamParser()
+    for chunk in client.chat(model=model, messages=messages, stream=True, **kwargs):
+        for item in parser.feed(chunk["message"]["content"]):
+            if validate(item):
+                yield item
+            else:
+                parser.errors += 1
+        if parser.finished:
+            break
+    if parser.errors:
+        print(f"Skipped {parser.errors} malformed item(s) in streamed response", file=sys.stderr)
+
+def generate_items_streaming(client, model, build_prompt, validate, target, max_rounds=3, key=None):
+    """Stream items until `target` valid ones are collected.
+
+    build_prompt(count, existing) returns the prompt asking for `count` more
+    items; only the shortfall is requested again after a bad response.
+    """
+    items, seen = [], set()
+    for _ in range(max_rounds):
+        missing = target - len(items)
+        if missing <= 0:
+            break
+        messages = [{"role": "user", "content": build_prompt(missing, items)}]
+        for item in stream_chat_items(client, model, messages, validate):
+            item_key = key(item) if key else json.dumps(item, sort_keys=True)
+            if item_key in seen:
+                continue
+            seen.add(item_key)
+            items.append(item)
+            if len(items) >= target:
+                break
+    return items
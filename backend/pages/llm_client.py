@@ -0,0 +1,125 @@
+import os
+import time
+import threading
+from ollama import Client
+from retry import retry_call
+from metrics import span, observe
+
+# Point OLLAMA_HOST at fake_ollama.py to run the whole pipeline without a model
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+MODEL = os.getenv("OLLAMA_MODEL", "gemma3")
+# Seconds; long contexts on a CPU-only box can take minutes to answer
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "600"))
+# In-flight requests per process across all threads. Match OLLAMA_NUM_PARALLEL
+# on the server; more than that only queues inside Ollama.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_ATTEMPTS = int(os.getenv("LLM_ATTEMPTS", "3"))
+
+class LLMClient:
+    """Process-wide front for ollama.Client.
+
+    Keeps one pooled HTTP client per timeout so connections are reused, caps
+    concurrent requests with a semaphore, and retries transient failures.
+    Drop-in for the `client.chat(model=..., messages=...)` calls in each module.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, timeout=LLM_TIMEOUT, max_concurrency=LLM_MAX_CONCURRENCY, attempts=LLM_ATTEMPTS):
+        self.host = host
+        self.timeout = timeout
+        self.attempts = attempts
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, timeout):
+        with self._lock:
+            if timeout not in self._clients:
+                self._clients[timeout] = Client(host=self.host, timeout=timeout)
+            return self._clients[timeout]
+
+    def _acquire(self, request_span):
+        started = time.perf_counter()
+        self._slots.acquire()
+        waited = time.perf_counter() - started
+        observe("llm_queue_wait_seconds", waited, model=request_span.labels["model"])
+        request_span.set(queue_wait_ms=round(waited * 1000, 3))
+
+    def chat(self, model=None, messages=None, stream=False, timeout=None, **kwargs):
+        client = self._client(timeout or self.timeout)
+        model = model or MODEL
+        if stream:
+            return self._stream(client, model, messages, **kwargs)
+
+        def call():
+            # One span per attempt, so retried failures show up as errors
+            with span("llm_request", model=model, stream="false") as request_span:
+                self._acquire(request_span)
+                try:
+                    response = client.chat(model=model, messages=messages, **kwargs)
+                finally:
+                    self._slots.release()
+                record_usage(request_span, response)
+                return response
+        return retry_call(call, attempts=self.attempts)
+
+    def _stream(self, client, model, messages, **kwargs):
+        # Only opening the stream is retried: once chunks have reached the
+        # caller, starting over would hand it duplicate text.
+        def open_stream():
+            chunks = client.chat(model=model, messages=messages, stream=True, **kwargs)
+            return chunks, next(chunks, None)
+
+        # The slot is held until the caller finishes or abandons the stream
+        with span("llm_request", model=model, stream="true") as request_span:
+            self._acquire(request_span)
+            try:
+                started = time.perf_counter()
+                chunks, first = retry_call(open_stream, attempts=self.attempts)
+                if first is None:
+                    return
+                request_span.set(first_chunk_ms=round((time.perf_counter() - started) * 1000, 3))
+                yield first
+                for chunk in chunks:
+                    if usage(chunk, "done"):
+                        record_usage(request_span, chunk)
+                    yield chunk
+            finally:
+                self._slots.release()
+
+    def embed(self, model, input, timeout=None, **kwargs):
+        client = self._client(timeout or self.timeout)
+
+        def call():
+            with span("llm_request", model=model, stream="false", kind="embed") as request_span:
+                self._acquire(request_span)
+                try:
+                    response = client.embed(model=model, input=input, **kwargs)
+                finally:
+                    self._slots.release()
+                request_span.count("prompt_tokens", usage(response, "prompt_eval_count") or 0)
+                return response
+        return retry_call(call, attempts=self.attempts)
+
+    def list_models(self):
+        return retry_call(lambda: self._client(self.timeout).list(), attempts=self.attempts)
+
+def usage(response, field):
+    # ollama returns pydantic models; fakes and older clients return dicts
+    if isinstance(response, dict):
+        return response.get(field)
+    return getattr(response, field, None)
+
+def record_usage(request_span, response):
+    request_span.count("prompt_tokens", usage(response, "prompt_eval_count") or 0)
+    request_span.count("output_tokens", usage(response, "eval_count") or 0)
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def get_client():
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = LLMClient()
+        return _default_client
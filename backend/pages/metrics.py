@@ -0,0 +1,317 @@
+"""Timing spans, counters and histograms for the pipeline, the LLM client and DB writes.
+
+Every finished span is aggregated in process (Prometheus text via
+render_prometheus / serve / write_prometheus) and appended as one JSON line to
+metrics/events.ndjson. Short-lived scripts each add to the same events file,
+and `python metrics.py prom` rebuilds the aggregates across all of them.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import argparse
+import threading
+import contextvars
+from datetime import datetime, timezone
+
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")
+EVENTS_PATH = os.getenv("METRICS_EVENTS_PATH", os.path.join(METRICS_DIR, "events.ndjson"))
+EVENTS_ENABLED = os.getenv("METRICS_EVENTS", "1") != "0"
+# Written at exit when set, for processes nobody scrapes
+DUMP_PATH = os.getenv("METRICS_DUMP_PATH")
+PREFIX = "lms_"
+
+# Events are written in batches, not per span
+FLUSH_EVENTS = 200
+FLUSH_INTERVAL = 5.0
+
+# Seconds; covers a cached DB write up to a long context generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render_prometheus(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} counter")
+                    typed.add(name)
+                lines.append(f"{PREFIX}{name}{fmt(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_bucket{fmt(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{PREFIX}{name}_sum{fmt(labels)} {round(histogram.sum, 6)}")
+                lines.append(f"{PREFIX}{name}_count{fmt(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+class EventBuffer:
+    """Buffered NDJSON writer; each flush is one append so concurrent processes do not interleave lines"""
+
+    def __init__(self, path=EVENTS_PATH, max_events=FLUSH_EVENTS, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.max_events = max_events
+        self.interval = interval
+        self.events = []
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        with self._lock:
+            self.events.append(json.dumps(event, ensure_ascii=False, default=str))
+            if len(self.events) < self.max_events and time.monotonic() - self.last_flush < self.interval:
+                return
+            lines, self.events = self.events, []
+            self.last_flush = time.monotonic()
+        self.write(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self.events = self.events, []
+            self.last_flush = time.monotonic()
+        self.write(lines)
+
+    def write(self, lines):
+        if not lines:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            print(f"Could not write metrics events: {e}", file=sys.stderr)
+
+registry = MetricsRegistry()
+events = EventBuffer() if EVENTS_ENABLED else None
+# (trace_id, span_id) of the span the current code runs under
+_current = contextvars.ContextVar("metrics_span", default=None)
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+def event(kind, **fields):
+    if events is not None:
+        parent = _current.get()
+        events.emit({"type": kind, "ts": datetime.now(timezone.utc).isoformat(), "trace_id": parent[0] if parent else None, **fields})
+
+class Span:
+    """Times a block: `with span("pipeline_stage", stage="quiz") as s: ... s.set(cached=True)`.
+
+    Labels become metric labels and must stay low-cardinality; per-call detail
+    (material ids, file names) goes in set(). count() adds to a counter named
+    after the span, e.g. span "llm_request" + count("output_tokens", n) ->
+    llm_request_output_tokens_total.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.fields = {}
+        self.counts = {}
+        self.duration = None
+        self.status = None
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def __enter__(self):
+        parent = _current.get()
+        self.parent_id = parent[1] if parent else None
+        self.trace_id = parent[0] if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self._token = _current.set((self.trace_id, self.span_id))
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        # A caller that stops reading a stream early is not an error
+        self.status = "ok" if exc_type is None or issubclass(exc_type, GeneratorExit) else "error"
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # A stream's span closed from another context (e.g. garbage collected)
+            pass
+        record_span(self.name, self.labels, self.duration, self.status, self.counts)
+        if events is not None:
+            events.emit({
+                "type": "span", "name": self.name, "ts": self.started_at.isoformat(),
+                "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "duration_ms": round(self.duration * 1000, 3), "status": self.status,
+                "labels": self.labels, "counts": self.counts, **self.fields,
+                **({"error": str(exc)} if self.status == "error" else {}),
+            })
+        return False
+
+    def summary(self):
+        """Compact record for storing on a document"""
+        return {"seconds": round(self.duration or 0.0, 3), "status": self.status, **self.fields}
+
+span = Span
+
+def in_current_trace(func):
+    """Wrap func for a thread pool so the spans it opens join the caller's trace"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+def record_span(name, labels, duration, status, counts, target=None):
+    target = target or registry
+    target.observe(f"{name}_seconds", duration, **labels)
+    target.inc(f"{name}_total", status=status, **labels)
+    for count_name, value in counts.items():
+        target.inc(f"{name}_{count_name}_total", value, **labels)
+
+def render_prometheus():
+    return registry.render_prometheus()
+
+def write_prometheus(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+def serve(port, host="0.0.0.0"):
+    """Expose /metrics on a background thread (for long-lived processes such as worker.py)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def shutdown():
+    if events is not None:
+        events.flush()
+    if DUMP_PATH:
+        write_prometheus(DUMP_PATH)
+
+atexit.register(shutdown)
+
+def read_events(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+def aggregate_events(path):
+    """Rebuild counters and histograms from the spans every process wrote"""
+    target = MetricsRegistry()
+    for item in read_events(path):
+        if item.get("type") == "span":
+            record_span(item["name"], item.get("labels", {}), item["duration_ms"] / 1000, item.get("status", "ok"), item.get("counts", {}), target)
+    return target
+
+def summarize_events(path):
+    durations = {}
+    for item in read_events(path):
+        if item.get("type") == "span":
+            labels = ",".join(f"{k}={v}" for k, v in sorted(item.get("labels", {}).items()))
+            durations.setdefault(f"{item['name']}{{{labels}}}", []).append(item["duration_ms"])
+    summary = {}
+    for key, values in sorted(durations.items()):
+        values.sort()
+        summary[key] = {
+            "count": len(values),
+            "p50_ms": values[len(values) // 2],
+            "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max_ms": values[-1],
+        }
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate span events written by the pipeline, worker and tutor")
+    parser.add_argument("command", choices=["prom", "summary"])
+    parser.add_argument("--events", default=EVENTS_PATH)
+    parser.add_argument("--output", help="Write instead of printing")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.events):
+        print(f"No events file at {args.events}", file=sys.stderr)
+        sys.exit(1)
+    text = aggregate_events(args.events).render_prometheus() if args.command == "prom" else json.dumps(summarize_events(args.events), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,152 @@
+"""Import the per-user session files the Node backend writes into Mongo.
+
+Walks user_answers/<userId>/*.json and flashcard_sessions/<userId>/*.json,
+parses files in a thread pool and inserts them in unordered batches. Every
+record carries a hash of its content behind a unique index, so re-running the
+import only adds files that are new:
+
+    python migrate_answers.py --root .. --batch-size 1000
+"""
+
 import os
+import sys
 import json
-from db import db
+import time
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from bson import ObjectId
-import datetime
-
-def migrate_answers():
-    for filename in os.listdir('user_answers'):
-        if filename.endswith('.json'):
-            user_id = filename.split('.')[0]  # Assuming filename is userid.json
-            with open(f'user_answers/{filename}') as f:
-                answers = json.load(f)
-            
-            db.user_answers.insert_one({
-                "user_id": ObjectId(user_id),
-                "answers": answers,
-                "migrated_at": datetime.now()
-            })
\ No newline at end of file
+from db import db
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Folder under the backend -> collection
+SOURCES = {
+    "user_answers": "user_answers",
+    "flashcard_sessions": "flashcard_sessions",
+}
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+PROGRESS_INTERVAL = 5.0
+
+def walk_session_files(root, folder):
+    """Yield (user_id, path) for every JSON file, one user directory at a time"""
+    base = os.path.join(root, folder)
+    if not os.path.isdir(base):
+        return
+    with os.scandir(base) as users:
+        for user_dir in users:
+            if not user_dir.is_dir():
+                continue
+            with os.scandir(user_dir.path) as files:
+                for entry in files:
+                    if entry.is_file() and entry.name.endswith(".json"):
+                        yield user_dir.name, entry.path
+
+def content_hash(data):
+    # Canonical JSON, so reformatting a file does not make it a new record
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+def parse_session_file(user_id, path, root):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    record = dict(data)
+    record["user_id"] = ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id
+    record["completed_at"] = parse_timestamp(data.get("timestamp"))
+    record["source_file"] = os.path.relpath(path, root)
+    record["content_hash"] = content_hash({"user_id": user_id, "data": data})
+    record["migrated_at"] = datetime.now(timezone.utc)
+    return record
+
+def parse_in_pool(items, parse, workers, window):
+    """Like pool.map but reads `items` lazily, keeping at most `window` files in flight.
+    Yields (item, record or exception) in input order."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(parse, *item)))
+            if len(pending) >= window:
+                yield finished(*pending.popleft())
+        while pending:
+            yield finished(*pending.popleft())
+
+def finished(item, future):
+    try:
+        return item, future.result()
+    except (OSError, ValueError) as e:
+        return item, e
+
+class Progress:
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.files = 0
+
+    def tick(self, label):
+        self.files += 1
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(f"[{label}] {self.files} files, {self.rate():.0f} records/s", flush=True)
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.files / elapsed if elapsed > 0 else 0.0
+
+def import_folder(root, folder, batch_size, workers, dry_run=False):
+    collection = SOURCES[folder]
+    progress = Progress()
+    totals = {"files": 0, "errors": 0, "inserted": 0, "duplicates": 0}
+    records = parse_in_pool(
+        walk_session_files(root, folder),
+        lambda user_id, path: parse_session_file(user_id, path, root),
+        workers, window=max(batch_size, workers * 4),
+    )
+
+    writer = None if dry_run else db.bulk_writer(collection, batch_size=batch_size)
+    for (user_id, path), record in records:
+        totals["files"] += 1
+        progress.tick(folder)
+        if isinstance(record, Exception):
+            totals["errors"] += 1
+            print(f"Skipping {os.path.relpath(path, root)}: {record}", file=sys.stderr)
+            continue
+        if writer is not None:
+            writer.add(record)
+    if writer is not None:
+        totals.update(writer.flush())
+
+    elapsed = time.perf_counter() - progress.started
+    totals["seconds"] = round(elapsed, 3)
+    totals["records_per_s"] = round(progress.rate(), 1)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Import user_answers and flashcard_sessions files into MongoDB")
+    parser.add_argument("--root", default=BACKEND_DIR, help="Directory holding user_answers/ and flashcard_sessions/")
+    parser.add_argument("--only", choices=list(SOURCES), action="append", help="Import just this tree (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Threads parsing files")
+    parser.add_argument("--dry-run", action="store_true", help="Parse and count without writing")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        db.ensure_indexes()
+    results = {}
+    for folder in args.only or list(SOURCES):
+        results[folder] = import_folder(args.root, folder, args.batch_size, args.workers, args.dry_run)
+        print(f"[{folder}] {json.dumps(results[folder])}", flush=True)
+    if any(result["errors"] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
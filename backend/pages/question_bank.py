@@ -0,0 +1,360 @@
+"""Per-material question bank that quizzes are drawn from, grown in the background.
+
+    python question_bank.py fill <material_id>
+    python question_bank.py quiz <material_id> -n 10
+"""
+
+import os
+import re
+import sys
+import json
+import zlib
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+from collections import defaultdict
+import numpy as np
+from bson import Binary, ObjectId
+from pymongo.errors import BulkWriteError
+from llm_client import get_client, MODEL
+from quiz_generator import build_quiz_prompt, validate_quiz_items
+from study_set_generator import extract_json_list
+from metrics import span
+import analytics
+
+COLLECTION = "question_bank"
+BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", "40"))
+GENERATION_BATCH = 10
+MAX_ROUNDS = 8
+# A round that adds fewer new questions than this means the material is exhausted
+MIN_NEW_PER_ROUND = 2
+# Questions listed in the prompt as "do not repeat"; bounded to keep prompts small
+MAX_AVOID_LISTED = 30
+
+# Character 4-grams of the sorted, stemmed content words, so reworded questions still match
+SHINGLE_CHARS = 4
+SHINGLING = f"char{SHINGLE_CHARS}-sorted-stems"  # stored with each signature; others are recomputed
+STOP_WORDS = frozenset("a an the is are be by in of on to at for from with as and or it this that do does you your "
+                       "which what when where who how".split())
+NUM_PERM = 128  # estimates within ~0.04 of the true similarity
+LSH_BANDS = 32  # 4 rows per band: pairs above ~0.45 similarity become candidates
+DUPLICATE_THRESHOLD = 0.72  # rewordings measured 0.77-1.0, distinct questions up to ~0.7
+_PRIME = (1 << 31) - 1
+_perm_rng = np.random.default_rng(20240817)
+_PERM_A = _perm_rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_PERM_B = _perm_rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+# Smoothed miss rate, so one unlucky attempt does not make a question "hard"; mirrored in services/questionBankService.js
+PRIOR_MISS_RATE = 0.3
+PRIOR_ATTEMPTS = 4
+BAND_NAMES = ["easy", "medium", "hard"]
+BAND_EDGES = [0.25, 0.5]
+QUIZ_MIX = {"easy": 0.3, "medium": 0.4, "hard": 0.3}
+# Seconds an in-memory bank is reused before it is reloaded with other processes' statistics
+POOL_TTL = int(os.getenv("QUESTION_BANK_TTL", "60"))
+
+WORD = re.compile(r"[a-z0-9_]+")
+
+def stem(word):
+    for suffix in ("ing", "es", "s", "ed"):
+        if len(word) > 4 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+def shingles(text):
+    words = WORD.findall(text.lower())
+    words = [word for word in words if word not in STOP_WORDS] or words
+    joined = " ".join(sorted(stem(word) for word in words))
+    if len(joined) <= SHINGLE_CHARS:
+        return {joined}
+    return {joined[i:i + SHINGLE_CHARS] for i in range(len(joined) - SHINGLE_CHARS + 1)}
+
+def signature(question):
+    """MinHash of the question with its correct option; the distractors do not make a question new"""
+    text = f"{question['question']} {question['options'].get(question['answer'], '')}"
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) % _PRIME for s in shingles(text)], dtype=np.uint64)
+    return ((np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+class DedupIndex:
+    def __init__(self):
+        self.signatures = []
+        self.buckets = defaultdict(list)
+        self.rows = NUM_PERM // LSH_BANDS
+
+    def _keys(self, sig):
+        return [(band, sig[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(LSH_BANDS)]
+
+    def find(self, sig):
+        """Index of a near-identical question already in the index, or None"""
+        candidates = {i for key in self._keys(sig) for i in self.buckets.get(key, ())}
+        for i in candidates:
+            if np.mean(self.signatures[i] == sig) >= DUPLICATE_THRESHOLD:
+                return i
+        return None
+
+    def add(self, sig):
+        for key in self._keys(sig):
+            self.buckets[key].append(len(self.signatures))
+        self.signatures.append(sig)
+
+def question_id(material_id, question):
+    text = " ".join(WORD.findall(question["question"].lower()))
+    return f"{material_id}:{hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]}"
+
+def bank_document(material_id, question, source, sig, attempts=0, misses=0):
+    return {
+        "_id": question_id(material_id, question),
+        "material_id": str(material_id),
+        "question": question["question"],
+        "options": question["options"],
+        "answer": question["answer"],
+        "source": source,
+        "signature": Binary(sig.tobytes()),
+        "shingling": SHINGLING,
+        "attempts": attempts,
+        "misses": misses,
+        "created_at": datetime.now(),
+    }
+
+def seed_bank(database, material_id, quiz_content, context_path=None):
+    """Put the material's own quiz in the bank, with the miss statistics its attempts already have"""
+    material_id = str(material_id)
+    stats = (database[analytics.COLLECTION].find_one({"_id": f"material:{material_id}"}) or {}).get("question_stats", {})
+    collection = database[COLLECTION]
+    with span("db_write", collection=COLLECTION, op="seed"):
+        for index, question in enumerate(validate_quiz_items(quiz_content)):
+            known = stats.get(str(index), {})
+            document = bank_document(material_id, question, "quiz", signature(question), known.get("attempts", 0), known.get("misses", 0))
+            collection.update_one({"_id": document["_id"]}, {"$setOnInsert": document}, upsert=True)
+    state = {"question_bank.seeded_at": datetime.now()}
+    if context_path:
+        state["question_bank.context_path"] = context_path
+    database["materials"].update_one({"_id": ObjectId(material_id)}, {"$set": state})
+    invalidate(material_id)
+
+def request_questions(context, count, avoid):
+    prompt = build_quiz_prompt(context, count, [{"question": text} for text in avoid])
+    response = get_client().chat(model=MODEL, messages=[{"role": "user", "content": prompt}])
+    return validate_quiz_items(extract_json_list(response["message"]["content"]))
+
+def fill_bank(database, material_id, context=None, size=BANK_SIZE):
+    """Generate questions until the bank holds `size` or the model stops producing new ones"""
+    material_id = str(material_id)
+    if context is None:
+        material = database["materials"].find_one({"_id": ObjectId(material_id)}, {"question_bank": 1}) or {}
+        context_path = material.get("question_bank", {}).get("context_path")
+        if not context_path or not os.path.isfile(context_path):
+            raise ValueError(f"No context text recorded for material {material_id}")
+        with open(context_path, "r", encoding="utf-8") as f:
+            context = f.read()
+
+    collection = database[COLLECTION]
+    index, questions = DedupIndex(), []
+    for doc in collection.find({"material_id": material_id}, {"question": 1, "options": 1, "answer": 1, "signature": 1, "shingling": 1}):
+        if doc.get("shingling") == SHINGLING:
+            index.add(np.frombuffer(doc["signature"], dtype=np.uint32))
+        else:
+            index.add(signature(doc))
+        questions.append(doc["question"])
+
+    added = duplicates = rounds = 0
+    with span("question_bank_fill") as fill_span:
+        while len(questions) < size and rounds < MAX_ROUNDS:
+            rounds += 1
+            avoid = random.sample(questions, min(len(questions), MAX_AVOID_LISTED))
+            try:
+                batch = request_questions(context, min(GENERATION_BATCH, size - len(questions)), avoid)
+            except Exception as e:
+                print(f"Question bank generation failed for material {material_id}: {e}", file=sys.stderr)
+                break
+            documents = []
+            for question in batch:
+                sig = signature(question)
+                if index.find(sig) is not None:
+                    duplicates += 1
+                    continue
+                index.add(sig)
+                documents.append(bank_document(material_id, question, "generated", sig))
+            inserted = insert_questions(collection, documents)
+            # The rest had the same normalized text as a stored question: not new after all
+            duplicates += len(documents) - len(inserted)
+            questions.extend(document["question"] for document in inserted)
+            added += len(inserted)
+            if len(inserted) < MIN_NEW_PER_ROUND:
+                break
+        fill_span.set(material_id=material_id, added=added, duplicates=duplicates, rounds=rounds, size=len(questions))
+
+    database["materials"].update_one({"_id": ObjectId(material_id)}, {"$set": {
+        "question_bank.size": len(questions), "question_bank.filled_at": datetime.now(),
+    }})
+    invalidate(material_id)
+    return {"size": len(questions), "added": added, "duplicates": duplicates, "rounds": rounds}
+
+def insert_questions(collection, documents):
+    """Insert what is new and return those documents; ids already taken are skipped, not fatal"""
+    if not documents:
+        return []
+    try:
+        with span("db_write", collection=COLLECTION, op="insert_many"):
+            collection.insert_many(documents, ordered=False)
+        return documents
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+        failed = {error["index"] for error in errors}
+        return [document for i, document in enumerate(documents) if i not in failed]
+
+class Pool:
+    """A material's bank in memory, with statistics as arrays for fast weighting"""
+
+    def __init__(self, documents):
+        self.ids = [doc["_id"] for doc in documents]
+        self.position = {qid: i for i, qid in enumerate(self.ids)}
+        self.questions = [{"question": doc["question"], "options": doc["options"], "answer": doc["answer"]} for doc in documents]
+        self.attempts = np.array([doc.get("attempts", 0) for doc in documents], dtype=np.float64)
+        self.misses = np.array([doc.get("misses", 0) for doc in documents], dtype=np.float64)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def difficulty(self):
+        return (self.misses + PRIOR_MISS_RATE * PRIOR_ATTEMPTS) / (self.attempts + PRIOR_ATTEMPTS)
+
+    def record(self, seen, missed):
+        with self.lock:
+            for qid in seen:
+                if qid in self.position:
+                    self.attempts[self.position[qid]] += 1
+            for qid in missed:
+                if qid in self.position:
+                    self.misses[self.position[qid]] += 1
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def load_pool(database, material_id):
+    material_id = str(material_id)
+    with _pools_lock:
+        cached = _pools.get(material_id)
+    if cached and time.monotonic() - cached[0] < POOL_TTL:
+        return cached[1]
+    documents = list(database[COLLECTION].find({"material_id": material_id}, {"signature": 0}).sort("_id", 1))
+    pool = Pool(documents)
+    with _pools_lock:
+        _pools[material_id] = (time.monotonic(), pool)
+    return pool
+
+def invalidate(material_id):
+    with _pools_lock:
+        _pools.pop(str(material_id), None)
+
+def band_quotas(n, available):
+    """Questions per band following QUIZ_MIX, moving any shortfall to bands that have questions left"""
+    wanted = [QUIZ_MIX[name] * n for name in BAND_NAMES]
+    quotas = [int(w) for w in wanted]
+    for band in sorted(range(len(BAND_NAMES)), key=lambda b: wanted[b] - quotas[b], reverse=True)[:n - sum(quotas)]:
+        quotas[band] += 1
+    quotas = [min(q, a) for q, a in zip(quotas, available)]
+    while sum(quotas) < min(n, sum(available)):
+        band = max(range(len(BAND_NAMES)), key=lambda b: available[b] - quotas[b])
+        quotas[band] += 1
+    return quotas
+
+def assemble_quiz(database, material_id, n=10, seed=None, exclude=()):
+    """A randomized, difficulty-balanced quiz: [{"id", "question", "options", "answer", "difficulty"}], or None without a bank"""
+    pool = load_pool(database, material_id)
+    if not len(pool):
+        return None
+    rng = np.random.default_rng(seed)
+    with pool.lock:
+        difficulty = pool.difficulty()
+        # Less-answered questions are drawn more often until their statistics settle
+        weights = 1.0 / np.sqrt(1.0 + pool.attempts)
+    bands = np.digitize(difficulty, BAND_EDGES)
+    excluded = {pool.position[qid] for qid in exclude if qid in pool.position}
+    candidates = [[i for i in np.flatnonzero(bands == band) if i not in excluded] for band in range(len(BAND_NAMES))]
+
+    chosen = []
+    for band, quota in enumerate(band_quotas(n, [len(c) for c in candidates])):
+        if quota:
+            rows = np.array(candidates[band])
+            p = weights[rows] / weights[rows].sum()
+            chosen.extend(rng.choice(rows, size=quota, replace=False, p=p).tolist())
+    rng.shuffle(chosen)
+    return [{"id": pool.ids[i], **pool.questions[i], "difficulty": BAND_NAMES[bands[i]]} for i in chosen]
+
+def bank_questions(database, question_ids):
+    """Bank questions in the order of question_ids, as quiz_content items (the tutor's view of a drawn quiz)"""
+    documents = {doc["_id"]: doc for doc in database[COLLECTION].find(
+        {"_id": {"$in": list(question_ids)}}, {"question": 1, "options": 1, "answer": 1}
+    )}
+    missing = [qid for qid in question_ids if qid not in documents]
+    if missing:
+        raise ValueError(f"{len(missing)} question(s) not in the bank: {', '.join(missing[:3])}")
+    return [{"question": documents[qid]["question"], "options": documents[qid]["options"], "answer": documents[qid]["answer"]}
+            for qid in question_ids]
+
+def record_answers(database, material_id, question_ids, answers):
+    """Count one attempt against the bank questions it used; answers refer to them by questionIndex"""
+    seen, missed = [], []
+    for answer in answers or []:
+        index = answer.get("questionIndex")
+        if isinstance(index, int) and 0 <= index < len(question_ids):
+            seen.append(question_ids[index])
+            if not answer.get("isCorrect"):
+                missed.append(question_ids[index])
+    if not seen:
+        return 0
+    collection = database[COLLECTION]
+    with span("db_write", collection=COLLECTION, op="update_many"):
+        collection.update_many({"_id": {"$in": seen}}, {"$inc": {"attempts": 1}})
+        if missed:
+            collection.update_many({"_id": {"$in": missed}}, {"$inc": {"misses": 1}})
+    with _pools_lock:
+        cached = _pools.get(str(material_id))
+    if cached:
+        cached[1].record(seen, missed)
+    return len(seen)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a material's question bank or draw a quiz from it")
+    parser.add_argument("command", choices=["fill", "quiz", "stats"])
+    parser.add_argument("material_id")
+    parser.add_argument("-n", type=int, default=10, help="Questions per quiz")
+    parser.add_argument("--size", type=int, default=BANK_SIZE, help="Bank size to fill up to")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    from db import db
+    if args.command == "fill":
+        material = db.materials.find_one({"_id": ObjectId(args.material_id)}, {"quiz_content": 1})
+        if not material:
+            print(f"Material {args.material_id} not found", file=sys.stderr)
+            sys.exit(1)
+        seed_bank(db.db, args.material_id, material.get("quiz_content") or [])
+        print(json.dumps(fill_bank(db.db, args.material_id, size=args.size)))
+    elif args.command == "quiz":
+        started = time.perf_counter()
+        quiz = assemble_quiz(db.db, args.material_id, args.n, args.seed)
+        if quiz is None:
+            print(f"No question bank for material {args.material_id}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(quiz, indent=2, ensure_ascii=False))
+        print(f"Assembled in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    else:
+        pool = load_pool(db.db, args.material_id)
+        bands = np.digitize(pool.difficulty(), BAND_EDGES)
+        print(json.dumps({
+            "questions": len(pool),
+            "bands": {name: int(np.sum(bands == band)) for band, name in enumerate(BAND_NAMES)},
+            "attempts": int(pool.attempts.sum()),
+            "misses": int(pool.misses.sum()),
+        }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,35 @@
 import sys
 import os
 import json
-from ollama import Client
-
-client = Client(host='http://localhost:11434')
-
-def generate_quiz(text, num_questions=10):
+from llm_client import get_client, MODEL
+from json_stream import generate_items_streaming
+
+# Bump when the prompt changes so cached artifacts from the old prompt are not reused
+PROMPT_VERSION = 1
+
+OPTION_LETTERS = ["A", "B", "C", "D"]
+
+def validate_quiz_item(item):
+    """True if item has the shape stored in quiz_content: question, options A-D, answer letter"""
+    if not isinstance(item, dict) or not isinstance(item.get("question"), str) or not item["question"].strip():
+        return False
+    options = item.get("options")
+    if not isinstance(options, dict) or sorted(options) != OPTION_LETTERS:
+        return False
+    if not all(isinstance(value, str) and value.strip() for value in options.values()):
+        return False
+    return item.get("answer") in OPTION_LETTERS
+
+def validate_quiz_items(items):
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if validate_quiz_item(item)]
+
+# Parse questions out of the streamed response one at a time instead of
+# waiting for (and possibly losing) the whole list. Opt-in.
+STREAM_GENERATION = os.getenv("STREAM_GENERATION", "0") == "1"
+
+def build_quiz_prompt(text, num_questions, existing=()):
     prompt = f"""
 You are an expert education assistant.
 Generate a quiz with {num_questions} multiple choice questions based on the educational content below.
@@ -22,7 +46,32 @@ Respond ONLY in JSON format as a list of dicts. Each dict should have:
 - "options" (dict with keys 'A', 'B', 'C', 'D')
 - "answer" (str, one of 'A', 'B', 'C', 'D').
     """
-    response = client.chat(model="gemma3", messages=[
+    if existing:
+        # Top-up request after a partly malformed response: ask only for new questions
+        asked = "\n".join(f"- {item['question']}" for item in existing)
+        prompt += f"\nDo not repeat any of these questions:\n{asked}\n"
+    return prompt
+
+def generate_quiz_streaming(text, num_questions=10):
+    questions = generate_items_streaming(
+        get_client(), MODEL,
+        lambda count, existing: build_quiz_prompt(text, count, existing),
+        validate_quiz_item, num_questions,
+        key=lambda item: item["question"].strip().lower()
+    )
+    if not questions:
+        print("ERROR: No valid questions found in the model's streamed response.", file=sys.stderr)
+        return None
+    if len(questions) < num_questions:
+        print(f"WARNING: Only {len(questions)} of {num_questions} questions were valid.", file=sys.stderr)
+    return json.dumps(questions, indent=2, ensure_ascii=False)
+
+def generate_quiz(text, num_questions=10, stream=STREAM_GENERATION):
+    if stream:
+        return generate_quiz_streaming(text, num_questions)
+
+    prompt = build_quiz_prompt(text, num_questions)
+    response = get_client().chat(model=MODEL, messages=[
         {"role": "user", "content": prompt}
     ])
     
@@ -70,7 +119,7 @@ def main():
         except ValueError:
             pass
 
-    print(f"Generating {num_questions} quiz questions using Gemma3...")
+    print(f"Generating {num_questions} quiz questions using {MODEL}...")
     quiz_json = generate_quiz(text, num_questions=num_questions)
 
     # If quiz generation failed, exit gracefully
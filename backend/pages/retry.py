@@ -0,0 +1,57 @@
+import sys
+import time
+import random
+
+def is_transient_error(error):
+    """True for errors worth retrying: dropped connections, timeouts, overloaded model server, Mongo failover"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+
+    try:
+        from ollama import ResponseError
+        if isinstance(error, ResponseError):
+            # 5xx covers "model is loading" and out-of-memory hiccups; 429 is back-pressure
+            return error.status_code == 429 or error.status_code >= 500
+    except ImportError:
+        pass
+
+    try:
+        import httpx
+        if isinstance(error, (httpx.TransportError, httpx.TimeoutException)):
+            return True
+    except ImportError:
+        pass
+
+    try:
+        from pymongo.errors import AutoReconnect, ConnectionFailure, NetworkTimeout
+        if isinstance(error, (AutoReconnect, ConnectionFailure, NetworkTimeout)):
+            return True
+    except ImportError:
+        pass
+
+    return False
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    # Full jitter keeps concurrent stages from retrying in lockstep
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def retry_call(func, attempts=4, base_delay=1.0, max_delay=30.0, is_transient=is_transient_error, on_retry=None):
+    """Call func(), retrying transient failures with exponential backoff"""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as e:
+            if getattr(e, "retries_exhausted", False) or not is_transient(e):
+                raise
+            if attempt == attempts - 1:
+                # Marked so an outer retry_call (a pipeline stage around LLMClient.chat)
+                # does not start the same attempts over again
+                if attempts > 1:
+                    e.retries_exhausted = True
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if on_retry:
+                on_retry(attempt + 1, e, delay)
+            else:
+                print(f"Transient error ({e}); retrying in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
@@ -0,0 +1,284 @@
+"""SM-2 spaced repetition for flashcards, one compact store per user.
+
+Card state lives in a numpy structured array (one 32-byte row per card) with
+a heap of due dates beside it, so the next N due cards cost O(N log n) even
+for users with tens of thousands of cards. Rescheduling a card pushes a new
+heap entry and bumps the row's version; stale entries are skipped when they
+surface (lazy deletion) and the heap is rebuilt once they outnumber live rows.
+
+In Mongo the rows are stored in chunks of CHUNK_SIZE cards as packed binary
+(card_states collection), and a session only rewrites the chunks it touched.
+Each chunk also lists the last sessions applied to it, so a save retried
+after a conflict part-way through never applies a review twice.
+Cards are identified by a hash of their deck and question text, so a
+regenerated deck keeps the progress of questions that did not change.
+"""
+
+import sys
+import json
+import time
+import heapq
+import hashlib
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+from metrics import span
+
+COLLECTION = "card_states"
+CHUNK_SIZE = 1024
+DAY = 86400
+SAVE_ATTEMPTS = 3
+# Session ids remembered per chunk; only needs to outlast a session's retries
+CHUNK_SESSIONS = 32
+
+STATE_DTYPE = np.dtype([
+    ("card", "<u8"),         # card_id(deck, question)
+    ("due", "<i8"),          # unix seconds
+    ("last_review", "<i8"),
+    ("ease", "<f4"),
+    ("interval", "<f4"),     # days
+    ("reps", "<u2"),
+    ("lapses", "<u2"),
+    ("deck", "<u4"),         # index into CardStore.decks
+])
+
+MIN_EASE = 1.3
+START_EASE = 2.5
+
+def card_id(deck, question):
+    digest = hashlib.sha1(f"{deck}\n{question}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+def sm2(ease, interval, reps, quality):
+    """One SM-2 step. quality is 0-5; below 3 the card starts over. Returns (ease, interval, reps)."""
+    if quality < 3:
+        reps, interval = 0, 1.0
+    else:
+        interval = 1.0 if reps == 0 else 6.0 if reps == 1 else round(interval * ease)
+        reps += 1
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return ease, interval, reps
+
+def review_quality(card):
+    # Sessions report either an SM-2 grade or whether the student knew the card
+    if card.get("quality") is not None:
+        return max(0, min(5, int(card["quality"])))
+    return 4 if card.get("correct", card.get("known")) else 1
+
+class ConflictError(Exception):
+    """Another session saved the same user's cards first"""
+
+class CardStore:
+    def __init__(self, user_id, rows=None, decks=None, versions=None, sessions=None):
+        self.user_id = user_id
+        self.rows = rows if rows is not None else np.zeros(0, dtype=STATE_DTYPE)
+        self.count = len(self.rows)
+        self.decks = list(decks or [])
+        self._deck_index = {deck: i for i, deck in enumerate(self.decks)}
+        self._row_of = {int(card): row for row, card in enumerate(self.rows["card"][:self.count])}
+        # Stored version of each chunk, checked on save; dirty chunks are rewritten
+        self.chunk_versions = dict(versions or {})
+        # Ids of the sessions already saved into each chunk
+        self.chunk_sessions = {chunk: list(ids) for chunk, ids in (sessions or {}).items()}
+        self.dirty = set()
+        self.decks_changed = False
+        self._rebuild_heap()
+
+    def __len__(self):
+        return self.count
+
+    def _rebuild_heap(self):
+        self._version = np.zeros(len(self.rows), dtype=np.uint32)
+        self._heap = [(int(due), row, 0) for row, due in enumerate(self.rows["due"][:self.count])]
+        heapq.heapify(self._heap)
+
+    def _push(self, row):
+        self._version[row] += 1
+        heapq.heappush(self._heap, (int(self.rows["due"][row]), row, int(self._version[row])))
+        if len(self._heap) > 2 * self.count + 64:
+            self._rebuild_heap()
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self.rows))
+        rows = np.zeros(capacity, dtype=STATE_DTYPE)
+        rows[:self.count] = self.rows[:self.count]
+        versions = np.zeros(capacity, dtype=np.uint32)
+        versions[:self.count] = self._version[:self.count]
+        self.rows, self._version = rows, versions
+
+    def _add(self, deck, question, now):
+        if self.count == len(self.rows):
+            self._grow()
+        if deck not in self._deck_index:
+            self._deck_index[deck] = len(self.decks)
+            self.decks.append(deck)
+            self.decks_changed = True
+        row = self.count
+        self.count += 1
+        self.rows[row] = (card_id(deck, question), now, 0, START_EASE, 0.0, 0, 0, self._deck_index[deck])
+        self._row_of[int(self.rows["card"][row])] = row
+        return row
+
+    def applied(self, deck, question, session_id):
+        """Whether session_id's review of this card is already saved"""
+        row = self._row_of.get(card_id(deck, question))
+        return row is not None and session_id in self.chunk_sessions.get(row // CHUNK_SIZE, ())
+
+    def review(self, deck, question, quality, now=None):
+        now = int(now if now is not None else time.time())
+        row = self._row_of.get(card_id(deck, question))
+        if row is None:
+            row = self._add(deck, question, now)
+        state = self.rows[row]
+        ease, interval, reps = sm2(float(state["ease"]), float(state["interval"]), int(state["reps"]), quality)
+        if quality < 3:
+            state["lapses"] = min(int(state["lapses"]) + 1, np.iinfo(np.uint16).max)
+        state["ease"], state["interval"], state["reps"] = ease, interval, min(reps, np.iinfo(np.uint16).max)
+        state["last_review"] = now
+        state["due"] = now + int(interval * DAY)
+        self.dirty.add(row // CHUNK_SIZE)
+        self._push(row)
+        return row
+
+    def next_due(self, n=20, now=None):
+        """Up to n cards due by `now`, soonest first, as (row, due) pairs"""
+        now = int(now if now is not None else time.time())
+        taken = []
+        while self._heap and len(taken) < n and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            due, row, version = entry
+            if version == self._version[row]:
+                taken.append(entry)
+        # Peeking must not consume: live entries go back on the heap
+        for entry in taken:
+            heapq.heappush(self._heap, entry)
+        return [(row, due) for due, row, _ in taken]
+
+    def describe(self, row):
+        state = self.rows[row]
+        return {
+            "deck": self.decks[int(state["deck"])],
+            "card_id": f"{int(state['card']):016x}",
+            "due": datetime.fromtimestamp(int(state["due"]), timezone.utc).isoformat(),
+            "interval_days": float(state["interval"]),
+            "ease": round(float(state["ease"]), 3),
+            "reps": int(state["reps"]),
+            "lapses": int(state["lapses"]),
+        }
+
+    def deck_order(self, deck, questions, n=None, now=None):
+        """Indexes into `questions` for a session of this deck: due cards first
+        (most overdue first), then cards never reviewed, then the rest by due date"""
+        now = int(now if now is not None else time.time())
+        due, new, later = [], [], []
+        for i, question in enumerate(questions):
+            row = self._row_of.get(card_id(deck, question))
+            if row is None:
+                new.append(i)
+            elif self.rows["due"][row] <= now:
+                due.append((int(self.rows["due"][row]), i))
+            else:
+                later.append((int(self.rows["due"][row]), i))
+        order = [i for _, i in sorted(due)] + new + [i for _, i in sorted(later)]
+        return order[:n] if n is not None else order
+
+def load_store(collection, user_id):
+    user_id = str(user_id)
+    chunks = sorted(collection.find({"user_id": user_id, "chunk": {"$gte": 0}}), key=lambda doc: doc["chunk"])
+    meta = collection.find_one({"_id": f"{user_id}:decks"}) or {}
+    rows = np.concatenate([np.frombuffer(doc["rows"], dtype=STATE_DTYPE) for doc in chunks]) if chunks else None
+    versions = {doc["chunk"]: doc["version"] for doc in chunks}
+    versions["decks"] = meta.get("version", 0)
+    sessions = {doc["chunk"]: doc.get("sessions", []) for doc in chunks}
+    return CardStore(user_id, rows.copy() if rows is not None else None, meta.get("decks"), versions, sessions)
+
+def save_store(collection, store, session_id=None):
+    """Write the chunks touched since loading, each guarded by the version it was loaded at.
+
+    Chunks are separate documents, so a conflict can leave earlier chunks
+    written; they are tagged with session_id so a replay skips their cards.
+    """
+    writes = 0
+    if store.decks_changed:
+        write_versioned(collection, f"{store.user_id}:decks", store.chunk_versions.get("decks", 0),
+                        {"user_id": store.user_id, "chunk": -1, "decks": store.decks})
+        store.chunk_versions["decks"] = store.chunk_versions.get("decks", 0) + 1
+        writes += 1
+    for chunk in sorted(store.dirty):
+        rows = store.rows[chunk * CHUNK_SIZE:min(store.count, (chunk + 1) * CHUNK_SIZE)]
+        version = store.chunk_versions.get(chunk, 0)
+        sessions = store.chunk_sessions.get(chunk, [])
+        if session_id is not None:
+            sessions = (sessions + [session_id])[-CHUNK_SESSIONS:]
+        write_versioned(collection, f"{store.user_id}:{chunk}", version,
+                        {"user_id": store.user_id, "chunk": chunk, "cards": len(rows), "rows": Binary(rows.tobytes()), "sessions": sessions})
+        store.chunk_sessions[chunk] = sessions
+        store.chunk_versions[chunk] = version + 1
+        writes += 1
+    store.dirty.clear()
+    store.decks_changed = False
+    return writes
+
+def write_versioned(collection, doc_id, version, fields):
+    document = {"_id": doc_id, **fields, "version": version + 1, "updated_at": datetime.now()}
+    if version == 0:
+        try:
+            collection.insert_one(document)
+        except DuplicateKeyError:
+            raise ConflictError(doc_id)
+        return
+    if collection.replace_one({"_id": doc_id, "version": version}, document).matched_count == 0:
+        raise ConflictError(doc_id)
+
+def record_session(database, user_id, session_data):
+    """Apply the per-card results of a flashcard session and save them in one batch of chunk writes.
+
+    session_data["cards"] is a list of {"question": ..., "quality": 0-5} or
+    {"question": ..., "correct": bool}; the deck is the session's
+    flashcardName (or material_id / activity). The session is identified by
+    its _id, or by a hash of its content, so recording it again is a no-op.
+    """
+    cards = [card for card in session_data.get("cards") or [] if card.get("question")]
+    if not cards:
+        return None
+    deck = str(session_data.get("flashcardName") or session_data.get("material_id") or session_data.get("activity") or "default")
+    completed = session_data.get("completed_at")
+    now = int(completed.timestamp()) if isinstance(completed, datetime) else int(time.time())
+    collection = database[COLLECTION]
+    session_id = str(session_data.get("_id") or hashlib.sha1(
+        json.dumps([str(user_id), deck, now, cards], sort_keys=True, default=str).encode("utf-8")).hexdigest())
+
+    with span("db_write", collection=COLLECTION, op="chunks") as write_span:
+        for attempt in range(SAVE_ATTEMPTS):
+            store = load_store(collection, user_id)
+            # Cards in chunks an earlier attempt already saved keep that review
+            pending = [card for card in cards if not store.applied(deck, card["question"], session_id)]
+            for card in pending:
+                store.review(deck, card["question"], review_quality(card), now)
+            try:
+                writes = save_store(collection, store, session_id)
+                write_span.set(cards=len(cards), chunk_writes=writes, attempts=attempt + 1)
+                return {"cards": len(cards), "reviewed": len(pending), "chunk_writes": writes}
+            except ConflictError:
+                # A concurrent session for the same user won; replay onto its state
+                if attempt == SAVE_ATTEMPTS - 1:
+                    raise
+
+def main():
+    parser = argparse.ArgumentParser(description="Spaced-repetition state of a user's flashcards")
+    parser.add_argument("command", choices=["due"])
+    parser.add_argument("user_id")
+    parser.add_argument("-n", type=int, default=20)
+    args = parser.parse_args()
+
+    from db import db
+    store = load_store(db.db[COLLECTION], args.user_id)
+    if not len(store):
+        print(f"No flashcard reviews recorded for user {args.user_id}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps([store.describe(row) for row, _ in store.next_due(args.n)], indent=2))
+
+if __name__ == "__main__":
+    main()
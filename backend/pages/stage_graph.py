@@ -0,0 +1,68 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class Stage:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+class StageFailed(Exception):
+    def __init__(self, stage, error):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+class StageGraph:
+    """Runs stages in one process as soon as their dependencies have finished.
+
+    Each stage function receives a dict of the results produced so far and
+    returns its own result, so data is handed between stages in memory.
+    Independent stages (e.g. quiz and flashcards) run concurrently.
+    """
+
+    def __init__(self, stages, max_workers=2):
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_workers = max_workers
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    def run(self, results=None, on_start=None, on_finish=None):
+        results = dict(results or {})
+        remaining = {name: stage for name, stage in self.stages.items() if name not in results}
+        running = {}
+        failure = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while remaining or running:
+                if failure is None:
+                    ready = [s for s in remaining.values() if all(dep in results for dep in s.deps)]
+                    for stage in ready:
+                        del remaining[stage.name]
+                        if on_start:
+                            on_start(stage.name)
+                        # Run in a copy of the caller's context so stages stay inside its trace
+                        running[pool.submit(contextvars.copy_context().run, stage.func, dict(results))] = stage.name
+
+                if not running:
+                    if remaining and failure is None:
+                        raise ValueError(f"Stage graph has a cycle: {sorted(remaining)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        # Let stages already in flight finish, but start nothing new
+                        failure = failure or StageFailed(name, e)
+                        continue
+                    if on_finish:
+                        on_finish(name)
+
+        if failure is not None:
+            raise failure
+        return results
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import threading
+from llm_client import get_client, MODEL
+from quiz_generator import validate_quiz_items
+from flashcard_generator import validate_flashcard_items
+
+# Bump when the prompt changes so cached artifacts from the old prompt are not reused
+PROMPT_VERSION = 1
+
+# separate:      quiz_generator and flashcard_generator each send the context (original behaviour)
+# combined:      one structured request returns both the quiz and the flashcards
+# shared_prefix: two requests whose prompts start with the same system message, sent
+#                back to back with keep_alive so Ollama reuses the context's KV cache
+GENERATION_MODES = ["separate", "combined", "shared_prefix"]
+GENERATION_MODE = os.getenv("GENERATION_MODE", "separate")
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+def shared_prefix(text):
+    # Must be byte-identical across requests for the model server to reuse it
+    return f"""You are an expert education assistant.
+All of your answers are based on the educational content below.
+
+Content:
+{text}"""
+
+QUIZ_TASK = """Generate a quiz with {num_questions} multiple choice questions based on the content.
+For each, provide:
+- The question text
+- Four answer options labeled A, B, C, D
+- The correct answer letter
+
+Respond ONLY in JSON format as a list of dicts. Each dict should have:
+- "question" (str)
+- "options" (dict with keys 'A', 'B', 'C', 'D')
+- "answer" (str, one of 'A', 'B', 'C', 'D')."""
+
+FLASHCARD_TASK = """Generate {num_flashcards} flashcards based on the content.
+Each flashcard should include:
+- A concise question (like a concept, term, or key idea)
+- A brief but informative answer or explanation
+
+Respond ONLY in JSON format as a list of dicts. Each dict should have:
+- "question" (str)
+- "answer" (str)"""
+
+COMBINED_TASK = """Generate study material based on the content: a quiz with {num_questions} multiple choice questions and {num_flashcards} flashcards.
+
+Respond ONLY with a JSON object of the form:
+{{
+  "quiz": [{{"question": str, "options": {{"A": str, "B": str, "C": str, "D": str}}, "answer": "A" | "B" | "C" | "D"}}],
+  "flashcards": [{{"question": str, "answer": str}}]
+}}"""
+
+def extract_json_list(content):
+    json_start = content.find('[')
+    json_end = content.rfind(']') + 1
+    if json_start == -1 or json_end == 0:
+        return None
+    try:
+        return json.loads(content[json_start:json_end])
+    except json.JSONDecodeError:
+        return None
+
+def to_json(items):
+    return json.dumps(items, indent=2, ensure_ascii=False)
+
+def chat(text, task, **kwargs):
+    response = get_client().chat(model=MODEL, keep_alive=KEEP_ALIVE, messages=[
+        {"role": "system", "content": shared_prefix(text)},
+        {"role": "user", "content": task},
+    ], **kwargs)
+    return response['message']['content']
+
+def generate_combined(text, num_questions=10, num_flashcards=10):
+    """One request for both outputs. Returns (quiz_json, flashcards_json)."""
+    content = chat(text, COMBINED_TASK.format(num_questions=num_questions, num_flashcards=num_flashcards), format="json")
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        raise ValueError("Model returned invalid JSON for the combined study set")
+
+    quiz = validate_quiz_items(data.get("quiz") if isinstance(data, dict) else None)
+    flashcards = validate_flashcard_items(data.get("flashcards") if isinstance(data, dict) else None)
+    if not quiz or not flashcards:
+        raise ValueError(f"Combined study set incomplete: {len(quiz)} valid question(s), {len(flashcards)} valid flashcard(s)")
+    return to_json(quiz), to_json(flashcards)
+
+def generate_shared_prefix(text, num_questions=10, num_flashcards=10):
+    """Two requests sharing an identical, kept-alive context prefix. Returns (quiz_json, flashcards_json)."""
+    # Sequential on purpose: the second request can only reuse the prefix
+    # once the first has finished filling the cache.
+    quiz = validate_quiz_items(extract_json_list(chat(text, QUIZ_TASK.format(num_questions=num_questions))))
+    flashcards = validate_flashcard_items(extract_json_list(chat(text, FLASHCARD_TASK.format(num_flashcards=num_flashcards))))
+    if not quiz or not flashcards:
+        raise ValueError(f"Study set incomplete: {len(quiz)} valid question(s), {len(flashcards)} valid flashcard(s)")
+    return to_json(quiz), to_json(flashcards)
+
+def generate_study_set(text, num_questions=10, num_flashcards=10, mode=GENERATION_MODE):
+    if mode == "combined":
+        return generate_combined(text, num_questions, num_flashcards)
+    if mode == "shared_prefix":
+        return generate_shared_prefix(text, num_questions, num_flashcards)
+    raise ValueError(f"generate_study_set does not handle mode '{mode}'")
+
+class SharedStudySet:
+    """Generates the study set once for the quiz and flashcard stages that run side by side.
+
+    Whichever stage asks first pays for the call; the other waits for and reuses
+    it. A stage whose output is already cached never asks at all.
+    """
+
+    def __init__(self, text, num_questions=10, num_flashcards=10, mode=GENERATION_MODE):
+        self.text = text
+        self.num_questions = num_questions
+        self.num_flashcards = num_flashcards
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._done = False
+        self._result = None
+        self._error = None
+
+    def get(self):
+        with self._lock:
+            if not self._done:
+                try:
+                    self._result = generate_study_set(self.text, self.num_questions, self.num_flashcards, self.mode)
+                except Exception as e:
+                    # The other stage fails with the same error instead of paying for the call again
+                    self._error = e
+                self._done = True
+            if self._error is not None:
+                raise self._error
+            return self._result
+
+    def quiz(self):
+        return self.get()[0]
+
+    def flashcards(self):
+        return self.get()[1]
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    mode = "shared_prefix" if "--shared-prefix" in sys.argv else "combined"
+    if len(args) < 2:
+        print("Usage: python study_set_generator.py <context_txt_path> <subject> [num_questions] [num_flashcards] [--shared-prefix]", file=sys.stderr)
+        sys.exit(1)
+
+    context_path, subject = args[0], args[1]
+    num_questions = int(args[2]) if len(args) > 2 else 10
+    num_flashcards = int(args[3]) if len(args) > 3 else 10
+
+    if not os.path.isfile(context_path):
+        print(f"File not found: {context_path}", file=sys.stderr)
+        sys.exit(1)
+    with open(context_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    print(f"Generating {num_questions} questions and {num_flashcards} flashcards ({mode}) using {MODEL}...")
+    try:
+        quiz_json, flashcards_json = generate_study_set(text, num_questions, num_flashcards, mode)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    base_name = os.path.splitext(os.path.basename(context_path))[0].replace('_llama_context', '')
+    for folder, suffix, content in (("generated_quizzes", "quiz", quiz_json), ("generated_flashcards", "flashcards", flashcards_json)):
+        output_dir = os.path.join(folder, subject)
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, f"{base_name}_{suffix}.json")
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        print(f"Saved: {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Per-material passage index used to ground tutor explanations in the source PDF.
+
+Passages are cut from the extracted blocks, embedded, L2-normalized and stored
+as a raw float32 matrix under vector_index/<material_id>/. Searches memory-map
+that file, so opening an index is cheap and the OS page cache is shared by
+every process reading it. Cosine similarity is then one matrix product plus
+argpartition. Large corpora are split into k-means clusters stored
+contiguously; a query only scans the clusters nearest to it.
+
+    python vector_index.py build <material_id> <labeled_json>
+    python vector_index.py search <material_id> "what does a decorator return?"
+"""
+
+import os
+import re
+import sys
+import json
+import zlib
+import argparse
+import threading
+import numpy as np
+from llm_client import get_client, usage
+from context_generator import CONTENT_TYPES, split_oversized
+from artifact_cache import hash_bytes
+import block_store
+from metrics import span
+
+INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_index")
+# Bump when passage cutting or the file layout changes so old indexes are rebuilt
+INDEX_VERSION = 1
+
+# ollama: EMBED_MODEL through the shared LLM client
+# hash:   hashed bag of words computed locally; no model needed, weaker matches
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "ollama")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+EMBED_BATCH = 64
+HASH_DIM = 512
+
+PASSAGE_TOKENS = int(os.getenv("PASSAGE_TOKENS", "200"))
+# Above this many passages the index is clustered; smaller ones are scanned whole
+PARTITION_THRESHOLD = int(os.getenv("VECTOR_PARTITION_THRESHOLD", "20000"))
+DEFAULT_PROBES = 8
+# Rows per block when scoring against centroids, bounds the temporary matrix
+SCORE_BLOCK_ROWS = 8192
+
+WORD = re.compile(r"[a-z0-9_]+")
+
+class HashEmbedder:
+    backend = "hash"
+
+    def __init__(self, dim=HASH_DIM):
+        self.dim = dim
+        self.model = f"hash-{dim}"
+
+    def embed(self, texts):
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for word in WORD.findall(text.lower()):
+                rows.append(row)
+                cols.append(zlib.crc32(word.encode("utf-8")) % self.dim)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (rows, cols), 1.0)
+        return vectors
+
+class OllamaEmbedder:
+    backend = "ollama"
+
+    def __init__(self, model=EMBED_MODEL):
+        self.model = model
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH):
+            response = get_client().embed(model=self.model, input=texts[start:start + EMBED_BATCH])
+            vectors.extend(usage(response, "embeddings"))
+        return np.asarray(vectors, dtype=np.float32)
+
+def get_embedder(backend=None, model=None):
+    backend = backend or EMBED_BACKEND
+    if backend == "hash":
+        return HashEmbedder(int(model.split("-")[1]) if model else HASH_DIM)
+    if backend == "ollama":
+        return OllamaEmbedder(model or EMBED_MODEL)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+def make_passages(blocks, token_budget=PASSAGE_TOKENS):
+    passages = []
+    for block in blocks:
+        if block.get("type") not in CONTENT_TYPES or not block["text"].strip():
+            continue
+        for text in split_oversized(block["text"], token_budget):
+            if text.strip():
+                passages.append({"page": block.get("page"), "text": text.strip()})
+    return passages
+
+def kmeans(vectors, clusters, iterations=10, sample=50000, seed=0):
+    """Spherical k-means (cosine) on a sample; returns unit centroids"""
+    rng = np.random.default_rng(seed)
+    training = vectors if len(vectors) <= sample else vectors[np.sort(rng.choice(len(vectors), sample, replace=False))]
+    centroids = np.array(training[rng.choice(len(training), clusters, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        assignment = assign_clusters(training, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, training)
+        # An empty cluster keeps its old centroid
+        filled = np.bincount(assignment, minlength=clusters) > 0
+        centroids[filled] = normalize(sums[filled])
+    return centroids
+
+def assign_clusters(vectors, centroids):
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + SCORE_BLOCK_ROWS])
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+class VectorIndex:
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.passages = meta["passages"]
+        shape = (meta["count"], meta["dim"])
+        self.vectors = np.memmap(os.path.join(path, meta["vectors_file"]), dtype=np.float32, mode="r", shape=shape) if meta["count"] else np.zeros(shape, np.float32)
+        self.centroids = None
+        if meta.get("centroids_file"):
+            self.centroids = np.fromfile(os.path.join(path, meta["centroids_file"]), dtype=np.float32).reshape(-1, meta["dim"])
+            self.offsets = meta["offsets"]
+        self._embedder = None
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = get_embedder(self.meta["backend"], self.meta["model"])
+        return self._embedder
+
+    @classmethod
+    def write(cls, path, passages, vectors, embedder, digest, partitions=None):
+        """Store normalized vectors; with partitions, rows are reordered so each cluster is one contiguous slice"""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        count, dim = vectors.shape if len(vectors) else (0, 0)
+        if partitions is None:
+            partitions = int(np.sqrt(count)) if count > PARTITION_THRESHOLD else 0
+        meta = {
+            "version": INDEX_VERSION, "digest": digest, "backend": embedder.backend, "model": embedder.model,
+            "count": count, "dim": dim, "vectors_file": f"vectors.{digest[:12]}.f32",
+        }
+        os.makedirs(path, exist_ok=True)
+        if partitions and count > partitions:
+            centroids = kmeans(vectors, partitions)
+            assignment = assign_clusters(vectors, centroids)
+            order = np.argsort(assignment, kind="stable")
+            vectors, passages = vectors[order], [passages[i] for i in order]
+            counts = np.bincount(assignment, minlength=partitions)
+            meta["offsets"] = np.concatenate([[0], np.cumsum(counts)]).tolist()
+            meta["centroids_file"] = f"centroids.{digest[:12]}.f32"
+            centroids.tofile(os.path.join(path, meta["centroids_file"]))
+        vectors.tofile(os.path.join(path, meta["vectors_file"]))
+        meta["passages"] = passages
+
+        # meta.json is replaced last, so readers see either the old index or the new one
+        old = read_meta(path)
+        tmp_path = os.path.join(path, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(path, "meta.json"))
+        if old:
+            for name in (old.get("vectors_file"), old.get("centroids_file")):
+                if name and name not in (meta["vectors_file"], meta.get("centroids_file")):
+                    try:
+                        os.remove(os.path.join(path, name))
+                    except OSError:
+                        pass
+        return cls(path, meta)
+
+    def search(self, queries, k=3, probes=DEFAULT_PROBES):
+        """Top-k passages for each row of `queries`: a list of [(score, passage), ...]"""
+        queries = normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if not self.meta["count"]:
+            return [[] for _ in queries]
+        if self.centroids is None:
+            scores = np.asarray(self.vectors @ queries.T)
+            return [self._hits(scores[:, column], np.arange(len(scores)), k) for column in range(len(queries))]
+
+        results = []
+        nearest = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :probes]
+        for query, clusters in zip(queries, nearest):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in clusters])
+            results.append(self._hits(np.asarray(self.vectors[rows] @ query), rows, k))
+        return results
+
+    def _hits(self, scores, rows, k):
+        return [(float(scores[i]), self.passages[rows[i]]) for i in top_k(scores, k)]
+
+    def search_text(self, texts, k=3, probes=DEFAULT_PROBES):
+        return self.search(self.embedder.embed(list(texts)), k, probes)
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def index_path(material_id):
+    return os.path.join(INDEX_DIR, str(material_id))
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+def load_index(path):
+    """Open an index, reusing the one already open in this process while it is unchanged"""
+    try:
+        mtime = os.path.getmtime(os.path.join(path, "meta.json"))
+    except OSError:
+        return None
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    meta = read_meta(path)
+    if meta is None or meta.get("version") != INDEX_VERSION:
+        return None
+    index = VectorIndex(path, meta)
+    with _loaded_lock:
+        _loaded[path] = (mtime, index)
+    return index
+
+def load_for_material(material_id):
+    return load_index(index_path(material_id)) if material_id else None
+
+def build_for_material(material_id, blocks, embedder=None):
+    """Build (or keep, if the passages and embedder are unchanged) the index of one material"""
+    embedder = embedder or get_embedder()
+    path = index_path(material_id)
+    passages = make_passages(blocks)
+    spec = {"version": INDEX_VERSION, "backend": embedder.backend, "model": embedder.model, "passage_tokens": PASSAGE_TOKENS, "passages": passages}
+    digest = hash_bytes(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    existing = read_meta(path)
+    if existing and existing.get("digest") == digest:
+        return {"passages": len(passages), "rebuilt": False}
+
+    with span("vector_index_build", backend=embedder.backend) as build_span:
+        vectors = embedder.embed([passage["text"] for passage in passages]) if passages else np.zeros((0, 0), np.float32)
+        index = VectorIndex.write(path, passages, vectors, embedder, digest)
+        build_span.set(passages=len(passages), dim=index.meta["dim"], partitioned=index.centroids is not None)
+    return {"passages": len(passages), "rebuilt": True, "partitioned": index.centroids is not None}
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the passage index of a material")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build")
+    build.add_argument("material_id")
+    build.add_argument("labeled_json", help="extracted_text/<subject>/<name>_labeled.json (or .blocks)")
+    search = subparsers.add_parser("search")
+    search.add_argument("material_id")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        blocks = block_store.read_blocks(args.labeled_json, types=CONTENT_TYPES, fields=("text",))
+        print(json.dumps(build_for_material(args.material_id, blocks)))
+        return
+    index = load_for_material(args.material_id)
+    if index is None:
+        print(f"No index for material {args.material_id}", file=sys.stderr)
+        sys.exit(1)
+    for score, passage in index.search_text([args.query], args.k)[0]:
+        print(f"[{score:.3f}] page {passage['page']}: {passage['text'][:200]}")
+
+if __name__ == "__main__":
+    main()
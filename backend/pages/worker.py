@@ -0,0 +1,213 @@
+import os
+import json
+import socket
+import signal
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from job_queue import MongoJobQueue, InMemoryJobQueue, DEFAULT_VISIBILITY_TIMEOUT
+import metrics
+
+# How many jobs of each type may run at once in one worker process. PDF
+# pipelines saturate the CPU (OCR) and the local model, so they run one at
+# a time; tutor requests are short and mostly wait on the model.
+DEFAULT_LIMITS = {
+    "pipeline": int(os.getenv("WORKER_PIPELINE_CONCURRENCY", "1")),
+    "tutor": int(os.getenv("WORKER_TUTOR_CONCURRENCY", "4")),
+    "question_bank": int(os.getenv("WORKER_QUESTION_BANK_CONCURRENCY", "1")),
+    "material_followups": int(os.getenv("WORKER_FOLLOWUP_CONCURRENCY", "1")),
+    "bank_answers": int(os.getenv("WORKER_BANK_ANSWERS_CONCURRENCY", "2")),
+}
+
+class JobFailed(Exception):
+    """A job that failed in a way retrying will not fix"""
+
+def pipeline_runner():
+    # Imported lazily so the tutor-only path never loads fitz/PIL
+    from auto_pipeline import PipelineRunner
+    runner = getattr(pipeline_runner, "runner", None)
+    if runner is None:
+        runner = pipeline_runner.runner = PipelineRunner()
+        # Follow-ups of pipelines this worker runs go back on its own queue
+        runner.followup_queue = getattr(pipeline_runner, "followup_queue", None)
+    return runner
+
+def run_pipeline_job(payload):
+    runner = pipeline_runner()
+    result = runner.execute_pipeline(payload["pdf_path"], payload["material_id"])
+    if result.get("status") != "success":
+        # The pipeline already retried transient errors and marked the material failed
+        raise JobFailed(result.get("message", "Pipeline failed"))
+    return result
+
+def run_tutor_job(payload):
+    import ai_tutor
+    output_path = ai_tutor.run_tutor_session(
+        payload["material_id"], payload["answers"], payload["attempt_id"], payload["user_id"],
+        payload.get("bank_question_ids"),
+    )
+    return {"output_path": output_path}
+
+def run_question_bank_job(payload):
+    import question_bank
+    from db import db
+    return question_bank.fill_bank(db.db, payload["material_id"], size=payload.get("size", question_bank.BANK_SIZE))
+
+def run_bank_answers_job(payload):
+    import question_bank
+    from db import db
+    counted = question_bank.record_answers(db.db, payload["material_id"], payload["question_ids"], payload.get("answers"))
+    return {"recorded": counted}
+
+def run_followups_job(payload):
+    return pipeline_runner().run_followups(**payload)
+
+DEFAULT_HANDLERS = {
+    "pipeline": run_pipeline_job,
+    "tutor": run_tutor_job,
+    "question_bank": run_question_bank_job,
+    "material_followups": run_followups_job,
+    "bank_answers": run_bank_answers_job,
+}
+
+class WorkerService:
+    def __init__(self, queue, handlers=None, limits=None, poll_interval=1.0,
+                 visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, retry_delay=30):
+        self.queue = queue
+        self.handlers = dict(handlers or DEFAULT_HANDLERS)
+        self.limits = {job_type: (limits or DEFAULT_LIMITS).get(job_type, 1) for job_type in self.handlers}
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {job_type: 0 for job_type in self.handlers}
+        self.active_jobs = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+    def log(self, message):
+        print(f"[worker {self.worker_id}] {message}", flush=True)
+
+    def free_job_types(self):
+        with self._lock:
+            return [job_type for job_type, limit in self.limits.items() if self.running[job_type] < limit]
+
+    def run_job(self, job):
+        job_type = job["type"]
+        if job.get("started_at") and job.get("available_at"):
+            metrics.observe("job_queue_wait_seconds", (job["started_at"] - job["available_at"]).total_seconds(), type=job_type)
+        try:
+            self.log(f"Running {job_type} job {job['_id']} (attempt {job['attempts']})")
+            with metrics.span("job", type=job_type) as job_span:
+                job_span.set(job_id=str(job["_id"]), attempt=job["attempts"])
+                result = self.handlers[job_type](job["payload"])
+            if self.queue.complete(job["_id"], self.worker_id, result):
+                self.log(f"Completed {job_type} job {job['_id']}")
+            else:
+                self.log(f"Lost the lease on {job_type} job {job['_id']}; another worker owns it, result dropped")
+        except Exception as e:
+            retry = not isinstance(e, JobFailed) and job["attempts"] < job.get("max_attempts", 1)
+            if self.queue.fail(job["_id"], self.worker_id, e, retry_delay=self.retry_delay * job["attempts"] if retry else None):
+                self.log(f"{job_type} job {job['_id']} failed ({'will retry' if retry else 'giving up'}): {e}")
+            else:
+                self.log(f"Lost the lease on {job_type} job {job['_id']}; another worker owns it, failure dropped: {e}")
+        finally:
+            with self._lock:
+                self.running[job_type] -= 1
+                self.active_jobs.discard(job["_id"])
+            self._wakeup.set()
+
+    def heartbeat_loop(self):
+        # Keep locks on long jobs (OCR of a big PDF) from expiring mid-run
+        while not self._stop.wait(self.visibility_timeout / 3):
+            # An idle worker would otherwise hold its last span events until exit
+            if metrics.events is not None:
+                metrics.events.flush()
+            with self._lock:
+                job_ids = list(self.active_jobs)
+            for job_id in job_ids:
+                try:
+                    self.queue.heartbeat(job_id, self.worker_id, self.visibility_timeout)
+                except Exception as e:
+                    self.log(f"Heartbeat failed for job {job_id}: {e}")
+
+    def claim_next(self):
+        job_types = self.free_job_types()
+        if not job_types:
+            return None
+        job = self.queue.claim(job_types, self.worker_id, self.visibility_timeout)
+        if job and job["attempts"] > job.get("max_attempts", 1):
+            # A job whose lock lapsed too many times (e.g. it crashes the worker)
+            self.queue.fail(job["_id"], self.worker_id, job.get("error") or "Exceeded max attempts")
+            return None
+        return job
+
+    def run(self, stop_when_idle=False):
+        self.log(f"Started with limits {self.limits}")
+        threading.Thread(target=self.heartbeat_loop, daemon=True).start()
+        with ThreadPoolExecutor(max_workers=sum(self.limits.values())) as pool:
+            while not self._stop.is_set():
+                job = self.claim_next()
+                if job is None:
+                    with self._lock:
+                        idle = not self.active_jobs
+                    if stop_when_idle and idle:
+                        break
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                with self._lock:
+                    self.running[job["type"]] += 1
+                    self.active_jobs.add(job["_id"])
+                pool.submit(self.run_job, job)
+        self._stop.set()
+        self.log("Stopped")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+def make_queue(backend):
+    if backend == "memory":
+        return InMemoryJobQueue()
+    from db import db
+    db.ensure_indexes()
+    queue = MongoJobQueue(db.db["jobs"])
+    queue.ensure_indexes()
+    return queue
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived worker for PDF pipelines and AI tutor requests")
+    parser.add_argument("--backend", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--pipeline-concurrency", type=int, default=DEFAULT_LIMITS["pipeline"])
+    parser.add_argument("--tutor-concurrency", type=int, default=DEFAULT_LIMITS["tutor"])
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is drained")
+    parser.add_argument("--status", action="store_true", help="Print job counts and exit")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("WORKER_METRICS_PORT", "0")),
+                        help="Serve Prometheus metrics on this port (0 = off)")
+    args = parser.parse_args()
+
+    queue = make_queue(args.backend)
+    pipeline_runner.followup_queue = queue
+    if args.status:
+        counts = {f"{job_type}:{status}": n for (job_type, status), n in queue.counts().items()}
+        print(json.dumps(counts, indent=2))
+        return
+
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print(f"Metrics on http://localhost:{args.metrics_port}/metrics", flush=True)
+
+    service = WorkerService(
+        queue,
+        limits={**DEFAULT_LIMITS, "pipeline": args.pipeline_concurrency, "tutor": args.tutor_concurrency},
+        poll_interval=args.poll_interval,
+    )
+    signal.signal(signal.SIGINT, lambda *_: service.stop())
+    signal.signal(signal.SIGTERM, lambda *_: service.stop())
+    service.run(stop_when_idle=args.once)
+
+if __name__ == "__main__":
+    main()
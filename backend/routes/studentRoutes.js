@@ -3,6 +3,9 @@ const router = express.Router();
 const fs = require('fs');
 const path = require('path');
 const Material = require('../models/Material');
+const { drawQuiz } = require('../services/questionBankService');
+
+const QUIZ_LENGTH = 10;
 
 router.get('/materials/:subject', async (req, res) => {
   try {
@@ -62,4 +65,26 @@ router.get('/quizzes/:subject/:quizName', async (req, res) => {
     }
 });
 
+// A fresh quiz per attempt, drawn from the material's question bank. The
+// attempt keeps bank_question_ids so its answers can be traced to the bank.
+router.get('/quizzes/:subject/:quizName/draw', async (req, res) => {
+    try {
+        const { quizName } = req.params;
+        const material = await Material.findOne({ originalName: quizName, status: 'completed' });
+        if (!material) {
+            return res.status(404).json({ error: 'Quiz not found' });
+        }
+        try {
+            const drawn = await drawQuiz(material, QUIZ_LENGTH);
+            res.status(200).json(drawn);
+        } catch (drawError) {
+            // The material's own quiz is always servable
+            console.error(`Quiz draw failed for ${quizName}:`, drawError);
+            res.status(200).json({ material_id: material._id.toString(), questions: material.quiz_content, bank_question_ids: [] });
+        }
+    } catch (error) {
+        res.status(500).json({ error: 'Failed to fetch quiz data' });
+    }
+});
+
 module.exports = router;
\ No newline at end of file
@@ -3,15 +3,16 @@ const router = express.Router();
 const fs = require('fs');
 const path = require('path');
 const { spawn } = require('child_process');
-const { PYTHON_PATH } = require('../config');
+const { PYTHON_PATH, PYTHON_WORKER_MODE } = require('../config');
 const Material = require('../models/Material');
+const { enqueueJob } = require('../services/jobQueue');
 
 const USER_ANSWERS_DIR = path.join(__dirname, '../user_answers_temp');
 const TUTOR_EXPLANATIONS_DIR = path.join(__dirname, '../pages/tutor_explanations');
 
 // This route triggers a new AI Tutor session. It remains unchanged.
 router.post('/trigger', async (req, res) => {
-  const { quizName, userAnswers, subject, userId } = req.body;
+  const { quizName, userAnswers, subject, userId, bankQuestionIds } = req.body;
 
   if (!quizName || !userAnswers || !subject || !userId) {
     return res.status(400).json({ error: 'Missing required data, including userId' });
@@ -28,9 +29,21 @@ router.post('/trigger', async (req, res) => {
     const userExplanationDir = path.join(TUTOR_EXPLANATIONS_DIR, userId);
     await fs.promises.mkdir(userExplanationDir, { recursive: true });
 
+    if (PYTHON_WORKER_MODE === 'queue') {
+      // The worker reads the answers from the job itself, so no temp file is needed
+      await enqueueJob('tutor', {
+        material_id: material._id.toString(),
+        answers: userAnswers,
+        attempt_id: attemptId,
+        user_id: userId,
+        bank_question_ids: bankQuestionIds || [],
+      });
+      return res.status(202).json({ message: 'AI Tutor processing initiated.', attemptId });
+    }
+
     const tempAnswersPath = path.join(USER_ANSWERS_DIR, `${material._id}_${attemptId}_answers.json`);
     await fs.promises.mkdir(USER_ANSWERS_DIR, { recursive: true });
-    await fs.promises.writeFile(tempAnswersPath, JSON.stringify({ quizName, answers: userAnswers }, null, 2));
+    await fs.promises.writeFile(tempAnswersPath, JSON.stringify({ quizName, answers: userAnswers, bank_question_ids: bankQuestionIds || [] }, null, 2));
     
     const pythonScriptPath = path.resolve(__dirname, '../pages/ai_tutor.py');
     
@@ -86,6 +99,56 @@ router.get('/explanations/:userId/:quizName/:attemptId', async (req, res) => {
     }
 });
 
+// Returns the explanations generated so far for an attempt. ai_tutor.py appends each
+// explanation to an .ndjson file as soon as it is ready and writes the final .json last.
+router.get('/explanations/:userId/:quizName/:attemptId/partial', async (req, res) => {
+    const { userId, quizName, attemptId } = req.params;
+    try {
+        const material = await Material.findOne({ originalName: quizName }).sort({ createdAt: -1 });
+        if (!material) {
+            return res.status(404).json({ error: 'Material not found.' });
+        }
+
+        const baseName = path.parse(material.filename).name;
+        const basePath = path.join(TUTOR_EXPLANATIONS_DIR, userId, `${baseName}_${attemptId}_tutor_explanations`);
+
+        const readComplete = async () => JSON.parse(await fs.promises.readFile(`${basePath}.json`, 'utf-8'));
+        try {
+            return res.status(200).json({ complete: true, explanations: await readComplete() });
+        } catch (error) {
+            if (error.code !== 'ENOENT') throw error;
+        }
+
+        try {
+            const data = await fs.promises.readFile(`${basePath}.ndjson`, 'utf-8');
+            const explanations = [];
+            for (const line of data.split('\n')) {
+                if (!line.trim()) continue;
+                try {
+                    explanations.push(JSON.parse(line));
+                } catch (parseError) {
+                    // A line still being appended is cut short; it is picked up on the next poll
+                }
+            }
+            explanations.sort((a, b) => a.index - b.index);
+            return res.status(200).json({ complete: false, explanations });
+        } catch (error) {
+            if (error.code !== 'ENOENT') throw error;
+        }
+
+        // The .ndjson file is removed right after the .json is written, so check once more
+        try {
+            return res.status(200).json({ complete: true, explanations: await readComplete() });
+        } catch (error) {
+            if (error.code !== 'ENOENT') throw error;
+            return res.status(404).json({ error: 'Explanations not found yet. Please wait.' });
+        }
+    } catch (error) {
+        console.error('Error fetching partial explanations:', error);
+        res.status(500).json({ error: 'Failed to fetch explanations.' });
+    }
+});
+
 // --- NEW ROUTES FOR HISTORY PAGE ---
 
 // ROUTE 1: Gets a list of all explanation sessions for a given user.
@@ -1,9 +1,17 @@
 const path = require('path');
 const { spawn } = require('child_process');
-const { PYTHON_PATH } = require('../config');
+const { PYTHON_PATH, PYTHON_WORKER_MODE } = require('../config');
+const { enqueueJob } = require('./jobQueue');
 
 exports.processNewPDF = (filePath, subject, materialId) => {
   const absPath = path.resolve(filePath);
+
+  if (PYTHON_WORKER_MODE === 'queue') {
+    enqueueJob('pipeline', { pdf_path: absPath, material_id: materialId.toString() })
+      .then((jobId) => console.log(`Queued pipeline job ${jobId} for material ${materialId}`))
+      .catch((err) => console.error('Failed to queue pipeline job:', err));
+    return;
+  }
   
   const scriptPath = path.resolve(__dirname, '../pages/auto_pipeline.py');
   
@@ -0,0 +1,28 @@
+const mongoose = require('mongoose');
+
+// Must match the priorities in pages/job_queue.py (lower runs first)
+const PRIORITIES = {
+  tutor: 0,
+  pipeline: 10,
+  bank_answers: 15,
+};
+
+/**
+ * Adds a job to the shared `jobs` collection consumed by pages/worker.py.
+ */
+exports.enqueueJob = async (type, payload, { priority, maxAttempts = 3 } = {}) => {
+  const now = new Date();
+  const result = await mongoose.connection.collection('jobs').insertOne({
+    type,
+    payload,
+    priority: priority ?? PRIORITIES[type] ?? 5,
+    status: 'queued',
+    attempts: 0,
+    max_attempts: maxAttempts,
+    available_at: now,
+    locked_until: null,
+    worker_id: null,
+    created_at: now,
+  });
+  return result.insertedId;
+};
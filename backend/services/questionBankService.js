@@ -0,0 +1,133 @@
+const mongoose = require('mongoose');
+const { PYTHON_WORKER_MODE } = require('../config');
+const { enqueueJob } = require('./jobQueue');
+
+// Must match pages/question_bank.py, which fills the bank this draws from
+const PRIOR_MISS_RATE = 0.3;
+const PRIOR_ATTEMPTS = 4;
+const BAND_NAMES = ['easy', 'medium', 'hard'];
+const BAND_EDGES = [0.25, 0.5];
+const QUIZ_MIX = { easy: 0.3, medium: 0.4, hard: 0.3 };
+const POOL_TTL_MS = parseInt(process.env.QUESTION_BANK_TTL || '60', 10) * 1000;
+
+// materialId -> { loadedAt, questions }; answers recorded here update it in place
+const pools = new Map();
+
+const bankCollection = () => mongoose.connection.collection('question_bank');
+
+const loadPool = async (materialId) => {
+  const cached = pools.get(materialId);
+  if (cached && Date.now() - cached.loadedAt < POOL_TTL_MS) {
+    return cached.questions;
+  }
+  const questions = await bankCollection()
+    .find({ material_id: materialId }, { projection: { question: 1, options: 1, answer: 1, attempts: 1, misses: 1 } })
+    .sort({ _id: 1 })
+    .toArray();
+  pools.set(materialId, { loadedAt: Date.now(), questions });
+  return questions;
+};
+
+// Miss rate smoothed towards the prior, so one unlucky attempt does not make a question "hard"
+const difficulty = (q) => ((q.misses || 0) + PRIOR_MISS_RATE * PRIOR_ATTEMPTS) / ((q.attempts || 0) + PRIOR_ATTEMPTS);
+const bandOf = (q) => BAND_EDGES.filter((edge) => difficulty(q) >= edge).length;
+
+// Questions per band following QUIZ_MIX, moving any shortfall to bands that have questions left
+const bandQuotas = (n, available) => {
+  const wanted = BAND_NAMES.map((name) => QUIZ_MIX[name] * n);
+  let quotas = wanted.map(Math.floor);
+  const short = n - quotas.reduce((a, b) => a + b, 0);
+  [...BAND_NAMES.keys()]
+    .sort((a, b) => (wanted[b] - quotas[b]) - (wanted[a] - quotas[a]))
+    .slice(0, short)
+    .forEach((band) => { quotas[band] += 1; });
+  quotas = quotas.map((q, band) => Math.min(q, available[band]));
+  const target = Math.min(n, available.reduce((a, b) => a + b, 0));
+  while (quotas.reduce((a, b) => a + b, 0) < target) {
+    let best = 0;
+    for (let band = 1; band < BAND_NAMES.length; band++) {
+      if (available[band] - quotas[band] > available[best] - quotas[best]) best = band;
+    }
+    quotas[best] += 1;
+  }
+  return quotas;
+};
+
+// Weighted draw without replacement; less-answered questions weigh more until their statistics settle
+const weightedSample = (questions, count) => {
+  const remaining = [...questions];
+  const chosen = [];
+  while (chosen.length < count && remaining.length) {
+    const weights = remaining.map((q) => 1 / Math.sqrt(1 + (q.attempts || 0)));
+    let r = Math.random() * weights.reduce((a, b) => a + b, 0);
+    let i = 0;
+    while (i < remaining.length - 1 && r >= weights[i]) {
+      r -= weights[i];
+      i += 1;
+    }
+    chosen.push(remaining.splice(i, 1)[0]);
+  }
+  return chosen;
+};
+
+const shuffle = (items) => {
+  for (let i = items.length - 1; i > 0; i--) {
+    const j = Math.floor(Math.random() * (i + 1));
+    [items[i], items[j]] = [items[j], items[i]];
+  }
+  return items;
+};
+
+/**
+ * One attempt's quiz: { material_id, questions, bank_question_ids }, where
+ * bank_question_ids[i] is the bank id of questions[i]. A material without a
+ * bank yet gets its own quiz and no ids.
+ */
+exports.drawQuiz = async (material, count) => {
+  const materialId = material._id.toString();
+  const pool = await loadPool(materialId);
+  if (!pool.length) {
+    return { material_id: materialId, questions: material.quiz_content, bank_question_ids: [] };
+  }
+  const byBand = BAND_NAMES.map(() => []);
+  pool.forEach((q) => byBand[bandOf(q)].push(q));
+  const quotas = bandQuotas(count, byBand.map((band) => band.length));
+  const drawn = shuffle(byBand.flatMap((band, i) => weightedSample(band, quotas[i])));
+  return {
+    material_id: materialId,
+    questions: drawn.map((q) => ({ question: q.question, options: q.options, answer: q.answer, difficulty: BAND_NAMES[bandOf(q)] })),
+    bank_question_ids: drawn.map((q) => q._id),
+  };
+};
+
+/**
+ * Counts an attempt's answers against the bank questions it was drawn from.
+ * With the worker running this is a bank_answers job; otherwise the two
+ * counter updates are made here.
+ */
+exports.recordAnswers = async ({ material_id: materialId, bank_question_ids: questionIds, answers }) => {
+  if (PYTHON_WORKER_MODE === 'queue') {
+    return enqueueJob('bank_answers', { material_id: materialId, question_ids: questionIds, answers });
+  }
+  const seen = [];
+  const missed = [];
+  for (const answer of answers || []) {
+    const id = questionIds[answer.questionIndex];
+    if (id === undefined) continue;
+    seen.push(id);
+    if (!answer.isCorrect) missed.push(id);
+  }
+  if (!seen.length) return null;
+  await bankCollection().updateMany({ _id: { $in: seen } }, { $inc: { attempts: 1 } });
+  if (missed.length) {
+    await bankCollection().updateMany({ _id: { $in: missed } }, { $inc: { misses: 1 } });
+  }
+  const cached = pools.get(materialId);
+  if (cached) {
+    for (const q of cached.questions) {
+      if (seen.includes(q._id)) q.attempts = (q.attempts || 0) + 1;
+      if (missed.includes(q._id)) q.misses = (q.misses || 0) + 1;
+    }
+  }
+  return null;
+};
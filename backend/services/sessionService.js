@@ -3,6 +3,7 @@ const fs = require('fs');
 const { promisify } = require('util');
 const readFile = promisify(fs.readFile);
 const readdir = promisify(fs.readdir);
+const { recordAnswers } = require('./questionBankService');
 
 const userAnswersBaseDir = path.join(__dirname, '../user_answers');
 const flashcardSessionsBaseDir = path.join(__dirname, '../flashcard_sessions');
@@ -67,6 +68,10 @@ exports.saveUserAnswers = (data) => {
   
   const payload = { userId, pdfName, timestamp: (timestamp || new Date().toISOString()), ...rest };
   fs.writeFileSync(filePath, JSON.stringify(payload, null, 2));
+  // A quiz drawn from the question bank feeds its misses back into the bank's difficulty statistics
+  if (payload.bank_question_ids?.length && payload.answers?.length) {
+    recordAnswers(payload).catch((err) => console.error('Failed to record question bank answers:', err));
+  }
   return { success: true };
 };
 
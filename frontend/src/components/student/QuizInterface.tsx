@@ -17,6 +17,12 @@ interface QuizQuestion {
   answer: string;
 }
 
+interface DrawnQuiz {
+  material_id: string;
+  questions: QuizQuestion[];
+  bank_question_ids: string[];
+}
+
 interface QuizCard {
   title: string;
   description: string;
@@ -57,6 +63,9 @@ const QuizInterface: React.FC = () => {
   const [availableQuizzes, setAvailableQuizzes] = useState<string[]>([]);
   const [questions, setQuestions] = useState<QuizQuestion[]>([]);
   const [currentQuiz, setCurrentQuiz] = useState<string | null>(null);
+  // Bank ids of the drawn questions, in order; empty when the material has no bank yet
+  const [bankQuestionIds, setBankQuestionIds] = useState<string[]>([]);
+  const [materialId, setMaterialId] = useState<string | null>(null);
   const [currentQuestion, setCurrentQuestion] = useState(0);
   const [userAnswers, setUserAnswers] = useState<UserAnswer[]>([]);
   const [selectedOption, setSelectedOption] = useState<string | null>(null);
@@ -104,13 +113,15 @@ const QuizInterface: React.FC = () => {
     setLoading(true); setError(null);
     try {
       const encoded = encodeURIComponent(quizName);
-      const res = await fetch(`http://localhost:3001/api/student/quizzes/${folder}/${encoded}`);
+      const res = await fetch(`http://localhost:3001/api/student/quizzes/${folder}/${encoded}/draw`);
       if (!res.ok) {
         const { error, details } = await res.json();
         throw new Error(details || error || 'Failed to fetch quiz');
       }
-      const data: QuizQuestion[] = await res.json();
-      setQuestions(data);
+      const data: DrawnQuiz = await res.json();
+      setQuestions(data.questions);
+      setBankQuestionIds(data.bank_question_ids || []);
+      setMaterialId(data.material_id);
       setCurrentQuiz(quizName);
       setCurrentQuestion(0);
       setUserAnswers([]);
@@ -157,6 +168,7 @@ const QuizInterface: React.FC = () => {
           quizName: currentQuiz,
           userAnswers: userAnswers,
           subject: currentCategoryFolder,
+          bankQuestionIds: bankQuestionIds,
           userId: user.id // Send the correct user ID
         }),
       });
@@ -175,19 +187,24 @@ const QuizInterface: React.FC = () => {
       
       setCurrentAttemptId(attemptId);
 
-      const pollInterval = 5000;
+      // Poll the partial endpoint so explanations appear as soon as each one is generated
+      const pollInterval = 2000;
       const pollTimeout = 180000;
 
       const pollId = setInterval(async () => {
         try {
-          const res = await fetch(`http://localhost:3001/api/tutor/explanations/${user.id}/${encodeURIComponent(currentQuiz)}/${attemptId}`);
+          const res = await fetch(`http://localhost:3001/api/tutor/explanations/${user.id}/${encodeURIComponent(currentQuiz)}/${attemptId}/partial`);
           if (res.ok) {
-            const explanations = await res.json();
-            setTutorExplanations(explanations);
-            setShowTutorExplanations(true);
-            setTutorLoading(false);
-            clearInterval(pollId);
-            clearTimeout(timeoutId);
+            const { complete, explanations } = await res.json();
+            if (explanations.length > 0) {
+              setTutorExplanations(explanations);
+              setShowTutorExplanations(true);
+            }
+            if (complete) {
+              setTutorLoading(false);
+              clearInterval(pollId);
+              clearTimeout(timeoutId);
+            }
           }
         } catch (pollError) {
           // Continue polling
@@ -228,6 +245,8 @@ const QuizInterface: React.FC = () => {
     }
     setQuestions([]);
     setCurrentQuiz(null);
+    setBankQuestionIds([]);
+    setMaterialId(null);
     setCurrentQuestion(0);
     setUserAnswers([]);
     setSelectedOption(null);
@@ -292,7 +311,11 @@ const QuizInterface: React.FC = () => {
         category: categories.find(c => c.title === selectedCategory)?.folder || 'mixed',
         score: percentage,
         correctAnswers: correctAnswers,
-        totalQuestions: totalQuestions
+        totalQuestions: totalQuestions,
+        // Stored on the attempt so its answers can be traced back to the bank
+        material_id: materialId || undefined,
+        bank_question_ids: bankQuestionIds,
+        answers: answers
       });
     }
     setShowResults(true);
@@ -635,7 +658,8 @@ const QuizInterface: React.FC = () => {
                 </div>
               )}
 
-              {!tutorLoading && !tutorError && tutorExplanations.length > 0 && (
+              {/* Explanations stream in, so show the ones that are ready while the rest generate */}
+              {!tutorError && tutorExplanations.length > 0 && (
                 <div className="space-y-6 text-left">
                   {tutorExplanations.map((explanation, index) => (
                     <Card key={index} className="border-l-4 border-yellow-500">
@@ -10,6 +10,10 @@ export interface StudySessionData {
   totalQuestions?: number;
   cardsReviewed?: number;
   totalCards?: number;
+  // Quiz attempts drawn from a question bank
+  material_id?: string;
+  bank_question_ids?: string[];
+  answers?: { questionIndex: number; isCorrect: boolean }[];
 }
 
 export const useStudySession = () => {